@@ -0,0 +1,372 @@
+"""Benchmark suite for eggnog_library and the main.py stages on synthetic eggNOG data.
+
+Generates members/annotations/taxid info files shaped like an eggNOG 5 taxonomic
+level at a configurable scale, times the library functions and every main.py
+stage on them and writes the timings as JSON, so runs can be compared between
+changes and scales.
+
+Usage:
+    python benchmark.py --scale small
+    python benchmark.py --ogs 200000 --species 1000 --proteins-per-species 2.0
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import eggnog_library as eggnog
+
+# number of OGs, species and mean proteins per species and OG for each preset;
+# "metazoa" is about the size of the 33208 level, "root" uses all 5090 eggNOG 5 organisms
+SCALES = {
+    "tiny": {"ogs": 2000, "species": 40, "proteins_per_species": 1.5},
+    "small": {"ogs": 20000, "species": 161, "proteins_per_species": 1.5},
+    "metazoa": {"ogs": 60000, "species": 161, "proteins_per_species": 1.8},
+    "large": {"ogs": 200000, "species": 1000, "proteins_per_species": 1.5},
+    "root": {"ogs": 500000, "species": 5090, "proteins_per_species": 1.3},
+}
+
+# species main.py asks for, with their real taxids and lineages
+NAMED_SPECIES = {
+    9606: ("Homo sapiens", "Primates", 9443),
+    9598: ("Pan troglodytes", "Primates", 9443),
+    9544: ("Macaca mulatta", "Primates", 9443),
+    10090: ("Mus musculus", "Rodentia", 9989),
+    10116: ("Rattus norvegicus", "Rodentia", 9989),
+    9031: ("Gallus gallus", "Galliformes", 8976),
+    7955: ("Danio rerio", "Cypriniformes", 7952),
+    31033: ("Takifugu rubripes", "Tetraodontiformes", 31022),
+}
+CATEGORY_LETTERS = "JAKLBDYVTMNZWUOCGEFHIPQRS"
+
+
+def generate_dataset(
+    directory: Path,
+    ogs: int,
+    species: int,
+    proteins_per_species: float,
+    level: int = 33208,
+    seed: int = 0,
+) -> dict:
+    """
+    Write synthetic eggNOG files into directory/data, in the layout of runall.sh.
+
+    OG sizes follow the heavy-tailed shape of the real levels: most OGs contain a
+    few species, a minority is nearly universal. Every species contributes a
+    geometric number of proteins (mean proteins_per_species) to an OG it is in.
+
+    Args:
+        directory (Path): Benchmark working directory.
+        ogs (int): Number of orthologous groups.
+        species (int): Number of species (at least the 8 species main.py uses).
+        proteins_per_species (float): Mean proteins per species and OG (>= 1).
+        level (int): Taxonomic level written to the files. Defaults to 33208.
+        seed (int): Random seed. Defaults to 0.
+
+    Returns:
+        dict: Row and protein counts of the generated files.
+    """
+    rng = np.random.default_rng(seed)
+    data = directory / "data"
+    data.mkdir(parents=True, exist_ok=True)
+
+    # taxonomy: the named species plus synthetic species spread over 20 orders
+    taxids = list(NAMED_SPECIES)
+    extra = species - len(taxids)
+    if extra < 0:
+        raise ValueError(f"species must be at least {len(taxids)}, got {species}")
+    taxids += list(range(2_000_000, 2_000_000 + extra))
+    with open(data / "e5.taxid_info.tsv", "w") as f:
+        f.write("# Taxid\tSci.Name\tRank\tNamed Lineage\tTaxid Lineage\n")
+        for i, taxid in enumerate(taxids):
+            if taxid in NAMED_SPECIES:
+                name, order, order_id = NAMED_SPECIES[taxid]
+            else:
+                name = f"Synthetica species{i}"
+                order, order_id = f"Synthetic order {i % 20}", 1_900_000 + i % 20
+            f.write(
+                f"{taxid}\t{name}\tspecies\t"
+                f"root,cellular organisms,Eukaryota,Metazoa,{order},{name}\t"
+                f"1,131567,2759,33208,{order_id},{taxid}\n"
+            )
+
+    # species per OG: mixture of small, medium and near-universal OGs
+    kind = rng.choice(3, size=ogs, p=[0.6, 0.3, 0.1])
+    sizes = np.where(
+        kind == 0,
+        rng.integers(2, max(3, species // 20), size=ogs),
+        np.where(
+            kind == 1,
+            rng.integers(2, species + 1, size=ogs),
+            rng.integers(int(species * 0.95), species + 1, size=ogs),
+        ),
+    )
+    sizes = np.clip(sizes, 2, species)
+    # popular species (low index, incl. the named ones) occur in more OGs
+    weights = 1.0 / np.arange(1, species + 1) ** 0.3
+    weights /= weights.sum()
+    taxid_array = np.asarray(taxids)
+
+    n_proteins = 0
+    og_ids = [f"S{i:07X}" for i in range(ogs)]
+    with open(data / f"{level}_members.tsv", "w") as f:
+        for og_id, size in zip(og_ids, sizes):
+            members = np.sort(
+                taxid_array[rng.choice(species, size=size, replace=False, p=weights)]
+            )
+            copies = rng.geometric(1.0 / proteins_per_species, size=size)
+            proteins = [
+                f"{taxid}.P{og_id}_{j}"
+                for taxid, n in zip(members.tolist(), copies.tolist())
+                for j in range(n)
+            ]
+            n_proteins += len(proteins)
+            f.write(
+                f"{level}\t{og_id}\t{len(proteins)}\t{size}\t{','.join(proteins)}\t"
+                f"{','.join(map(str, members.tolist()))}\n"
+            )
+
+    with open(data / f"{level}_annotations.tsv", "w") as f:
+        for og_id in og_ids:
+            n = rng.choice([1, 1, 1, 2, 3])
+            letters = "".join(rng.choice(list(CATEGORY_LETTERS), size=n, replace=False))
+            f.write(f"{level}\t{og_id}\t{letters}\tsynthetic function of {og_id}\n")
+
+    with open(data / "eggnog4.functional_categories.txt", "w") as f:
+        f.write("SYNTHETIC CATEGORIES\n")
+        for letter in CATEGORY_LETTERS:
+            f.write(f" [{letter}] Category {letter} \n")
+
+    return {"ogs": ogs, "species": species, "proteins": n_proteins}
+
+
+def time_call(function, repeat: int):
+    """Runs function repeat times; returns the wall times and the last result."""
+    runs = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        runs.append(time.perf_counter() - start)
+    return runs, result
+
+
+def _rows(value):
+    if isinstance(value, (dict, tuple)):
+        return None
+    if isinstance(value, eggnog.PresenceMatrix):
+        return len(value.og_ids)
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def benchmark_library(repeat: int) -> list:
+    """Times the library functions on the tables in ./data."""
+    df_members = eggnog.dataframe_setup_members()
+    df_species = eggnog.dataframe_setup_taxid_info()
+    taxonomy = eggnog.build_taxonomy_index(df_species)
+    primates = [str(t) for t in taxonomy.clade_species(eggnog.PRIMATES_TAXID)]
+    column = "species_taxid_containing_protein"
+    rows_in = len(df_members)
+
+    cases = {
+        "dataframe_setup_members": eggnog.dataframe_setup_members,
+        "dataframe_setup_annotations": eggnog.dataframe_setup_annotations,
+        "dataframe_setup_taxid_info": eggnog.dataframe_setup_taxid_info,
+        "build_taxonomy_index": lambda: eggnog.build_taxonomy_index(df_species),
+        "build_token_index": lambda: eggnog.build_token_index(df_members[column]),
+        "filter_by_ids": lambda: eggnog.filter_by_ids(
+            df_members, column, ["9606", "9598"], ["10090"]
+        ),
+        "filter_allowed_ids": lambda: eggnog.filter_allowed_ids(
+            df_members, column, primates
+        ),
+        "clean_taxid_string": lambda: df_members[column].apply(
+            eggnog.clean_taxid_string
+        ),
+    }
+    results = []
+    for name, function in cases.items():
+        runs, result = time_call(function, repeat)
+        results.append(_result("library", name, runs, rows_in, _rows(result)))
+
+    df_members["clean_taxid_set"] = df_members[column].apply(eggnog.clean_taxid_string)
+    runs, result = time_call(lambda: eggnog.get_og_set(9606, df_members), repeat)
+    results.append(_result("library", "get_og_set", runs, rows_in, _rows(result)))
+
+    runs, presence = time_call(lambda: eggnog.build_presence_matrix(df_members), repeat)
+    results.append(
+        _result("library", "build_presence_matrix", runs, rows_in, _rows(presence))
+    )
+    queries = [
+        eggnog.Query("1A", include=[9606, 9598], exclude=[10090]),
+        eggnog.Query("1D", include=[9606, 9598], only_within=[9606, 9598]),
+        eggnog.Query("2_core", include_any=[[9606, 9598], [9031], [7955, 31033]]),
+    ]
+    runs, result = time_call(lambda: eggnog.run_queries(queries, presence), repeat)
+    results.append(_result("library", "run_queries", runs, rows_in, _rows(result)))
+    runs, result = time_call(lambda: presence.coverage().mask(0.99), repeat)
+    results.append(
+        _result("library", "q3_coverage", runs, rows_in, int(np.sum(result)))
+    )
+    return results
+
+
+def benchmark_main(repeat: int) -> list:
+    """Times the main.py table loads, pipeline stages, analyses and result writes."""
+    import main
+
+    Path("results").mkdir(exist_ok=True)
+    tables_stages = ["members", "annotations", "species", "taxonomy"]
+    timings = {}
+    rows = {}
+    for _ in range(repeat):
+        shutil.rmtree(eggnog.CACHE_DIR, ignore_errors=True)
+        tables = main.Tables()
+        for stage in tables_stages:
+            start = time.perf_counter()
+            value = getattr(tables, stage)
+            timings.setdefault(stage, []).append(time.perf_counter() - start)
+            rows[stage] = _rows(value)
+        # stages are registered after their inputs, so getting them in order times
+        # each computation on its own; the cache was cleared, so none is reused
+        pipeline = main.build_pipeline(tables)
+        for stage in pipeline.status()["stage"]:
+            start = time.perf_counter()
+            value = pipeline.get(stage)
+            timings.setdefault(stage, []).append(time.perf_counter() - start)
+            rows[stage] = _rows(value)
+        summary = {}
+        writer = tables.eggnog.ResultWriter()
+        try:
+            for analysis in main.ANALYSES:
+                start = time.perf_counter()
+                main.RUNNERS[analysis](tables, pipeline, summary, writer)
+                timings.setdefault(analysis, []).append(time.perf_counter() - start)
+        finally:
+            # the runners only queue their files; time what is left to write
+            start = time.perf_counter()
+            writer.close()
+            timings.setdefault("write_results", []).append(time.perf_counter() - start)
+    return [
+        _result("main", name, runs, rows.get("members"), rows.get(name))
+        for name, runs in timings.items()
+    ]
+
+
+def _result(group: str, name: str, runs: list, rows_in, rows_out) -> dict:
+    return {
+        "group": group,
+        "name": name,
+        "median_seconds": statistics.median(runs),
+        "min_seconds": min(runs),
+        "runs": runs,
+        "rows_in": rows_in,
+        "rows_out": rows_out,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--ogs", type=int, help="override the number of OGs")
+    parser.add_argument("--species", type=int, help="override the number of species")
+    parser.add_argument(
+        "--proteins-per-species",
+        type=float,
+        help="override the mean proteins per species and OG",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        default=None,
+        help="where data and results go (default: benchmark_data/<scale>)",
+    )
+    parser.add_argument("--output", type=Path, default=None, help="JSON results file")
+    parser.add_argument(
+        "--skip-main", action="store_true", help="only time the library functions"
+    )
+    parser.add_argument(
+        "--regenerate",
+        action="store_true",
+        help="rewrite the synthetic data even if it exists",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scale = dict(SCALES[args.scale])
+    for key in ("ogs", "species", "proteins_per_species"):
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+    label = args.scale if scale == SCALES[args.scale] else "custom"
+    workdir = (args.workdir or Path("benchmark_data") / label).resolve()
+    output = (args.output or workdir / "benchmark_results.json").resolve()
+
+    members = workdir / "data" / "33208_members.tsv"
+    config = workdir / "dataset.json"
+    expected = {**scale, "seed": args.seed}
+    if (
+        args.regenerate
+        or not members.exists()
+        or not config.exists()
+        or json.loads(config.read_text()).get("config") != expected
+    ):
+        print(f"Generating synthetic data in {workdir} ({scale}) ...")
+        start = time.perf_counter()
+        dataset = generate_dataset(workdir, seed=args.seed, **scale)
+        dataset["generation_seconds"] = time.perf_counter() - start
+        config.write_text(json.dumps({"config": expected, "dataset": dataset}))
+    dataset = json.loads(config.read_text())["dataset"]
+
+    # the library and main.py read data/ relative to the working directory
+    os.chdir(workdir)
+    print("Timing library functions ...")
+    results = benchmark_library(args.repeat)
+    if not args.skip_main:
+        print("Timing main.py stages ...")
+        results += benchmark_main(args.repeat)
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "scale": label,
+        "config": expected,
+        "dataset": dataset,
+        "repeat": args.repeat,
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "cpus": os.cpu_count(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    print(f"\n{'group':<8} {'benchmark':<28} {'median s':>10} {'rows out':>10}")
+    for r in results:
+        rows_out = "" if r["rows_out"] is None else r["rows_out"]
+        print(
+            f"{r['group']:<8} {r['name']:<28} {r['median_seconds']:>10.4f} {rows_out:>10}"
+        )
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,40 @@
 """Library for working with eggNOG files (eggNOG v5.0)"""
 
 from pathlib import Path
-from typing import List, Optional, Set
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+import asyncio
+import functools
+import gzip
+import hashlib
+import inspect
+import io
+import itertools
+import json
+import numpy as np
+import os
+import pickle
 import pandas as pd
+import queue
 import re
-
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+import warnings
 
 # --FUNCTIONS--
 PRIMATES = {
@@ -25,6 +55,10 @@ PRIMATES = {
     "Macaca mulatta",
 }
 
+# PRIMATES are the eggNOG 5 species of the order Primates (taxid 9443); prefer
+# resolving clades from the taxonomy, e.g. TaxonomyIndex.clade_species(PRIMATES_TAXID)
+PRIMATES_TAXID = 9443
+
 IDS_EX2 = {
     "human": 9606,
     "chimp": 9598,
@@ -35,12 +69,412 @@ IDS_EX2 = {
     "rat": 10116,
 }
 
+# eggNOG 5 files are downloaded per taxonomic level (per_tax_level/<level>/) into DATA_DIR
+DATA_DIR = "data"
+DEFAULT_TAX_LEVEL = 33208  # Metazoa
+
+CACHE_DIR = Path("data/cache")
+CACHE_VERSION = 1
+
+
+# -- On-disk cache for parsed tables --
+def _file_fingerprint(path: Path, with_hash: bool = True) -> dict:
+    """
+    Get size, modification time and (optionally) the sha256 hash of a file.
+
+    Args:
+        path (Path): The file to fingerprint.
+        with_hash (bool): Whether to hash the file content. Defaults to True.
+
+    Returns:
+        dict: Dictionary with keys 'size', 'mtime_ns' and 'sha256' (None if not hashed).
+    """
+    stat = path.stat()
+    digest = None
+    if with_hash:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        digest = sha.hexdigest()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+
+
+def _parquet_available() -> bool:
+    """Check if pyarrow is installed, which pandas needs for parquet files."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def load_cached(
+    source: str,
+    build: Callable[[], pd.DataFrame],
+    variant: str = "",
+    cache_dir: Path = CACHE_DIR,
+) -> pd.DataFrame:
+    """
+    Load a parsed table from the on-disk cache, or build it and write it to the cache.
+
+    The cache is stored as parquet (if pyarrow is installed, otherwise as pickle)
+    next to a small JSON file with the fingerprint of the source file. The cache is
+    valid as long as the source file has the same size and modification time; if
+    those changed, the source is hashed and the cache is only rebuilt if the hash
+    differs too. Columns holding Python sets (e.g. 'clean_taxid_set') are stored
+    as sorted lists and converted back to sets on load.
+
+    Args:
+        source (str): Path of the source file the table is parsed from.
+        build (Callable[[], pd.DataFrame]): Function parsing the source file.
+        variant (str): Suffix to distinguish different tables built from the same
+                       source (e.g. with derived columns). Defaults to "".
+        cache_dir (Path): Directory of the cache files. Defaults to data/cache.
+
+    Returns:
+        pd.DataFrame: The parsed table.
+
+    Raises:
+        FileNotFoundError: If the source file does not exist (raised by build).
+
+    Examples:
+        >>> import tempfile
+        >>> from unittest import mock
+        >>> directory = Path(tempfile.mkdtemp())
+        >>> source = directory / 'members.tsv'
+        >>> _ = source.write_text('OG1 9606,10090')
+        >>> builds = []
+        >>> def build():
+        ...     builds.append(1)
+        ...     return pd.DataFrame({'og': ['OG1'], 'taxids': [{'9606', '10090'}]})
+        >>> for parquet in (True, False):  # second load of each comes from the cache
+        ...     with mock.patch(f'{__name__}._parquet_available', lambda: parquet):
+        ...         for _ in range(2):
+        ...             df = load_cached(str(source), build, str(parquet), directory)
+        ...     print(sorted(df.loc[0, 'taxids']), len(builds))
+        ['10090', '9606'] 1
+        ['10090', '9606'] 2
+    """
+    source_path = Path(source)
+    if not source_path.exists():
+        return build()
+
+    name = source_path.name + (f".{variant}" if variant else "")
+    use_parquet = _parquet_available()
+    cache_file = Path(cache_dir) / (name + (".parquet" if use_parquet else ".pkl"))
+    meta_file = Path(cache_dir) / (name + ".meta.json")
+
+    fingerprint = _file_fingerprint(source_path, with_hash=False)
+    meta = None
+    if cache_file.exists() and meta_file.exists():
+        try:
+            meta = json.loads(meta_file.read_text())
+        except ValueError:
+            meta = None
+    if meta is not None and meta.get("version") == CACHE_VERSION:
+        fresh = (
+            meta["source"]["size"] == fingerprint["size"]
+            and meta["source"]["mtime_ns"] == fingerprint["mtime_ns"]
+        )
+        if not fresh and meta["source"]["size"] == fingerprint["size"]:
+            # file was touched (e.g. re-downloaded), only rebuild if content changed
+            fingerprint = _file_fingerprint(source_path)
+            fresh = meta["source"]["sha256"] == fingerprint["sha256"]
+            if fresh:
+                meta["source"] = fingerprint
+                meta_file.write_text(json.dumps(meta))
+        if fresh:
+            if use_parquet:
+                df = pd.read_parquet(cache_file)
+            else:
+                df = pd.read_pickle(cache_file)
+            for column in meta["set_columns"]:
+                # numpy arrays from parquet, lists from pickle
+                df[column] = [set(values) for values in df[column]]
+            return df
+
+    df = build()
+    set_columns = [
+        column
+        for column in df.columns
+        if df[column].dtype == object
+        and len(df)
+        and isinstance(df[column].iloc[0], set)
+    ]
+    try:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        stored = df.copy() if set_columns else df
+        for column in set_columns:
+            stored[column] = [sorted(values) for values in stored[column]]
+        tmp_file = cache_file.with_name(cache_file.name + ".tmp")
+        if use_parquet:
+            stored.to_parquet(tmp_file, index=False)
+        else:
+            stored.to_pickle(tmp_file)
+        os.replace(tmp_file, cache_file)
+        meta = {
+            "version": CACHE_VERSION,
+            "source": _file_fingerprint(source_path),
+            "set_columns": set_columns,
+        }
+        meta_file.write_text(json.dumps(meta))
+    except OSError as e:
+        warnings.warn(f"Could not write cache for '{source}': {e}")
+    return df
+
+
+# -- Stage instrumentation --
+class StageProfiler:
+    """
+    Opt-in recorder of wall time, CPU time, rows and peak memory per pipeline stage.
+
+    Stages are timed with the stage() context manager, or automatically for the
+    library functions decorated with @profiled (loaders, filters, matrix builders)
+    once the profiler is activated with enable_profiling(). Nested stages (e.g. a
+    filter called inside a question) are recorded with their depth and parent.
+    Not thread-safe: profile one pipeline run at a time.
+
+    Peak RSS is the process high-water mark after the stage (it never goes down);
+    with trace_memory, tracemalloc additionally reports the peak of Python/numpy
+    allocations during each stage, at the cost of slower allocations.
+
+    Attributes:
+        records (List[dict]): One record per finished stage, in finishing order.
+
+    Examples:
+        >>> profiler = StageProfiler()
+        >>> with profiler.stage("count", rows_in=3) as record:
+        ...     record["rows_out"] = len([1, 2])
+        >>> [(r["name"], r["rows_in"], r["rows_out"]) for r in profiler.records]
+        [('count', 3, 2)]
+    """
+
+    def __init__(
+        self,
+        trace_memory: bool = False,
+        hooks: Optional[Dict[str, Callable[[str], object]]] = None,
+    ):
+        """
+        Args:
+            trace_memory (bool): Measure per-stage peaks with tracemalloc.
+                                 Defaults to False.
+            hooks (Optional[Dict[str, Callable]]): Stage name -> factory returning a
+                context manager that is entered around that stage, to attach an
+                external profiler to a single stage (see cprofile_hook).
+        """
+        self.trace_memory = trace_memory
+        self.hooks = dict(hooks or {})
+        self.records = []
+        self._stack = []
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str, rows_in: Optional[int] = None) -> Iterator[dict]:
+        """
+        Time a stage. The yielded record can be updated, e.g. with "rows_out".
+
+        Args:
+            name (str): Name of the stage.
+            rows_in (Optional[int]): Number of input rows, if meaningful.
+
+        Yields:
+            dict: The record of the stage, appended to self.records when it ends.
+        """
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if self._stack:
+                parent = self._stack[-1]
+                parent["_peak"] = max(
+                    parent["_peak"], tracemalloc.get_traced_memory()[1]
+                )
+            tracemalloc.reset_peak()
+        record = {
+            "name": name,
+            "parent": self._stack[-1]["name"] if self._stack else None,
+            "depth": len(self._stack),
+            "start_seconds": time.perf_counter() - self._start,
+            "rows_in": rows_in,
+            "rows_out": None,
+            "_peak": 0,
+        }
+        self._stack.append(record)
+        hook = self.hooks.get(name)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            if hook is None:
+                yield record
+            else:
+                with hook(name):
+                    yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            record["peak_rss_mb"] = _peak_rss_mb()
+            peak = record.pop("_peak")
+            if self.trace_memory:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                record["peak_traced_mb"] = peak / 2**20
+            else:
+                record["peak_traced_mb"] = None
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]["_peak"] = max(self._stack[-1]["_peak"], peak)
+            self.records.append(record)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """The records as a DataFrame, in start order."""
+        columns = [
+            "name",
+            "parent",
+            "depth",
+            "start_seconds",
+            "wall_seconds",
+            "cpu_seconds",
+            "rows_in",
+            "rows_out",
+            "peak_rss_mb",
+            "peak_traced_mb",
+        ]
+        df = pd.DataFrame(self.records, columns=columns)
+        df[["rows_in", "rows_out"]] = df[["rows_in", "rows_out"]].astype("Int64")
+        return df.sort_values("start_seconds", kind="stable").reset_index(drop=True)
+
+    def write(self, path_prefix: str) -> Tuple[Path, Path]:
+        """
+        Write the profile as <path_prefix>.json and <path_prefix>.tsv.
+
+        Args:
+            path_prefix (str): Output path without extension, e.g. "results/profile".
+
+        Returns:
+            Tuple[Path, Path]: Paths of the JSON and the TSV file.
+        """
+        json_path = Path(f"{path_prefix}.json")
+        tsv_path = Path(f"{path_prefix}.tsv")
+        stages = sorted(self.records, key=lambda record: record["start_seconds"])
+        json_path.write_text(
+            json.dumps({"trace_memory": self.trace_memory, "stages": stages}, indent=2)
+        )
+        self.to_dataframe().to_csv(tsv_path, sep="\t", index=False)
+        return json_path, tsv_path
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of the process in MB (None where unsupported)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def cprofile_hook(path_prefix: str) -> Callable[[str], object]:
+    """
+    Hook for StageProfiler that runs a stage under cProfile.
+
+    Args:
+        path_prefix (str): The stats are dumped to <path_prefix>_<stage>.prof,
+                           readable with pstats or snakeviz.
+
+    Returns:
+        Callable[[str], object]: Factory of the context manager for a stage name.
+    """
+
+    @contextmanager
+    def hook(name: str):
+        import cProfile
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            safe_name = re.sub(r"[^\w.-]", "_", name)
+            profile.dump_stats(f"{path_prefix}_{safe_name}.prof")
+
+    return hook
+
+
+_PROFILER: Optional[StageProfiler] = None
+
+
+def enable_profiling(profiler: StageProfiler) -> StageProfiler:
+    """Record all @profiled library calls and profile_stage() blocks in profiler."""
+    global _PROFILER
+    _PROFILER = profiler
+    return profiler
+
+
+def disable_profiling():
+    """Stop recording; @profiled functions run without any bookkeeping again."""
+    global _PROFILER
+    _PROFILER = None
+
+
+def profile_stage(name: str, rows_in: Optional[int] = None):
+    """
+    Time a block as a stage of the active profiler; a no-op if profiling is off.
+
+    Examples:
+        >>> with profile_stage("not recorded") as record:
+        ...     record["rows_out"] = 0
+    """
+    if _PROFILER is None:
+        return nullcontext({})
+    return _PROFILER.stage(name, rows_in=rows_in)
+
+
+def _count_rows(value) -> Optional[int]:
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray, list, set, dict)):
+        return len(value)
+    og_ids = getattr(value, "og_ids", None)
+    if og_ids is not None:
+        return len(og_ids)
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def profiled(function: Callable) -> Callable:
+    """Decorator recording calls of function as stages of the active profiler."""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _PROFILER is None:
+            return function(*args, **kwargs)
+        rows_in = next(
+            (len(a) for a in args if isinstance(a, (pd.DataFrame, pd.Series))), None
+        )
+        with _PROFILER.stage(function.__name__, rows_in=rows_in) as record:
+            result = function(*args, **kwargs)
+            record["rows_out"] = _count_rows(result)
+        return result
+
+    return wrapper
+
 
 # -- Dataframe setup functions--
-def dataframe_setup_annotations() -> pd.DataFrame:
+@profiled
+def dataframe_setup_annotations(
+    cache: bool = False, tax_level: int = DEFAULT_TAX_LEVEL, data_dir: str = DATA_DIR
+) -> pd.DataFrame:
     """
     Set up the Dataframe for annotations. The orthologous_group_id is set as index.
 
+    Args:
+        cache (bool): Load from / write to the on-disk cache (see load_cached).
+                      Defaults to False.
+        tax_level (int): Taxonomic level of the file <tax_level>_annotations.tsv,
+                         e.g. 7742 for Vertebrata. Defaults to 33208 (Metazoa).
+        data_dir (str): Directory of the downloaded files. Defaults to "data".
+
     Returns:
         pd.DataFrame: A DataFrame containing annotation data with columns:
                       - evolutionary_level
@@ -53,6 +487,12 @@ def dataframe_setup_annotations() -> pd.DataFrame:
         pd.errors.ParserError: If the file is corrupted or malformed.
         pd.errors.EmptyDataError: If the file is empty.
     """
+    path = os.path.join(data_dir, f"{tax_level}_annotations.tsv")
+    if cache:
+        return load_cached(
+            path,
+            lambda: dataframe_setup_annotations(tax_level=tax_level, data_dir=data_dir),
+        )
     try:
         column_names = [
             "evolutionary_level",
@@ -61,7 +501,7 @@ def dataframe_setup_annotations() -> pd.DataFrame:
             "functional_description",
         ]
         df = pd.read_csv(
-            "data/33208_annotations.tsv",
+            path,
             sep="\t",
             header=None,
             names=column_names,
@@ -69,7 +509,8 @@ def dataframe_setup_annotations() -> pd.DataFrame:
         )
     except FileNotFoundError:
         raise FileNotFoundError(
-            "File '33208_annotations.tsv' not found. Run: bash runall.sh to download files."
+            f"File '{tax_level}_annotations.tsv' not found in '{data_dir}'. "
+            f"Run: bash runall.sh to download files."
         )
     except pd.errors.ParserError as e:
         raise pd.errors.ParserError(
@@ -83,10 +524,25 @@ def dataframe_setup_annotations() -> pd.DataFrame:
     return df
 
 
-def dataframe_setup_members() -> pd.DataFrame:
+@profiled
+def dataframe_setup_members(
+    cache: bool = False,
+    with_taxid_sets: bool = False,
+    tax_level: int = DEFAULT_TAX_LEVEL,
+    data_dir: str = DATA_DIR,
+) -> pd.DataFrame:
     """
     Set up the Dataframe for members. The orthologous_group_id is set as index.
 
+    Args:
+        cache (bool): Load from / write to the on-disk cache (see load_cached).
+                      Defaults to False.
+        with_taxid_sets (bool): Add the derived 'clean_taxid_set' column
+                                (see clean_taxid_string). Defaults to False.
+        tax_level (int): Taxonomic level of the file <tax_level>_members.tsv,
+                         e.g. 7742 for Vertebrata. Defaults to 33208 (Metazoa).
+        data_dir (str): Directory of the downloaded files. Defaults to "data".
+
     Returns:
         pd.DataFrame: A DataFrame containing member data with columns:
                       - evolutionary_level
@@ -95,12 +551,22 @@ def dataframe_setup_members() -> pd.DataFrame:
                       - num_of_species
                       - protein_id
                       - species_taxid_containing_protein
+                      - clean_taxid_set (only if with_taxid_sets is True)
 
     Raises:
         FileNotFoundError: If the members file is not found in the data directory.
         pd.errors.ParserError: If the file is corrupted or malformed.
         pd.errors.EmptyDataError: If the file is empty.
     """
+    path = os.path.join(data_dir, f"{tax_level}_members.tsv")
+    if cache:
+        return load_cached(
+            path,
+            lambda: dataframe_setup_members(
+                with_taxid_sets=with_taxid_sets, tax_level=tax_level, data_dir=data_dir
+            ),
+            variant="taxid_sets" if with_taxid_sets else "",
+        )
     try:
         column_names = [
             "evolutionary_level",
@@ -111,7 +577,7 @@ def dataframe_setup_members() -> pd.DataFrame:
             "species_taxid_containing_protein",
         ]
         df = pd.read_csv(
-            "data/33208_members.tsv",
+            path,
             sep="\t",
             header=None,
             names=column_names,
@@ -119,7 +585,8 @@ def dataframe_setup_members() -> pd.DataFrame:
         )
     except FileNotFoundError:
         raise FileNotFoundError(
-            "File '33208_members.tsv' not found. Run: bash runall.sh to download files."
+            f"File '{tax_level}_members.tsv' not found in '{data_dir}'. "
+            f"Run: bash runall.sh to download files."
         )
     except pd.errors.ParserError as e:
         raise pd.errors.ParserError(
@@ -130,12 +597,24 @@ def dataframe_setup_members() -> pd.DataFrame:
         raise pd.errors.EmptyDataError(
             "Data file is empty. Re-download with: bash runall.sh"
         )
+    if with_taxid_sets:
+        df["clean_taxid_set"] = df["species_taxid_containing_protein"].apply(
+            clean_taxid_string
+        )
     return df
 
 
-def dataframe_setup_taxid_info() -> pd.DataFrame:
+@profiled
+def dataframe_setup_taxid_info(
+    cache: bool = False, data_dir: str = DATA_DIR
+) -> pd.DataFrame:
     """
-    Set up the Dataframe for tax (species) id info.
+    Set up the Dataframe for tax (species) id info. The file covers all levels.
+
+    Args:
+        cache (bool): Load from / write to the on-disk cache (see load_cached).
+                      Defaults to False.
+        data_dir (str): Directory of the downloaded files. Defaults to "data".
 
     Returns:
         pd.DataFrame: A DataFrame containing taxonomy info with columns:
@@ -150,6 +629,9 @@ def dataframe_setup_taxid_info() -> pd.DataFrame:
         pd.errors.ParserError: If the file is corrupted or malformed.
         pd.errors.EmptyDataError: If the file is empty.
     """
+    path = os.path.join(data_dir, "e5.taxid_info.tsv")
+    if cache:
+        return load_cached(path, lambda: dataframe_setup_taxid_info(data_dir=data_dir))
     try:
         column_names = [
             "species_taxid",
@@ -158,12 +640,11 @@ def dataframe_setup_taxid_info() -> pd.DataFrame:
             "named_lineage",
             "tax_id_lineage",
         ]
-        df = pd.read_csv(
-            "data/e5.taxid_info.tsv", sep="\t", header=0, names=column_names
-        )
+        df = pd.read_csv(path, sep="\t", header=0, names=column_names)
     except FileNotFoundError:
         raise FileNotFoundError(
-            "File 'e5.taxid_info.tsv' not found. Run: bash runall.sh to download files."
+            f"File 'e5.taxid_info.tsv' not found in '{data_dir}'. "
+            f"Run: bash runall.sh to download files."
         )
     except pd.errors.ParserError as e:
         raise pd.errors.ParserError(
@@ -177,10 +658,14 @@ def dataframe_setup_taxid_info() -> pd.DataFrame:
     return df
 
 
-def dataframe_setup_functional_categories() -> pd.DataFrame:
+@profiled
+def dataframe_setup_functional_categories(data_dir: str = DATA_DIR) -> pd.DataFrame:
     """
     Set up the Dataframe for functional categories by parsing a text file.
 
+    Args:
+        data_dir (str): Directory of the downloaded files. Defaults to "data".
+
     Returns:
         pd.DataFrame: A DataFrame containing functional categories with columns:
                       - Category_code
@@ -194,7 +679,9 @@ def dataframe_setup_functional_categories() -> pd.DataFrame:
     try:
         data = []
 
-        with open("data/eggnog4.functional_categories.txt", "r") as f:
+        with open(
+            os.path.join(data_dir, "eggnog4.functional_categories.txt"), "r"
+        ) as f:
             for line in f:
                 line = line.strip()
 
@@ -285,13 +772,14 @@ def get_species_name_by_id(species_id: int, df: pd.DataFrame) -> str:
     return species_name
 
 
-def get_species_ids_from_names(species_names, df_species: pd.DataFrame) -> List[int]:
+def get_species_ids_from_names(species_names, df_species) -> List[int]:
     """
     Convert a list or set of species names to their corresponding IDs.
 
     Args:
         species_names: Iterable of species name strings
-        df_species: Species dataframe containing taxid info
+        df_species: Species dataframe containing taxid info, or a TaxonomyIndex
+                    built from it (constant time per name)
 
     Returns:
         List[int]: List of species IDs
@@ -303,237 +791,5202 @@ def get_species_ids_from_names(species_names, df_species: pd.DataFrame) -> List[
         >>> get_species_ids_from_names(['E. coli', 'H. sapiens'], df)
         [562, 9606]
     """
+    if isinstance(df_species, TaxonomyIndex):
+        return df_species.resolve_names(species_names).tolist()
     return [get_species_id_by_name(name, df_species) for name in species_names]
 
 
-def filter_by_ids(
-    df: pd.DataFrame,
-    column: str,
-    include_ids: List[str],
-    exclude_ids: Optional[List[str]] = None,
-) -> pd.DataFrame:
+class TaxonomyIndex:
     """
-    Filters a dataframe based on presence or absence of specific IDs
-    within a comma-separated string column.
+    Hash-map index over the taxid info table for O(1) species name/ID resolution
+    and lineage lookups.
 
-    Args:
-        df (pd.DataFrame): The input dataframe.
-        column (str): The column name containing comma-separated IDs.
-        include_ids (List[str]): List of IDs that MUST be present.
-        exclude_ids (Optional[List[str]]): List of IDs that MUST NOT be present. Defaults to None.
+    Built once with build_taxonomy_index. Lineages are stored in CSR layout: the
+    lineage of the i-th taxid is lineage_taxids[lineage_offsets[i]:lineage_offsets[i + 1]]
+    (from the root down to the taxid itself), with the matching names in lineage_names.
 
-    Returns:
-        pd.DataFrame: The filtered dataframe.
+    Attributes:
+        taxids (np.ndarray): Taxids of the table, in table order.
+        names (np.ndarray): Species names, aligned with taxids.
+        ranks (np.ndarray): Ranks, aligned with taxids.
+        lineage_offsets (np.ndarray): Lineage boundaries, length len(taxids) + 1.
+        lineage_taxids (np.ndarray): Taxid lineages of all taxids, one after the other.
+        lineage_names (np.ndarray): Named lineages, aligned with lineage_taxids.
+    """
 
-    Raises:
-        KeyError: If the specified column is not found in the dataframe.
+    def __init__(
+        self,
+        taxids: np.ndarray,
+        names: np.ndarray,
+        ranks: np.ndarray,
+        lineage_offsets: np.ndarray,
+        lineage_taxids: np.ndarray,
+        lineage_names: np.ndarray,
+    ):
+        self.taxids = np.asarray(taxids, dtype=np.int64)
+        self.names = np.asarray(names, dtype=object)
+        self.ranks = np.asarray(ranks, dtype=object)
+        self.lineage_offsets = lineage_offsets
+        self.lineage_taxids = lineage_taxids
+        self.lineage_names = lineage_names
+        self._position = {int(taxid): i for i, taxid in enumerate(self.taxids)}
+        self._id_by_name = {}
+        self._duplicate_names = set()
+        for name, taxid in zip(self.names, self.taxids):
+            if name in self._id_by_name:
+                self._duplicate_names.add(name)
+            self._id_by_name[name] = int(taxid)
+        self._clade_taxids = None
+        self._clade_bitmap = None
+        self._clade_row = None
+        self._clade_by_name = None
 
-    Examples:
-        >>> import pandas as pd
-        >>> data = {'id': [1, 2, 3], 'tags': ['A,B', 'B,C', 'A,C']}
-        >>> df = pd.DataFrame(data)
-        >>> # Include 'A', Exclude 'B' -> Should match row 3 ('A,C')
-        >>> filter_by_ids(df, 'tags', ['A'], ['B'])
-           id tags
-        2   3  A,C
-        >>> # Include 'B' -> Should match row 1 and 2
-        >>> filter_by_ids(df, 'tags', ['B'], [])
-           id tags
-        0   1  A,B
-        1   2  B,C
-    """
-    if exclude_ids is None:
-        exclude_ids = []
+    def __len__(self) -> int:
+        return len(self.taxids)
 
-    try:
-        # Start with a mask where everything is True
-        mask = pd.Series(True, index=df.index)
-
-        # 1. Must include ALL of these
-        for inc_id in include_ids:
-            # \b ensures we match "1" but not "11"
-            regex_pattern = rf"\b{inc_id}\b"
-            mask &= df[column].str.contains(regex_pattern, na=False)
-
-        # 2. Must include NONE of these
-        for exc_id in exclude_ids:
-            regex_pattern = rf"\b{exc_id}\b"
-            mask &= ~df[column].str.contains(regex_pattern, na=False)
-    except KeyError:
-        raise KeyError(
-            f"Column '{column}' not found in dataframe. "
-            f"Available columns: {list(df.columns)}"
-        )
+    def __repr__(self) -> str:
+        return f"TaxonomyIndex({len(self)} taxids)"
 
-    return df[mask]
+    def __contains__(self, taxid: int) -> bool:
+        return int(taxid) in self._position
 
+    def id_by_name(self, species_name: str) -> int:
+        """
+        Get the species taxid by species name.
 
-def filter_by_species_names(
-    df: pd.DataFrame, column: str, species_names, df_species: pd.DataFrame
-) -> pd.DataFrame:
-    """
-    Filter dataframe to include only rows where the specified column
-    contains any of the given species (by name).
+        Args:
+            species_name (str): The name of the species.
 
-    This is a convenience wrapper that converts species names to IDs
-    and then filters the dataframe.
+        Returns:
+            int: The species taxid.
 
-    Args:
-        df: Dataframe to filter
-        column: Column name containing species IDs
-        species_names: Iterable of species names to include
-        df_species: Species dataframe for name-to-ID mapping
+        Raises:
+            ValueError: If the species name is not found or has duplicate entries.
 
-    Returns:
-        pd.DataFrame: Filtered dataframe
+        Examples:
+            >>> taxonomy = build_taxonomy_index(pd.DataFrame({
+            ...     'species_taxid': [562, 9606], 'species_name': ['E. coli', 'H. sapiens'],
+            ...     'rank': ['species', 'species'], 'named_lineage': ['root,E. coli', 'root,H. sapiens'],
+            ...     'tax_id_lineage': ['1,562', '1,9606']}))
+            >>> taxonomy.id_by_name('H. sapiens')
+            9606
+        """
+        if (
+            species_name in self._duplicate_names
+            or species_name not in self._id_by_name
+        ):
+            raise ValueError(
+                f"Species '{species_name}' not found or has duplicate entries in dataframe."
+            )
+        return self._id_by_name[species_name]
 
-    Raises:
-        ValueError: If any species name in the iterable is not found in the species dataframe.
-        KeyError: If the specified column is not found in the dataframe.
+    def name_by_id(self, species_id: int) -> str:
+        """
+        Get the species name by species taxid.
 
-    Examples:
-        >>> import pandas as pd
-        >>> df = pd.DataFrame({'ids': ['562,9606', '9606', '562']})
-        >>> species_df = pd.DataFrame({
-        ...     'species_name': ['E. coli', 'H. sapiens'],
-        ...     'species_taxid': [562, 9606]
-        ... })
-        >>> filter_by_species_names(df, 'ids', ['E. coli', 'H. sapiens'], species_df)
-           ids
-        0  562,9606
-        1  9606
-        2  562
-    """
+        Args:
+            species_id (int): The species taxid.
 
-    try:
-        species_ids = get_species_ids_from_names(species_names, df_species)
-    except ValueError as e:
-        raise ValueError(f"Failed to resolve species names to IDs: {e}")
-    return filter_allowed_ids(df, column, species_ids)
+        Returns:
+            str: The name of the species.
 
+        Raises:
+            ValueError: If the species ID is not found.
+        """
+        position = self._position.get(int(species_id))
+        if position is None:
+            raise ValueError(
+                f"Species with ID '{species_id}' not found or has duplicate entries in dataframe."
+            )
+        return self.names[position]
 
-def filter_allowed_ids(
-    df: pd.DataFrame, column: str, allowed_ids: Set[str]
-) -> pd.DataFrame:
-    """
-    Filter a DataFrame to include only rows where all IDs in a column are in the allowed set.
-    This function splits the values in the specified column by common delimiters (commas and/or whitespace),
-    then checks if all resulting IDs are present in the allowed_ids set. Only rows where all IDs are allowed
-    are retained in the returned DataFrame.
-    Args:
-        df (pd.DataFrame): The input DataFrame to filter.
-        column (str): The name of the column containing IDs to check. Values can be single IDs or
-                      multiple IDs separated by commas and/or whitespace.
-        allowed_ids (List[str]): A list of IDs that are considered allowed. Non-string IDs will be
-                                 converted to strings for comparison.
-    Returns:
-        pd.DataFrame: A filtered DataFrame containing only rows where all IDs in the specified column
-                      are present in the allowed_ids set. The original DataFrame is not modified.
-    Raises:
-        KeyError: If the specified column is not found in the dataframe.
-    Example:
-        >>> df = pd.DataFrame({'ids': ['1,2,3', '4,5', '2,3']})
-        >>> allowed = ['1', '2', '3', '4', '5']
-        >>> filter_allowed_ids(df, 'ids', allowed)
-           ids
-        0  1,2,3
-        1  4,5
-        2  2,3
-    """
-    allowed_set = set(str(item) for item in allowed_ids)
+    def resolve_names(self, species_names: Iterable[str]) -> np.ndarray:
+        """
+        Convert many species names to taxids at once.
 
-    try:
-        mask = (
-            df[column]
-            .astype(str)
-            .str.split(r"[,\s]+")
-            .apply(lambda ids: set(ids) <= allowed_set)
-        )
-    except KeyError:
-        raise KeyError(
-            f"Column '{column}' not found in dataframe. "
-            f"Available columns: {list(df.columns)}"
+        Args:
+            species_names (Iterable[str]): Species names.
+
+        Returns:
+            np.ndarray: Taxids (int64), in the order of species_names.
+
+        Raises:
+            ValueError: If any species name is not found or has duplicate entries.
+        """
+        return np.array(
+            [self.id_by_name(name) for name in species_names], dtype=np.int64
         )
 
-    return df[mask]
+    def resolve_ids(self, species_ids: Iterable[int]) -> np.ndarray:
+        """
+        Convert many taxids to species names at once.
 
+        Args:
+            species_ids (Iterable[int]): Species taxids.
 
-def clean_taxid_string(raw_string: str) -> Set[int]:
-    """
-    Extract unique taxonomic IDs from a protein ID string.
+        Returns:
+            np.ndarray: Species names, in the order of species_ids.
 
-    Parses a comma-separated string of protein IDs with taxonomic prefixes
-    and returns a set of unique taxonomic IDs.
+        Raises:
+            ValueError: If any species ID is not found.
 
-    Args:
-        raw_string (str): Comma-separated protein IDs with taxid prefixes
-                         (e.g., "9606.ENSP123, 10090.ENSMUSP456")
+        Examples:
+            >>> taxonomy = build_taxonomy_index(pd.DataFrame({
+            ...     'species_taxid': [562, 9606], 'species_name': ['E. coli', 'H. sapiens'],
+            ...     'rank': ['species', 'species'], 'named_lineage': ['root,E. coli', 'root,H. sapiens'],
+            ...     'tax_id_lineage': ['1,562', '1,9606']}))
+            >>> taxonomy.resolve_ids([9606, 562]).tolist()
+            ['H. sapiens', 'E. coli']
+        """
+        return np.array([self.name_by_id(taxid) for taxid in species_ids], dtype=object)
 
-    Returns:
-        Set[int]: Set of unique taxonomic IDs extracted from the string
+    def lineage(self, species_id: int) -> np.ndarray:
+        """
+        Get the taxid lineage of a taxid, from the root down to the taxid itself.
 
-    Raises:
-        ValueError: If the string contains non-numeric taxonomic ID prefixes.
+        Args:
+            species_id (int): The species taxid.
 
-    Examples:
-        >>> clean_taxid_string("9606.ENSP123, 10090.ENSMUSP456, 10116.ENSRNOP789")
-        {9606, 10090, 10116}
-        >>> clean_taxid_string("562.ECOLI_001")
-        {562}
-    """
-    s = str(raw_string)
-    items = s.split(",")
-    try:
-        clean_set = {int(item.split(".")[0].strip()) for item in items}
-    except ValueError:
-        raise ValueError(
-            f"Failed to parse taxonomic IDs from string: '{raw_string}'. "
-            f"Expected format: 'TAXID.PROTEINID' (e.g., '9606.ENSP00000123')."
-        )
-    return clean_set
+        Returns:
+            np.ndarray: Taxids of the lineage.
 
+        Raises:
+            ValueError: If the species ID is not found.
 
-def get_og_set(target_taxid: int, df_members: pd.DataFrame) -> Set[str]:
-    """
-    Get all orthologous group IDs containing a specific taxonomic ID.
+        Examples:
+            >>> taxonomy = build_taxonomy_index(pd.DataFrame({
+            ...     'species_taxid': [562, 9606], 'species_name': ['E. coli', 'H. sapiens'],
+            ...     'rank': ['species', 'species'], 'named_lineage': ['root,E. coli', 'root,H. sapiens'],
+            ...     'tax_id_lineage': ['1,562', '1,9606']}))
+            >>> taxonomy.lineage(9606).tolist()
+            [1, 9606]
+        """
+        position = self._position.get(int(species_id))
+        if position is None:
+            raise ValueError(f"Species with ID '{species_id}' not found in taxonomy.")
+        start, end = self.lineage_offsets[position], self.lineage_offsets[position + 1]
+        return self.lineage_taxids[start:end]
 
-    Filters the members dataframe to find all orthologous groups that contain
-    the specified taxonomic ID. Requires that the dataframe has a 'clean_taxid_set'
-    column created by applying clean_taxid_string.
+    def named_lineage(self, species_id: int) -> List[str]:
+        """
+        Get the named lineage of a taxid, from the root down to the taxid itself.
 
-    Args:
-        target_taxid (int): The taxonomic ID to search for
-        df_members (pd.DataFrame): Members dataframe with 'clean_taxid_set' column
-                                   and 'orthologous_group_id' column or index
+        Args:
+            species_id (int): The species taxid.
 
-    Returns:
-        Set[str]: Set of orthologous group IDs containing the target taxonomic ID
+        Returns:
+            List[str]: Names of the lineage.
 
-    Raises:
-        KeyError: If the 'clean_taxid_set' column is missing from the dataframe.
+        Raises:
+            ValueError: If the species ID is not found.
+        """
+        position = self._position.get(int(species_id))
+        if position is None:
+            raise ValueError(f"Species with ID '{species_id}' not found in taxonomy.")
+        start, end = self.lineage_offsets[position], self.lineage_offsets[position + 1]
+        return self.lineage_names[start:end].tolist()
 
-    Examples:
-        >>> import pandas as pd
-        >>> df = pd.DataFrame({
-        ...     'orthologous_group_id': ['OG1', 'OG2', 'OG3'],
-        ...     'clean_taxid_set': [{9606, 10090}, {9606}, {10090, 10116}]
-        ... })
-        >>> get_og_set(9606, df)
-        {'OG1', 'OG2'}
+    def _build_clades(self):
+        """
+        Precompute the clade -> species bitmap over the taxonomy tree.
+
+        Every taxid occurring in any lineage is a clade; row c of the bitmap has
+        bit i set if the i-th taxid of the table lies under clade c. Rows are
+        packed with np.packbits (1 bit per species).
+        """
+        self._clade_taxids, clade_codes = np.unique(
+            self.lineage_taxids, return_inverse=True
+        )
+        species = np.repeat(np.arange(len(self)), np.diff(self.lineage_offsets))
+        bitmap = np.zeros((len(self._clade_taxids), len(self)), dtype=bool)
+        bitmap[clade_codes, species] = True
+        self._clade_bitmap = np.packbits(bitmap, axis=1)
+        self._clade_row = {int(taxid): i for i, taxid in enumerate(self._clade_taxids)}
+
+        names = {}
+        duplicates = set()
+        for name, taxid in zip(self.lineage_names, self.lineage_taxids):
+            if names.setdefault(name, int(taxid)) != int(taxid):
+                duplicates.add(name)
+        for name in duplicates:
+            names[name] = None
+        self._clade_by_name = names
+
+    @property
+    def clade_taxids(self) -> np.ndarray:
+        """Sorted taxids of all clades (nodes) of the taxonomy tree."""
+        if self._clade_taxids is None:
+            self._build_clades()
+        return self._clade_taxids
+
+    def clade_id_by_name(self, clade_name: str) -> int:
+        """
+        Get the taxid of a clade (any node of the lineages) by its name.
+
+        Args:
+            clade_name (str): The name of the clade, e.g. "Primates".
+
+        Returns:
+            int: The taxid of the clade.
+
+        Raises:
+            ValueError: If the name is not found or belongs to several taxids.
+
+        Examples:
+            >>> taxonomy = build_taxonomy_index(pd.DataFrame({
+            ...     'species_taxid': [9606, 10090], 'species_name': ['Homo sapiens', 'Mus musculus'],
+            ...     'rank': ['species', 'species'],
+            ...     'named_lineage': ['root,Primates,Homo sapiens', 'root,Rodentia,Mus musculus'],
+            ...     'tax_id_lineage': ['1,9443,9606', '1,9989,10090']}))
+            >>> taxonomy.clade_id_by_name('Primates')
+            9443
+        """
+        if self._clade_by_name is None:
+            self._build_clades()
+        taxid = self._clade_by_name.get(clade_name)
+        if taxid is None:
+            raise ValueError(
+                f"Clade '{clade_name}' not found or has duplicate entries in taxonomy."
+            )
+        return taxid
+
+    def clade_name_by_id(self, clade_taxid: int) -> str:
+        """
+        Get the name of a clade (any node of the lineages) by its taxid.
+
+        Args:
+            clade_taxid (int): The taxid of the clade.
+
+        Returns:
+            str: The name of the clade.
+
+        Raises:
+            ValueError: If the clade does not occur in any lineage.
+
+        Examples:
+            >>> taxonomy = build_taxonomy_index(pd.DataFrame({
+            ...     'species_taxid': [9606], 'species_name': ['Homo sapiens'], 'rank': ['species'],
+            ...     'named_lineage': ['root,Primates,Homo sapiens'], 'tax_id_lineage': ['1,9443,9606']}))
+            >>> taxonomy.clade_name_by_id(9443)
+            'Primates'
+        """
+        positions = np.flatnonzero(self.lineage_taxids == int(clade_taxid))
+        if not len(positions):
+            raise ValueError(f"Clade with ID '{clade_taxid}' not found in taxonomy.")
+        return str(self.lineage_names[positions[0]])
+
+    def clade_mask(self, clade_taxid: int) -> np.ndarray:
+        """
+        Get a boolean mask over self.taxids of the species under a clade.
+
+        Args:
+            clade_taxid (int): The taxid of the clade (e.g. 9443 for Primates).
+
+        Returns:
+            np.ndarray: Boolean array of length len(self).
+
+        Raises:
+            ValueError: If the clade does not occur in any lineage.
+        """
+        return self.clade_masks([clade_taxid])[0]
+
+    def clade_masks(self, clade_taxids: Iterable[int]) -> np.ndarray:
+        """
+        Get boolean masks over self.taxids of the species under several clades.
+
+        Args:
+            clade_taxids (Iterable[int]): Taxids of the clades.
+
+        Returns:
+            np.ndarray: Boolean array of shape (number of clades, len(self)).
+
+        Raises:
+            ValueError: If a clade does not occur in any lineage.
+        """
+        if self._clade_row is None:
+            self._build_clades()
+        rows = []
+        for taxid in clade_taxids:
+            row = self._clade_row.get(int(taxid))
+            if row is None:
+                raise ValueError(f"Clade with ID '{taxid}' not found in taxonomy.")
+            rows.append(row)
+        bits = self._clade_bitmap[np.asarray(rows, dtype=np.int64)]
+        return np.unpackbits(bits, axis=1, count=len(self)).astype(bool)
+
+    def clade_species(self, clade_taxid: int) -> np.ndarray:
+        """
+        Get the taxids of all species under a clade, e.g. all primates for 9443.
+
+        The result can be fed directly into the OG filters (PresenceMatrix.og_mask,
+        filter_allowed_ids, ...).
+
+        Args:
+            clade_taxid (int): The taxid of the clade.
+
+        Returns:
+            np.ndarray: Taxids of the species, in table order.
+
+        Raises:
+            ValueError: If the clade does not occur in any lineage.
+
+        Examples:
+            >>> taxonomy = build_taxonomy_index(pd.DataFrame({
+            ...     'species_taxid': [9606, 9598, 10090],
+            ...     'species_name': ['Homo sapiens', 'Pan troglodytes', 'Mus musculus'],
+            ...     'rank': ['species', 'species', 'species'],
+            ...     'named_lineage': ['root,Primates,Homo sapiens', 'root,Primates,Pan troglodytes',
+            ...                       'root,Rodentia,Mus musculus'],
+            ...     'tax_id_lineage': ['1,9443,9606', '1,9443,9598', '1,9989,10090']}))
+            >>> taxonomy.clade_species(9443).tolist()
+            [9606, 9598]
+        """
+        return self.taxids[self.clade_mask(clade_taxid)]
+
+
+@profiled
+def build_taxonomy_index(df_species: pd.DataFrame) -> TaxonomyIndex:
+    """
+    Build a TaxonomyIndex from the taxid info dataframe (see dataframe_setup_taxid_info).
+
+    Args:
+        df_species (pd.DataFrame): The dataframe containing species information.
+
+    Returns:
+        TaxonomyIndex: The index.
+
+    Raises:
+        KeyError: If a required column is missing from the dataframe.
+        ValueError: If the lineage columns are malformed.
+
+    Examples:
+        >>> import pandas as pd
+        >>> df = pd.DataFrame({
+        ...     'species_taxid': [9606], 'species_name': ['Homo sapiens'], 'rank': ['species'],
+        ...     'named_lineage': ['root,Primates,Homo sapiens'], 'tax_id_lineage': ['1,9443,9606']})
+        >>> taxonomy = build_taxonomy_index(df)
+        >>> taxonomy
+        TaxonomyIndex(1 taxids)
+        >>> taxonomy.named_lineage(9606)
+        ['root', 'Primates', 'Homo sapiens']
     """
     try:
-        mask = df_members["clean_taxid_set"].apply(lambda s: target_taxid in s)
-    except KeyError:
+        lengths, lineage_taxids = _parse_taxid_tokens(df_species["tax_id_lineage"])
+        # some names contain ", " (e.g. "ant, tsetse, mealybug, aphid, etc. endosymbionts")
+        lineage_names = [
+            name
+            for lineage in df_species["named_lineage"].astype(str)
+            for name in re.split(r",(?! )", lineage)
+        ]
+        taxids = df_species["species_taxid"].to_numpy()
+        names = df_species["species_name"].to_numpy()
+        ranks = df_species["rank"].to_numpy()
+    except KeyError as e:
         raise KeyError(
-            "Column 'clean_taxid_set' not found. Apply clean_taxid_string to the "
-            "'species_taxid_containing_protein' column first."
+            f"Column {e} not found in dataframe. "
+            f"Available columns: {list(df_species.columns)}"
         )
-    og_col = (
-        "orthologous_group_id"
-        if "orthologous_group_id" in df_members.columns
-        else df_members.index.name
+    if len(lineage_names) != len(lineage_taxids):
+        raise ValueError(
+            "Columns 'named_lineage' and 'tax_id_lineage' have different lengths."
+        )
+    offsets = np.zeros(len(df_species) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return TaxonomyIndex(
+        taxids,
+        names,
+        ranks,
+        offsets,
+        lineage_taxids,
+        np.asarray(lineage_names, dtype=object),
     )
-    if og_col in df_members.columns:
-        return set(df_members.loc[mask, og_col])
+
+
+class TokenIndex:
+    """
+    Tokenized form of a column of comma-separated IDs in CSR layout.
+
+    Every distinct ID (token) gets an integer code; row i holds the distinct codes
+    codes[offsets[i]:offsets[i + 1]]. Built once with build_token_index, it answers
+    membership queries for any number of IDs in one vectorized pass.
+
+    Attributes:
+        tokens (np.ndarray): Distinct IDs indexed by code, as int64 if the column
+                             is purely numeric (e.g. taxids), otherwise as strings.
+        offsets (np.ndarray): Row boundaries into codes, length n_rows + 1.
+        codes (np.ndarray): Token codes of all rows, row after row.
+        counts (Optional[np.ndarray]): How often each entry of codes was listed in
+                                       its row, if parsed with counts=True.
+    """
+
+    def __init__(
+        self,
+        tokens: np.ndarray,
+        offsets: np.ndarray,
+        codes: np.ndarray,
+        counts: Optional[np.ndarray] = None,
+    ):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.codes = codes
+        self.counts = counts
+        self._lookup = None
+        self._rows = None
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __repr__(self) -> str:
+        return f"TokenIndex({len(self)} rows, {len(self.tokens)} distinct IDs)"
+
+    @property
+    def rows(self) -> np.ndarray:
+        """Row number of every entry in codes."""
+        if self._rows is None:
+            self._rows = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        return self._rows
+
+    def lookup(self, ids: Iterable) -> np.ndarray:
+        """
+        Get the codes of the given IDs, -1 for IDs that do not occur in the column.
+
+        Args:
+            ids (Iterable): IDs to look up. Non-string IDs are converted to strings.
+
+        Returns:
+            np.ndarray: Integer codes, in the order of ids.
+
+        Examples:
+            >>> index = build_token_index(pd.Series(['9606,10090', '10116']))
+            >>> index.lookup([10116, '9606', 'ENSP1']).tolist()
+            [2, 0, -1]
+        """
+        if self._lookup is None:
+            self._lookup = pd.Index(self.tokens)
+        ids = [str(item).strip() for item in ids]
+        if self.tokens.dtype == np.int64:
+            ids = [int(item) if item.isdigit() else -1 for item in ids]
+        return self._lookup.get_indexer(ids)
+
+    def token_mask(self, ids: Iterable) -> np.ndarray:
+        """
+        Get a boolean mask over the distinct tokens for the given IDs.
+
+        Args:
+            ids (Iterable): IDs to mark. IDs not in the column are ignored.
+
+        Returns:
+            np.ndarray: Boolean array of length len(self.tokens).
+        """
+        codes = self.lookup(ids)
+        mask = np.zeros(len(self.tokens), dtype=bool)
+        mask[codes[codes >= 0]] = True
+        return mask
+
+    def count_matches(self, ids: Iterable) -> np.ndarray:
+        """
+        Count for every row how many of the given (distinct) IDs it contains.
+
+        Args:
+            ids (Iterable): IDs to count. Non-string IDs are converted to strings.
+
+        Returns:
+            np.ndarray: Integer array of length len(self).
+
+        Examples:
+            >>> index = build_token_index(pd.Series(['A,B', 'B,C', 'A,A']))
+            >>> index.count_matches(['A', 'B']).tolist()
+            [2, 1, 1]
+        """
+        hit = self.token_mask(ids)[self.codes]
+        return np.bincount(self.rows[hit], minlength=len(self))
+
+    def allowed_masks(self, allowed_sets: List[Iterable]) -> np.ndarray:
+        """
+        Test for many sets of allowed IDs at once which rows contain ONLY allowed IDs.
+
+        Each allowed set becomes one bit in a per-token bitmap (64 sets per uint64
+        word), the bitmaps of all tokens of a row are AND-ed together in a single
+        np.bitwise_and.reduceat, and a row passes for a set if its bit survives.
+        Empty rows never pass.
+
+        Args:
+            allowed_sets (List[Iterable]): Sets of allowed IDs.
+
+        Returns:
+            np.ndarray: Boolean array of shape (len(self), len(allowed_sets)).
+
+        Examples:
+            >>> index = build_token_index(pd.Series(['1,2,3', '4,5', '2,3', None]))
+            >>> index.allowed_masks([[1, 2, 3], [2, 3, 4, 5]]).tolist()
+            [[True, False], [False, True], [True, True], [False, False]]
+        """
+        n_sets = len(allowed_sets)
+        n_words = max(1, -(-n_sets // 64))
+        bitmap = np.zeros((len(self.tokens), n_words), dtype=np.uint64)
+        for i, allowed in enumerate(allowed_sets):
+            bitmap[self.token_mask(allowed), i // 64] |= np.uint64(1) << np.uint64(
+                i % 64
+            )
+
+        masks = np.zeros((len(self), n_sets), dtype=bool)
+        non_empty = np.diff(self.offsets) > 0
+        if not non_empty.any():
+            return masks
+        row_bits = np.bitwise_and.reduceat(
+            bitmap[self.codes], self.offsets[:-1][non_empty], axis=0
+        )
+        for i in range(n_sets):
+            masks[non_empty, i] = (
+                row_bits[:, i // 64] >> np.uint64(i % 64)
+            ) & np.uint64(1) == 1
+        return masks
+
+
+def _fast_int_split(joined: str, expected: int) -> Optional[np.ndarray]:
+    """
+    Convert a string of comma-separated integers to an int64 array in one NumPy call.
+
+    Args:
+        joined (str): Comma-separated integers, e.g. "9606,10090".
+        expected (int): Expected number of integers.
+
+    Returns:
+        Optional[np.ndarray]: The integers, or None if the string is not purely
+                              numeric (or the count does not match).
+
+    Examples:
+        >>> _fast_int_split("9606, 10090", 2).tolist()
+        [9606, 10090]
+        >>> _fast_int_split("A,B", 2) is None
+        True
+    """
+    with warnings.catch_warnings():
+        # malformed input only triggers a DeprecationWarning and a truncated result
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            values = np.fromstring(joined, dtype=np.int64, sep=",")
+        except (ValueError, DeprecationWarning):
+            return None
+    if len(values) != expected:
+        return None
+    return values
+
+
+@profiled
+def build_token_index(series: pd.Series) -> TokenIndex:
+    """
+    Tokenize a column of comma-separated IDs into a TokenIndex.
+
+    Whitespace around the IDs is ignored, missing values become empty rows and
+    IDs listed several times in a row are kept once. Purely numeric columns
+    (like 'species_taxid_containing_protein') are parsed in one NumPy call.
+
+    Args:
+        series (pd.Series): Column with comma-separated IDs.
+
+    Returns:
+        TokenIndex: The tokenized column, rows in the order of series.
+
+    Examples:
+        >>> import pandas as pd
+        >>> index = build_token_index(pd.Series(['9606, 10090', None, '9606,9606']))
+        >>> index
+        TokenIndex(3 rows, 2 distinct IDs)
+        >>> index.offsets.tolist(), index.tokens[index.codes].tolist()
+        ([0, 2, 2, 3], [9606, 10090, 9606])
+    """
+    present = series.notna().to_numpy()
+    strings = series[present].astype(str).tolist()
+    lengths = np.zeros(len(series), dtype=np.int64)
+    lengths[present] = [string.count(",") + 1 for string in strings]
+    joined = ",".join(strings)
+
+    values = None
+    if "." not in joined:
+        values = _fast_int_split(joined, lengths.sum())
+    if values is None:
+        values = pd.Series(
+            [token.strip() for token in joined.split(",")] if strings else [],
+            dtype=object,
+        )
+    codes, uniques = pd.factorize(values, sort=False)
+    tokens = np.asarray(uniques, dtype=np.int64 if values.dtype == np.int64 else object)
+    return _token_index_from_codes(tokens, lengths, codes)
+
+
+def _token_index_from_codes(
+    tokens: np.ndarray, lengths: np.ndarray, codes: np.ndarray, counts: bool = False
+) -> TokenIndex:
+    """
+    Assemble a TokenIndex from per-row lengths and flat token codes, dropping IDs
+    listed several times in the same row.
+
+    Args:
+        tokens (np.ndarray): Distinct tokens, indexed by code.
+        lengths (np.ndarray): Number of entries per row.
+        codes (np.ndarray): Token codes of all entries, row after row.
+        counts (bool): Keep how often each distinct code was listed per row.
+                       Defaults to False.
+
+    Returns:
+        TokenIndex: The index, with distinct codes per row.
+    """
+    n_rows = len(lengths)
+    rows = np.repeat(np.arange(n_rows), lengths)
+    keys = rows * max(len(tokens), 1) + codes
+    copies = np.ones(len(keys), dtype=np.int64) if counts else None
+    # sorting is cheap, np.unique is not
+    if len(keys) and (np.diff(keys) <= 0).any():
+        keys = np.sort(keys)
+        keep = np.ones(len(keys), dtype=bool)
+        keep[1:] = keys[1:] != keys[:-1]
+        if counts:
+            copies = np.diff(np.append(np.flatnonzero(keep), len(keys)))
+        keys = keys[keep]
+        rows, codes = np.divmod(keys, len(tokens))
+        lengths = np.bincount(rows, minlength=n_rows)
+
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return TokenIndex(tokens, offsets, codes.astype(np.int32), copies)
+
+
+@profiled
+def parse_taxid_column(
+    series: pd.Series,
+    workers: Optional[int] = None,
+    chunk_rows: int = 20000,
+    counts: bool = False,
+) -> TokenIndex:
+    """
+    Parse a column of comma-separated taxids or protein IDs with taxid prefixes
+    into a compact integer TokenIndex, using several processes.
+
+    The rows are split into chunks of chunk_rows rows which are parsed in parallel
+    by a process pool (see _parse_taxid_chunk); the per-chunk integer arrays are
+    then combined into one index. Tokens are the sorted distinct taxids, each row
+    holds the distinct taxids of the row as int32 codes. Inputs of a single chunk
+    are parsed in-process.
+
+    Callers running this from a script must guard the script's entry point with
+    ``if __name__ == "__main__":`` (required by multiprocessing on spawn platforms).
+
+    Args:
+        series (pd.Series): Column with values like "9606,10090" or
+                            "9606.ENSP123,10090.ENSMUSP456".
+        workers (Optional[int]): Number of processes. Defaults to os.cpu_count();
+                                 1 parses in-process.
+        chunk_rows (int): Rows per chunk. Defaults to 20000.
+        counts (bool): Also keep how often each taxid is listed per row (e.g. the
+                       copy number of a species in a protein_id list, see
+                       build_copy_number_matrix). Defaults to False.
+
+    Returns:
+        TokenIndex: Integer tokens (taxids) in CSR layout, rows in the order of series.
+
+    Raises:
+        ValueError: If the column contains non-numeric taxonomic ID prefixes.
+
+    Examples:
+        >>> import pandas as pd
+        >>> index = parse_taxid_column(pd.Series(['9606.A,9606.B,10090.C', '562.D']))
+        >>> index.tokens.tolist(), index.offsets.tolist(), index.codes.tolist()
+        ([562, 9606, 10090], [0, 2, 3], [1, 2, 0])
+    """
+    strings = series.astype(str).tolist()
+    chunks = [
+        strings[start : start + chunk_rows]
+        for start in range(0, len(strings), chunk_rows)
+    ]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            parts = list(pool.map(_parse_taxid_chunk, chunks))
     else:
-        return set(df_members.loc[mask].index)
+        parts = [_parse_taxid_chunk(chunk) for chunk in chunks]
+
+    if any(part is None for part in parts):
+        raise ValueError(
+            f"Failed to parse taxonomic IDs from column '{series.name}'. "
+            f"Expected format: 'TAXID.PROTEINID' (e.g., '9606.ENSP00000123')."
+        )
+    lengths = np.concatenate([part[0] for part in parts] or [np.zeros(0, np.int64)])
+    values = np.concatenate([part[1] for part in parts] or [np.zeros(0, np.int64)])
+    codes, taxids = pd.factorize(values, sort=True)
+    return _token_index_from_codes(
+        np.asarray(taxids, dtype=np.int64), lengths, codes, counts=counts
+    )
+
+
+@profiled
+def filter_by_ids(
+    df: pd.DataFrame,
+    column: str,
+    include_ids: List[str],
+    exclude_ids: Optional[List[str]] = None,
+    index: Optional[TokenIndex] = None,
+) -> pd.DataFrame:
+    """
+    Filters a dataframe based on presence or absence of specific IDs
+    within a comma-separated string column.
+
+    IDs are matched as whole comma-separated entries, so "9606" does not match
+    "19606" nor a protein accession like "9606.ENSP123". The column is tokenized
+    once (see build_token_index) and all include/exclude IDs are tested in a
+    single vectorized pass, so the cost hardly grows with the number of IDs.
+
+    Args:
+        df (pd.DataFrame): The input dataframe.
+        column (str): The column name containing comma-separated IDs.
+        include_ids (List[str]): List of IDs that MUST be present.
+        exclude_ids (Optional[List[str]]): List of IDs that MUST NOT be present. Defaults to None.
+        index (Optional[TokenIndex]): Token index of df[column], to reuse it across calls.
+                                      Built on the fly if None. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The filtered dataframe.
+
+    Raises:
+        KeyError: If the specified column is not found in the dataframe.
+        ValueError: If the token index does not match the dataframe.
+
+    Examples:
+        >>> import pandas as pd
+        >>> data = {'id': [1, 2, 3], 'tags': ['A,B', 'B,C', 'A,C']}
+        >>> df = pd.DataFrame(data)
+        >>> # Include 'A', Exclude 'B' -> Should match row 3 ('A,C')
+        >>> filter_by_ids(df, 'tags', ['A'], ['B'])
+           id tags
+        2   3  A,C
+        >>> # Include 'B' -> Should match row 1 and 2
+        >>> filter_by_ids(df, 'tags', ['B'], [])
+           id tags
+        0   1  A,B
+        1   2  B,C
+    """
+    if exclude_ids is None:
+        exclude_ids = []
+
+    if index is None:
+        try:
+            index = build_token_index(df[column])
+        except KeyError:
+            raise KeyError(
+                f"Column '{column}' not found in dataframe. "
+                f"Available columns: {list(df.columns)}"
+            )
+    elif len(index) != len(df):
+        raise ValueError(
+            f"Token index has {len(index)} rows but the dataframe has {len(df)}."
+        )
+
+    # 1. Must include ALL of these
+    include_set = set(str(item) for item in include_ids)
+    mask = index.count_matches(include_set) == len(include_set)
+
+    # 2. Must include NONE of these
+    if exclude_ids:
+        mask &= index.count_matches(exclude_ids) == 0
+
+    return df[mask]
+
+
+@profiled
+def filter_by_species_names(
+    df: pd.DataFrame, column: str, species_names, df_species
+) -> pd.DataFrame:
+    """
+    Filter dataframe to include only rows where the specified column
+    contains any of the given species (by name).
+
+    This is a convenience wrapper that converts species names to IDs
+    and then filters the dataframe.
+
+    Args:
+        df: Dataframe to filter
+        column: Column name containing species IDs
+        species_names: Iterable of species names to include
+        df_species: Species dataframe or TaxonomyIndex for name-to-ID mapping
+
+    Returns:
+        pd.DataFrame: Filtered dataframe
+
+    Raises:
+        ValueError: If any species name in the iterable is not found in the species dataframe.
+        KeyError: If the specified column is not found in the dataframe.
+
+    Examples:
+        >>> import pandas as pd
+        >>> df = pd.DataFrame({'ids': ['562,9606', '9606', '562']})
+        >>> species_df = pd.DataFrame({
+        ...     'species_name': ['E. coli', 'H. sapiens'],
+        ...     'species_taxid': [562, 9606]
+        ... })
+        >>> filter_by_species_names(df, 'ids', ['E. coli', 'H. sapiens'], species_df)
+           ids
+        0  562,9606
+        1  9606
+        2  562
+    """
+
+    try:
+        species_ids = get_species_ids_from_names(species_names, df_species)
+    except ValueError as e:
+        raise ValueError(f"Failed to resolve species names to IDs: {e}")
+    return filter_allowed_ids(df, column, species_ids)
+
+
+@profiled
+def filter_allowed_ids(
+    df: pd.DataFrame,
+    column: str,
+    allowed_ids: Set[str],
+    index: Optional[TokenIndex] = None,
+) -> pd.DataFrame:
+    """
+    Filter a DataFrame to include only rows where all IDs in a column are in the allowed set.
+    The column is tokenized once (see build_token_index) and the subset test is a
+    bitmap test over the integer token codes (see TokenIndex.allowed_masks), instead
+    of splitting every row and building a Python set per row.
+    Args:
+        df (pd.DataFrame): The input DataFrame to filter.
+        column (str): The name of the column containing IDs to check. Values can be single IDs or
+                      multiple IDs separated by commas (surrounding whitespace is ignored).
+        allowed_ids (List[str]): A list of IDs that are considered allowed. Non-string IDs will be
+                                 converted to strings for comparison.
+        index (Optional[TokenIndex]): Token index of df[column], to reuse it across calls.
+                                      Built on the fly if None. Defaults to None.
+    Returns:
+        pd.DataFrame: A filtered DataFrame containing only rows where all IDs in the specified column
+                      are present in the allowed_ids set. The original DataFrame is not modified.
+    Raises:
+        KeyError: If the specified column is not found in the dataframe.
+        ValueError: If the token index does not match the dataframe.
+    Example:
+        >>> df = pd.DataFrame({'ids': ['1,2,3', '4,5', '2,3']})
+        >>> allowed = ['1', '2', '3', '4', '5']
+        >>> filter_allowed_ids(df, 'ids', allowed)
+           ids
+        0  1,2,3
+        1  4,5
+        2  2,3
+    """
+    masks = filter_allowed_ids_batch(df, column, {"allowed": allowed_ids}, index=index)
+    return df[masks["allowed"]]
+
+
+@profiled
+def filter_allowed_ids_batch(
+    df: pd.DataFrame,
+    column: str,
+    allowed_sets: dict,
+    index: Optional[TokenIndex] = None,
+) -> pd.DataFrame:
+    """
+    Test many candidate sets of allowed IDs (e.g. clades) against a column in one call.
+
+    Batched version of filter_allowed_ids: the column is tokenized once and all
+    sets are tested together (see TokenIndex.allowed_masks).
+
+    Args:
+        df (pd.DataFrame): The input DataFrame.
+        column (str): The name of the column containing comma-separated IDs.
+        allowed_sets (dict): Mapping of a name (e.g. "primates") to its allowed IDs.
+        index (Optional[TokenIndex]): Token index of df[column], to reuse it across calls.
+                                      Built on the fly if None. Defaults to None.
+
+    Returns:
+        pd.DataFrame: Boolean DataFrame with the index of df and one column per name,
+                      True where all IDs of the row are in that allowed set.
+
+    Raises:
+        KeyError: If the specified column is not found in the dataframe.
+        ValueError: If the token index does not match the dataframe.
+
+    Examples:
+        >>> import pandas as pd
+        >>> df = pd.DataFrame({'ids': ['9606,9598', '9606,10090', '9598']})
+        >>> filter_allowed_ids_batch(df, 'ids', {'apes': [9606, 9598], 'human': [9606]})
+            apes  human
+        0   True  False
+        1  False  False
+        2   True  False
+    """
+    if index is None:
+        try:
+            index = build_token_index(df[column])
+        except KeyError:
+            raise KeyError(
+                f"Column '{column}' not found in dataframe. "
+                f"Available columns: {list(df.columns)}"
+            )
+    elif len(index) != len(df):
+        raise ValueError(
+            f"Token index has {len(index)} rows but the dataframe has {len(df)}."
+        )
+    names = list(allowed_sets)
+    masks = index.allowed_masks([allowed_sets[name] for name in names])
+    return pd.DataFrame(masks, index=df.index, columns=names)
+
+
+def clean_taxid_string(raw_string: str) -> Set[int]:
+    """
+    Extract unique taxonomic IDs from a protein ID string.
+
+    Parses a comma-separated string of protein IDs with taxonomic prefixes
+    and returns a set of unique taxonomic IDs.
+
+    Args:
+        raw_string (str): Comma-separated protein IDs with taxid prefixes
+                         (e.g., "9606.ENSP123, 10090.ENSMUSP456")
+
+    Returns:
+        Set[int]: Set of unique taxonomic IDs extracted from the string
+
+    Raises:
+        ValueError: If the string contains non-numeric taxonomic ID prefixes.
+
+    Examples:
+        >>> clean_taxid_string("9606.ENSP123, 10090.ENSMUSP456, 10116.ENSRNOP789")
+        {9606, 10090, 10116}
+        >>> clean_taxid_string("562.ECOLI_001")
+        {562}
+    """
+    s = str(raw_string)
+    items = s.split(",")
+    try:
+        clean_set = {int(item.split(".")[0].strip()) for item in items}
+    except ValueError:
+        raise ValueError(
+            f"Failed to parse taxonomic IDs from string: '{raw_string}'. "
+            f"Expected format: 'TAXID.PROTEINID' (e.g., '9606.ENSP00000123')."
+        )
+    return clean_set
+
+
+@profiled
+def get_og_set(target_taxid: int, df_members: pd.DataFrame) -> Set[str]:
+    """
+    Get all orthologous group IDs containing a specific taxonomic ID.
+
+    Filters the members dataframe to find all orthologous groups that contain
+    the specified taxonomic ID. Requires that the dataframe has a 'clean_taxid_set'
+    column created by applying clean_taxid_string.
+
+    Args:
+        target_taxid (int): The taxonomic ID to search for
+        df_members (pd.DataFrame): Members dataframe with 'clean_taxid_set' column
+                                   and 'orthologous_group_id' column or index
+
+    Returns:
+        Set[str]: Set of orthologous group IDs containing the target taxonomic ID
+
+    Raises:
+        KeyError: If the 'clean_taxid_set' column is missing from the dataframe.
+
+    Examples:
+        >>> import pandas as pd
+        >>> df = pd.DataFrame({
+        ...     'orthologous_group_id': ['OG1', 'OG2', 'OG3'],
+        ...     'clean_taxid_set': [{9606, 10090}, {9606}, {10090, 10116}]
+        ... })
+        >>> get_og_set(9606, df)
+        {'OG1', 'OG2'}
+    """
+    try:
+        mask = df_members["clean_taxid_set"].apply(lambda s: target_taxid in s)
+    except KeyError:
+        raise KeyError(
+            "Column 'clean_taxid_set' not found. Apply clean_taxid_string to the "
+            "'species_taxid_containing_protein' column first."
+        )
+    og_col = (
+        "orthologous_group_id"
+        if "orthologous_group_id" in df_members.columns
+        else df_members.index.name
+    )
+    if og_col in df_members.columns:
+        return set(df_members.loc[mask, og_col])
+    else:
+        return set(df_members.loc[mask].index)
+
+
+# -- OG x species presence matrix --
+class PresenceMatrix:
+    """
+    Boolean presence/absence matrix of orthologous groups (rows) x species taxids (columns).
+
+    Built once from the members dataframe (see build_presence_matrix), so that
+    OG set queries for any species or union of species are column operations
+    on a NumPy array instead of a Python scan over every row.
+
+    Attributes:
+        og_ids (np.ndarray): Orthologous group IDs, one per matrix row.
+        taxids (np.ndarray): Sorted species taxids, one per matrix column.
+        matrix (np.ndarray): Boolean array of shape (len(og_ids), len(taxids)).
+    """
+
+    def __init__(self, og_ids: np.ndarray, taxids: np.ndarray, matrix: np.ndarray):
+        self.og_ids = np.asarray(og_ids)
+        self.taxids = np.asarray(taxids)
+        self.matrix = matrix
+        self._column = {int(taxid): i for i, taxid in enumerate(self.taxids)}
+
+    def __repr__(self) -> str:
+        return f"PresenceMatrix({len(self.og_ids)} OGs x {len(self.taxids)} species)"
+
+    def species_mask(self, taxids: Iterable[int]) -> np.ndarray:
+        """
+        Get a boolean mask over the matrix columns for the given taxids.
+        Taxids that do not occur in the data are ignored.
+
+        Args:
+            taxids (Iterable[int]): Species taxids.
+
+        Returns:
+            np.ndarray: Boolean array of length len(self.taxids).
+        """
+        mask = np.zeros(len(self.taxids), dtype=bool)
+        for taxid in taxids:
+            col = self._column.get(int(taxid))
+            if col is not None:
+                mask[col] = True
+        return mask
+
+    def og_mask(self, taxids: Iterable[int], how: str = "any") -> np.ndarray:
+        """
+        Get a boolean mask over the orthologous groups containing the given species.
+
+        Args:
+            taxids (Iterable[int]): Species taxids.
+            how (str): "any" for OGs containing at least one of the species (union),
+                       "all" for OGs containing every species (intersection).
+
+        Returns:
+            np.ndarray: Boolean array of length len(self.og_ids).
+
+        Raises:
+            ValueError: If how is not "any" or "all".
+
+        Examples:
+            >>> pm = PresenceMatrix(['OG1', 'OG2', 'OG3'], [9606, 10090, 10116],
+            ...                     np.array([[1, 1, 0], [1, 0, 0], [0, 1, 1]], dtype=bool))
+            >>> pm.og_mask([10090, 10116], how="any").tolist()
+            [True, False, True]
+            >>> pm.og_mask([10090, 10116], how="all").tolist()
+            [False, False, True]
+        """
+        taxids = [int(taxid) for taxid in taxids]
+        cols = self.species_mask(taxids)
+        if how == "any":
+            return self.matrix[:, cols].any(axis=1)
+        if how == "all":
+            # a species missing from the data can never be present
+            if cols.sum() < len(set(taxids)):
+                return np.zeros(len(self.og_ids), dtype=bool)
+            return self.matrix[:, cols].all(axis=1)
+        raise ValueError(f"Invalid value for how: '{how}'. Use 'any' or 'all'.")
+
+    def filter_mask(
+        self, include_ids: Iterable[int], exclude_ids: Optional[Iterable[int]] = None
+    ) -> np.ndarray:
+        """
+        Get a boolean mask over the orthologous groups that contain ALL of the
+        included species and NONE of the excluded species.
+
+        Args:
+            include_ids (Iterable[int]): Taxids that MUST be present.
+            exclude_ids (Optional[Iterable[int]]): Taxids that MUST NOT be present.
+
+        Returns:
+            np.ndarray: Boolean array of length len(self.og_ids).
+
+        Examples:
+            >>> pm = PresenceMatrix(['OG1', 'OG2', 'OG3'], [9606, 10090, 10116],
+            ...                     np.array([[1, 1, 0], [1, 0, 0], [0, 1, 1]], dtype=bool))
+            >>> pm.filter_mask([9606], [10090]).tolist()
+            [False, True, False]
+        """
+        mask = self.og_mask(include_ids, how="all")
+        if exclude_ids is not None:
+            mask &= ~self.og_mask(exclude_ids, how="any")
+        return mask
+
+    def og_set(self, taxids: Iterable[int], how: str = "any") -> Set[str]:
+        """
+        Get the orthologous group IDs containing the given species.
+
+        Args:
+            taxids (Iterable[int]): Species taxids.
+            how (str): "any" (union) or "all" (intersection), see og_mask.
+
+        Returns:
+            Set[str]: Set of orthologous group IDs.
+
+        Examples:
+            >>> pm = PresenceMatrix(['OG1', 'OG2', 'OG3'], [9606, 10090, 10116],
+            ...                     np.array([[1, 1, 0], [1, 0, 0], [0, 1, 1]], dtype=bool))
+            >>> sorted(pm.og_set([9606]))
+            ['OG1', 'OG2']
+        """
+        return set(self.og_ids[self.og_mask(taxids, how=how)].tolist())
+
+    def species_counts(self) -> np.ndarray:
+        """
+        Get the number of species present in each orthologous group.
+
+        Returns:
+            np.ndarray: Integer array of length len(self.og_ids).
+        """
+        return self.matrix.sum(axis=1)
+
+    def coverage(self, taxids: Optional[Iterable[int]] = None) -> "CoverageHistogram":
+        """
+        Count the species per orthologous group once and build their distribution.
+
+        Args:
+            taxids (Optional[Iterable[int]]): Species (e.g. a clade, see
+                                              TaxonomyIndex.clade_species) to count.
+                                              Defaults to all species of the data.
+
+        Returns:
+            CoverageHistogram: Species counts per OG and their cumulative distribution.
+
+        Examples:
+            >>> pm = PresenceMatrix(['OG1', 'OG2', 'OG3'], [9606, 9598, 10090],
+            ...                     np.array([[1, 1, 1], [1, 1, 0], [1, 0, 0]], dtype=bool))
+            >>> pm.coverage().at_least.tolist()
+            [3, 3, 2, 1]
+            >>> pm.coverage([9606, 9598]).n_at_least_fraction(1.0)
+            2
+        """
+        if taxids is None:
+            return CoverageHistogram(self.species_counts(), len(self.taxids))
+        cols = self.species_mask(taxids)
+        return CoverageHistogram(self.matrix[:, cols].sum(axis=1), int(cols.sum()))
+
+    def cooccurrence(
+        self, block_rows: int = 65536, workers: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Count the orthologous groups shared by every pair of species.
+
+        Computes the species x species product M.T @ M of the presence matrix in
+        blocks of rows, so only one float32 block per worker is materialized. The
+        blocks are multiplied on a thread pool (the BLAS call releases the GIL)
+        and their exact integer counts summed.
+
+        Args:
+            block_rows (int): OGs per block, at most 2**24 so float32 counts stay
+                              exact. Defaults to 65536.
+            workers (Optional[int]): Number of threads. Defaults to os.cpu_count().
+
+        Returns:
+            np.ndarray: Symmetric int64 array of shape (len(taxids), len(taxids));
+                        the diagonal holds the number of OGs of each species.
+
+        Examples:
+            >>> pm = PresenceMatrix(['OG1', 'OG2', 'OG3'], [9606, 9598, 10090],
+            ...                     np.array([[1, 1, 1], [1, 1, 0], [1, 0, 0]], dtype=bool))
+            >>> pm.cooccurrence(block_rows=2).tolist()
+            [[3, 2, 1], [2, 2, 1], [1, 1, 1]]
+        """
+        if not 0 < block_rows <= 2**24:
+            raise ValueError(
+                f"block_rows must be between 1 and 2**24, got {block_rows}."
+            )
+        n_species = len(self.taxids)
+
+        def block_product(start: int) -> np.ndarray:
+            block = self.matrix[start : start + block_rows].astype(np.float32)
+            return np.rint(block.T @ block).astype(np.int64)
+
+        starts = range(0, len(self.og_ids), block_rows)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        shared = np.zeros((n_species, n_species), dtype=np.int64)
+        if workers > 1 and len(starts) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(starts))) as pool:
+                for part in pool.map(block_product, starts):
+                    shared += part
+        else:
+            for start in starts:
+                shared += block_product(start)
+        return shared
+
+
+class CoverageHistogram:
+    """
+    Species counts per orthologous group with their cumulative distribution.
+
+    Built once (see PresenceMatrix.coverage), it answers "universal at 90/95/99/100%"
+    or "present in >= N species" for any threshold without touching the raw data again.
+
+    Attributes:
+        counts (np.ndarray): Number of species present, per OG (presence matrix order).
+        n_species (int): Number of species counted (100% coverage).
+        histogram (np.ndarray): histogram[k] is the number of OGs with exactly k species.
+        at_least (np.ndarray): at_least[k] is the number of OGs with k or more species.
+    """
+
+    def __init__(self, counts: np.ndarray, n_species: int):
+        self.counts = counts
+        self.n_species = n_species
+        self.histogram = np.bincount(counts, minlength=n_species + 1)
+        self.at_least = np.cumsum(self.histogram[::-1])[::-1]
+
+    def __repr__(self) -> str:
+        return f"CoverageHistogram({len(self.counts)} OGs, {self.n_species} species)"
+
+    def min_species(self, fraction: float) -> int:
+        """
+        Get the smallest species count reaching a coverage fraction.
+
+        Args:
+            fraction (float): Coverage between 0 and 1, e.g. 0.99.
+
+        Returns:
+            int: Minimum number of species.
+
+        Examples:
+            >>> CoverageHistogram(np.array([160, 161]), 161).min_species(0.99)
+            160
+        """
+        # round away float noise like 0.95 * 100 = 95.00000000000001
+        return int(np.ceil(round(fraction * self.n_species, 9)))
+
+    def n_at_least(self, n_species: int) -> int:
+        """Number of OGs present in at least n_species species."""
+        if n_species > self.n_species:
+            return 0
+        return int(self.at_least[max(n_species, 0)])
+
+    def n_at_least_fraction(self, fraction: float) -> int:
+        """Number of OGs present in at least the given fraction of species."""
+        return self.n_at_least(self.min_species(fraction))
+
+    def mask(self, fraction: float) -> np.ndarray:
+        """Boolean mask over the OGs present in at least the given fraction of species."""
+        return self.counts >= self.min_species(fraction)
+
+    def sweep(self, fractions: Iterable[float]) -> pd.DataFrame:
+        """
+        Tabulate the number of OGs for several coverage thresholds.
+
+        Args:
+            fractions (Iterable[float]): Coverage thresholds between 0 and 1.
+
+        Returns:
+            pd.DataFrame: Columns fraction, min_species and num_of_ogs.
+
+        Examples:
+            >>> CoverageHistogram(np.array([1, 2, 3, 3]), 3).sweep([0.5, 1.0])
+               fraction  min_species  num_of_ogs
+            0       0.5            2           3
+            1       1.0            3           2
+        """
+        rows = [
+            (fraction, self.min_species(fraction), self.n_at_least_fraction(fraction))
+            for fraction in fractions
+        ]
+        return pd.DataFrame(rows, columns=["fraction", "min_species", "num_of_ogs"])
+
+
+@profiled
+def species_cooccurrence(
+    presence: PresenceMatrix,
+    taxonomy: Optional["TaxonomyIndex"] = None,
+    block_rows: int = 65536,
+    workers: Optional[int] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Compare all species pairs by their shared orthologous groups.
+
+    Args:
+        presence (PresenceMatrix): OG x species presence matrix.
+        taxonomy (Optional[TaxonomyIndex]): Labels rows and columns with species
+                                            names. Defaults to None (taxids).
+        block_rows (int): OGs per block, see PresenceMatrix.cooccurrence.
+        workers (Optional[int]): Number of threads, see PresenceMatrix.cooccurrence.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: Species x species tables of the number
+        of shared OGs (diagonal: OGs per species) and of the Jaccard similarity
+        |A & B| / |A | B| of their OG sets (0 for two species without OGs).
+
+    Raises:
+        ValueError: If a taxid of the presence matrix is not in the taxonomy.
+
+    Examples:
+        >>> pm = PresenceMatrix(['OG1', 'OG2', 'OG3'], [9598, 9606, 10090],
+        ...                     np.array([[1, 1, 1], [1, 1, 0], [0, 1, 0]], dtype=bool))
+        >>> shared, jaccard = species_cooccurrence(pm)
+        >>> shared.to_numpy().tolist()
+        [[2, 2, 1], [2, 3, 1], [1, 1, 1]]
+        >>> jaccard.loc[10090].round(2).tolist()
+        [0.5, 0.33, 1.0]
+    """
+    shared = presence.cooccurrence(block_rows=block_rows, workers=workers)
+    n_ogs = np.diag(shared)
+    union = n_ogs[:, None] + n_ogs[None, :] - shared
+    jaccard = np.divide(
+        shared, union, out=np.zeros(shared.shape, dtype=np.float64), where=union > 0
+    )
+    labels = (
+        pd.Index(taxonomy.resolve_ids(presence.taxids), name="species_name")
+        if taxonomy is not None
+        else pd.Index(presence.taxids, name="taxid")
+    )
+    return (
+        pd.DataFrame(shared, index=labels, columns=labels),
+        pd.DataFrame(jaccard, index=labels, columns=labels),
+    )
+
+
+class LineageLossScan:
+    """
+    Dollo-style gene losses of every clade of the taxonomy tree.
+
+    An orthologous group counts as lost in a clade if it is absent from all species
+    of the clade but present in its sister species (the other species under the
+    parent clade) and in the outgroup (the species under the grandparent clade
+    but outside the parent). Built once with lineage_loss_scan; the lost OGs of
+    clade i are og_ids[rows[offsets[i]:offsets[i + 1]]].
+
+    Attributes:
+        clades (pd.DataFrame): One row per clade with columns clade_taxid, clade_name,
+                               parent_taxid, depth, n_species, n_sister_species,
+                               n_outgroup_species and n_lost.
+        offsets (np.ndarray): Clade boundaries into rows, length len(clades) + 1.
+        rows (np.ndarray): Presence matrix rows of the lost OGs, clade after clade.
+        og_ids (np.ndarray): Orthologous group IDs of the presence matrix.
+    """
+
+    def __init__(
+        self,
+        clades: pd.DataFrame,
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        og_ids: np.ndarray,
+        aliases: Optional[Dict[int, int]] = None,
+    ):
+        self.clades = clades
+        self.offsets = offsets
+        self.rows = rows
+        self.og_ids = og_ids
+        # taxids of collapsed single-child nodes (e.g. a genus with one species)
+        # point to the clade row they were merged into
+        self._position = {int(t): i for i, t in enumerate(clades["clade_taxid"])}
+        for taxid, position in (aliases or {}).items():
+            self._position.setdefault(int(taxid), position)
+
+    def __len__(self) -> int:
+        return len(self.clades)
+
+    def __repr__(self) -> str:
+        return f"LineageLossScan({len(self)} clades, {len(self.rows)} losses)"
+
+    def lost_ogs(self, clade) -> np.ndarray:
+        """
+        Get the orthologous groups lost in a clade.
+
+        Args:
+            clade (int or str): Taxid or name of the clade (or species).
+
+        Returns:
+            np.ndarray: Lost orthologous group IDs, in presence matrix order.
+
+        Raises:
+            ValueError: If the clade is not part of the scan.
+        """
+        if isinstance(clade, str):
+            matches = np.flatnonzero(self.clades["clade_name"].to_numpy() == clade)
+            position = int(matches[0]) if len(matches) == 1 else None
+        else:
+            position = self._position.get(int(clade))
+        if position is None:
+            raise ValueError(
+                f"Clade '{clade}' not found in the scan or has duplicate entries. "
+                "Clades need a parent and a grandparent with other species."
+            )
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.og_ids[self.rows[start:end]]
+
+
+@profiled
+def lineage_loss_scan(
+    presence: PresenceMatrix, taxonomy: "TaxonomyIndex", block_rows: int = 16384
+) -> LineageLossScan:
+    """
+    Find the OGs lost in every clade of the taxonomy tree in one pass.
+
+    The tree is built from the lineages of the species of the presence matrix;
+    nodes with a single child (same species set) are merged into the deepest one.
+    OG presence is then propagated bottom-up as packed bit rows (one bit per OG):
+    every clade is the OR of its children, and the sister and outgroup presence
+    of all clades follow from OR-ing siblings, so the whole tree costs a few
+    vectorized passes over the OGs. OGs are processed in blocks of block_rows.
+
+    Args:
+        presence (PresenceMatrix): OG x species presence matrix.
+        taxonomy (TaxonomyIndex): Lineages of the species of presence.
+        block_rows (int): OGs per block. Defaults to 16384.
+
+    Returns:
+        LineageLossScan: Loss counts and lost OGs of every clade with a grandparent.
+
+    Raises:
+        ValueError: If a species of the presence matrix is not in the taxonomy.
+
+    Examples:
+        >>> taxonomy = build_taxonomy_index(pd.DataFrame({
+        ...     'species_taxid': [9606, 9598, 10090, 7955],
+        ...     'species_name': ['Homo sapiens', 'Pan troglodytes', 'Mus musculus', 'Danio rerio'],
+        ...     'rank': ['species'] * 4,
+        ...     'named_lineage': ['root,Mammalia,Primates,Homo sapiens',
+        ...                       'root,Mammalia,Primates,Pan troglodytes',
+        ...                       'root,Mammalia,Mus musculus', 'root,Danio rerio'],
+        ...     'tax_id_lineage': ['1,40674,9443,9606', '1,40674,9443,9598',
+        ...                        '1,40674,10090', '1,7955']}))
+        >>> pm = PresenceMatrix(['OG1', 'OG2', 'OG3', 'OG4'], [7955, 9598, 9606, 10090],
+        ...                     np.array([[1, 1, 1, 1], [1, 1, 1, 0], [1, 1, 0, 1], [1, 0, 0, 1]],
+        ...                              dtype=bool))
+        >>> scan = lineage_loss_scan(pm, taxonomy)
+        >>> scan.clades[['clade_name', 'n_sister_species', 'n_outgroup_species', 'n_lost']]
+                clade_name  n_sister_species  n_outgroup_species  n_lost
+        0         Primates                 1                   1       1
+        1     Mus musculus                 2                   1       1
+        2  Pan troglodytes                 1                   1       0
+        3     Homo sapiens                 1                   1       1
+        >>> scan.lost_ogs('Primates').tolist(), scan.lost_ogs(10090).tolist()
+        (['OG4'], ['OG2'])
+    """
+    n_species = len(presence.taxids)
+    lineages = [taxonomy.lineage(taxid) for taxid in presence.taxids]
+    names = [taxonomy.named_lineage(taxid) for taxid in presence.taxids]
+    lengths = np.array([len(lineage) for lineage in lineages], dtype=np.int64)
+    node_taxids = np.concatenate(lineages) if lineages else np.zeros(0, np.int64)
+    node_names = np.array([name for path in names for name in path], dtype=object)
+    depths = np.concatenate([np.arange(n) for n in lengths]) if lineages else []
+    species = np.repeat(np.arange(n_species), lengths)
+
+    # one node per distinct taxid, with its species set
+    codes, nodes = pd.factorize(node_taxids)
+    members = np.zeros((len(nodes), n_species), dtype=bool)
+    members[codes, species] = True
+    node_depth = np.zeros(len(nodes), dtype=np.int64)
+    node_depth[codes] = depths
+    first = np.zeros(len(nodes), dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes))[::-1]
+
+    # merge nodes with the same species set into the deepest of them
+    packed = np.packbits(members, axis=1)
+    group, _ = pd.factorize(np.array([row.tobytes() for row in packed], dtype=object))
+    order = np.lexsort((-node_depth, group))
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = group[order][1:] != group[order][:-1]
+    representative = np.empty(group.max() + 1 if len(group) else 0, dtype=np.int64)
+    representative[group[order][is_first]] = order[is_first]
+
+    # parent of each merged node: the previous distinct node along any lineage
+    parent = np.full(len(representative), -1, dtype=np.int64)
+    path_groups = group[codes]
+    changes = np.ones(len(path_groups), dtype=bool)
+    changes[1:] = path_groups[1:] != path_groups[:-1]
+    starts = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=starts[1:])
+    changes[starts[:-1]] = False
+    parent[path_groups[changes]] = path_groups[np.flatnonzero(changes) - 1]
+    grandparent = np.where(parent >= 0, parent[parent], -1)
+
+    # clades with a sister and an outgroup, top-down
+    clade = np.flatnonzero(grandparent >= 0)
+    clade = clade[
+        np.lexsort((nodes[representative[clade]], node_depth[representative[clade]]))
+    ]
+    sizes = members[representative].sum(axis=1)
+    n_groups = len(representative)
+    terminal = path_groups[starts[1:] - 1]
+    bottom_up = np.argsort(-node_depth[representative], kind="stable")
+    children = [[] for _ in range(n_groups)]
+    for g in bottom_up[::-1]:
+        if parent[g] >= 0:
+            children[parent[g]].append(g)
+
+    # OG presence per clade as bit rows over the OGs (8 OGs per byte), one block
+    # of OGs at a time: species rows are OR-ed into their clade and clades into
+    # their parent, deepest first; the sister bits of each child are the OR of
+    # the other children of its parent, and its outgroup bits are its parent's
+    # sister bits
+    lost_rows, lost_clades = [], []
+    for start in range(0, len(presence.og_ids), block_rows):
+        block = presence.matrix[start : start + block_rows]
+        species_bits = np.packbits(np.ascontiguousarray(block.T), axis=1)
+        own = np.zeros((n_groups, species_bits.shape[1]), dtype=np.uint8)
+        np.bitwise_or.at(own, terminal, species_bits)
+        present = own.copy()
+        for g in bottom_up:
+            if parent[g] >= 0:
+                present[parent[g]] |= present[g]
+        sister = np.zeros_like(present)
+        for p, kids in enumerate(children):
+            if not kids:
+                continue
+            bits = present[kids]
+            others = np.broadcast_to(own[p], bits.shape).copy()
+            others[1:] |= np.bitwise_or.accumulate(bits, axis=0)[:-1]
+            others[:-1] |= np.bitwise_or.accumulate(bits[::-1], axis=0)[::-1][1:]
+            sister[kids] = others
+        lost = ~present[clade] & sister[clade] & sister[parent[clade]]
+        columns, rows = np.nonzero(np.unpackbits(lost, axis=1, count=len(block)))
+        lost_rows.append(rows + start)
+        lost_clades.append(columns)
+    rows = np.concatenate(lost_rows) if lost_rows else np.zeros(0, np.int64)
+    columns = np.concatenate(lost_clades) if lost_clades else np.zeros(0, np.int64)
+    order = np.argsort(columns, kind="stable")
+    n_lost = np.bincount(columns, minlength=len(clade))
+    offsets = np.zeros(len(clade) + 1, dtype=np.int64)
+    np.cumsum(n_lost, out=offsets[1:])
+
+    table = pd.DataFrame(
+        {
+            "clade_taxid": nodes[representative[clade]],
+            "clade_name": node_names[first[representative[clade]]],
+            "parent_taxid": nodes[representative[parent[clade]]],
+            "depth": node_depth[representative[clade]],
+            "n_species": sizes[clade],
+            "n_sister_species": sizes[parent[clade]] - sizes[clade],
+            "n_outgroup_species": sizes[grandparent[clade]] - sizes[parent[clade]],
+            "n_lost": n_lost,
+        }
+    )
+    position = np.full(len(representative), -1, dtype=np.int64)
+    position[clade] = np.arange(len(clade))
+    aliases = {
+        int(taxid): int(position[g])
+        for taxid, g in zip(nodes, group)
+        if position[g] >= 0
+    }
+    return LineageLossScan(table, offsets, rows[order], presence.og_ids, aliases)
+
+
+def _parse_taxid_tokens(series: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse a column of comma-separated taxids (or protein IDs with taxid prefixes)
+    into flat integer arrays.
+
+    All rows are joined into one string, protein suffixes are stripped with a
+    single regex substitution and the taxids are converted by NumPy in one call.
+
+    Args:
+        series (pd.Series): Column with values like "9606,10090" or
+                            "9606.ENSP123,10090.ENSMUSP456".
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Number of taxids per row and the flat
+                                       array of all taxids (row after row).
+
+    Raises:
+        ValueError: If the column contains non-numeric taxonomic ID prefixes.
+
+    Examples:
+        >>> import pandas as pd
+        >>> lengths, values = _parse_taxid_tokens(pd.Series(['9606.A, 10090.B', '562']))
+        >>> lengths.tolist(), values.tolist()
+        ([2, 1], [9606, 10090, 562])
+    """
+    parsed = _parse_taxid_chunk(series.astype(str).tolist())
+    if parsed is None:
+        raise ValueError(
+            f"Failed to parse taxonomic IDs from column '{series.name}'. "
+            f"Expected format: 'TAXID.PROTEINID' (e.g., '9606.ENSP00000123')."
+        )
+    return parsed
+
+
+def _parse_taxid_chunk(strings: List[str]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Parse a chunk of rows for _parse_taxid_tokens / parse_taxid_column (runs in
+    worker processes, so it is a module level function).
+
+    Args:
+        strings (List[str]): Row values.
+
+    Returns:
+        Optional[Tuple[np.ndarray, np.ndarray]]: Number of taxids per row and the
+                                                 flat taxids, or None if malformed.
+    """
+    lengths = np.fromiter(
+        (string.count(",") + 1 for string in strings),
+        dtype=np.int64,
+        count=len(strings),
+    )
+    joined = ",".join(strings)
+    if "." in joined:
+        joined = re.sub(r"\.[^,]*", "", joined)
+    values = _fast_int_split(joined, lengths.sum())
+    if values is None:
+        return None
+    return lengths, values
+
+
+@profiled
+def build_presence_matrix(
+    df_members: pd.DataFrame,
+    column: str = "species_taxid_containing_protein",
+    workers: Optional[int] = None,
+) -> PresenceMatrix:
+    """
+    Build the OG x species presence matrix from the members dataframe.
+
+    The taxid prefixes of all rows are parsed into integer arrays in parallel
+    (see parse_taxid_column) instead of row by row.
+
+    Args:
+        df_members (pd.DataFrame): Members dataframe with 'orthologous_group_id'
+                                   column or index.
+        column (str): Column with comma-separated taxids or protein IDs with
+                      taxid prefixes. Defaults to 'species_taxid_containing_protein'.
+        workers (Optional[int]): Number of parsing processes, see parse_taxid_column.
+
+    Returns:
+        PresenceMatrix: The presence matrix, rows in the order of df_members.
+
+    Raises:
+        KeyError: If the specified column is not found in the dataframe.
+        ValueError: If the column contains non-numeric taxonomic ID prefixes.
+
+    Examples:
+        >>> import pandas as pd
+        >>> df = pd.DataFrame({
+        ...     'orthologous_group_id': ['OG1', 'OG2', 'OG3'],
+        ...     'species_taxid_containing_protein': ['9606,10090', '9606', '10090,10116']
+        ... })
+        >>> pm = build_presence_matrix(df)
+        >>> pm
+        PresenceMatrix(3 OGs x 3 species)
+        >>> sorted(pm.og_set([10090, 10116], how="any"))
+        ['OG1', 'OG3']
+    """
+    try:
+        index = parse_taxid_column(df_members[column], workers=workers)
+    except KeyError:
+        raise KeyError(
+            f"Column '{column}' not found in dataframe. "
+            f"Available columns: {list(df_members.columns)}"
+        )
+    return _presence_matrix_from_index(df_members, index)
+
+
+def _presence_matrix_from_index(
+    df_members: pd.DataFrame, index: TokenIndex
+) -> PresenceMatrix:
+    """
+    Build the presence matrix from an already parsed taxid index (see parse_taxid_column).
+
+    Args:
+        df_members (pd.DataFrame): Members dataframe the index was parsed from.
+        index (TokenIndex): Parsed taxids, rows in the order of df_members.
+
+    Returns:
+        PresenceMatrix: The presence matrix.
+    """
+    matrix = np.zeros((len(index), len(index.tokens)), dtype=bool)
+    matrix[index.rows, index.codes] = True
+    if "orthologous_group_id" in df_members.columns:
+        og_ids = df_members["orthologous_group_id"].to_numpy()
+    else:
+        og_ids = df_members.index.to_numpy()
+    return PresenceMatrix(og_ids, index.tokens, matrix)
+
+
+# -- OG x species copy numbers --
+class CopyNumberMatrix:
+    """
+    Sparse matrix of the number of proteins (copies) per orthologous group (rows)
+    and species taxid (columns), for paralog expansion and single-copy analyses.
+
+    Stored in CSR layout: the species of OG i are taxids[columns[offsets[i]:offsets[i + 1]]]
+    with copies counts[offsets[i]:offsets[i + 1]]. Species without proteins in an
+    OG are not stored (0 copies). Built once with build_copy_number_matrix.
+
+    Attributes:
+        og_ids (np.ndarray): Orthologous group IDs, one per row.
+        taxids (np.ndarray): Sorted species taxids, one per column.
+        offsets (np.ndarray): Row boundaries into columns and counts, length len(og_ids) + 1.
+        columns (np.ndarray): Column (species) of every stored entry.
+        counts (np.ndarray): Number of copies of every stored entry (>= 1).
+    """
+
+    def __init__(
+        self,
+        og_ids: np.ndarray,
+        taxids: np.ndarray,
+        offsets: np.ndarray,
+        columns: np.ndarray,
+        counts: np.ndarray,
+    ):
+        self.og_ids = np.asarray(og_ids)
+        self.taxids = np.asarray(taxids)
+        self.offsets = offsets
+        self.columns = columns
+        self.counts = counts
+        self._column = {int(taxid): i for i, taxid in enumerate(self.taxids)}
+        self._rows = None
+
+    def __repr__(self) -> str:
+        return (
+            f"CopyNumberMatrix({len(self.og_ids)} OGs x {len(self.taxids)} species, "
+            f"{len(self.counts)} entries)"
+        )
+
+    @property
+    def rows(self) -> np.ndarray:
+        """Row number of every stored entry."""
+        if self._rows is None:
+            self._rows = np.repeat(np.arange(len(self.og_ids)), np.diff(self.offsets))
+        return self._rows
+
+    def species_mask(self, taxids: Iterable[int]) -> np.ndarray:
+        """
+        Get a boolean mask over the columns for the given taxids.
+        Taxids that do not occur in the data are ignored.
+
+        Args:
+            taxids (Iterable[int]): Species taxids.
+
+        Returns:
+            np.ndarray: Boolean array of length len(self.taxids).
+        """
+        mask = np.zeros(len(self.taxids), dtype=bool)
+        for taxid in taxids:
+            col = self._column.get(int(taxid))
+            if col is not None:
+                mask[col] = True
+        return mask
+
+    def copies(self, taxids: Iterable[int]) -> np.ndarray:
+        """
+        Get the dense copy numbers of some species.
+
+        Args:
+            taxids (Iterable[int]): Species taxids. Taxids not in the data get 0 copies.
+
+        Returns:
+            np.ndarray: Integer array of shape (len(og_ids), number of taxids).
+
+        Examples:
+            >>> cn = build_copy_number_matrix(pd.DataFrame({
+            ...     'orthologous_group_id': ['OG1', 'OG2'],
+            ...     'protein_id': ['9606.A,9606.B,10090.C', '9606.D']}))
+            >>> cn.copies([9606, 10090, 7955]).tolist()
+            [[2, 1, 0], [1, 0, 0]]
+        """
+        taxids = list(taxids)
+        dense = np.zeros((len(self.og_ids), len(taxids)), dtype=np.int64)
+        position = np.full(len(self.taxids), -1, dtype=np.int64)
+        for i, taxid in enumerate(taxids):
+            col = self._column.get(int(taxid))
+            if col is not None:
+                position[col] = i
+        selected = position[self.columns] >= 0
+        dense[self.rows[selected], position[self.columns[selected]]] = self.counts[
+            selected
+        ]
+        return dense
+
+    def mean_copies(self, taxids: Iterable[int]) -> np.ndarray:
+        """
+        Get the mean copy number of a group of species per OG (absent species count 0).
+
+        Args:
+            taxids (Iterable[int]): Species taxids; taxids not in the data are ignored.
+
+        Returns:
+            np.ndarray: Float array of length len(og_ids) (NaN for an empty group).
+        """
+        cols = self.species_mask(taxids)
+        selected = cols[self.columns]
+        total = np.bincount(
+            self.rows[selected],
+            weights=self.counts[selected],
+            minlength=len(self.og_ids),
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return total / cols.sum()
+
+    def expanded(
+        self, taxids: Iterable[int], reference: Iterable[int], fold: float = 3.0
+    ) -> np.ndarray:
+        """
+        Get a mask over the OGs expanded in a group of species relative to a reference.
+
+        An OG is expanded if the mean copy number of taxids is at least fold times
+        the mean copy number of reference. OGs absent from the reference are gains,
+        not expansions, and never match.
+
+        Args:
+            taxids (Iterable[int]): Species of the expanded group, e.g. all primates.
+            reference (Iterable[int]): Reference species, e.g. [10090] for mouse.
+            fold (float): Minimum ratio of the mean copy numbers. Defaults to 3.0.
+
+        Returns:
+            np.ndarray: Boolean array of length len(og_ids).
+
+        Examples:
+            >>> cn = build_copy_number_matrix(pd.DataFrame({
+            ...     'orthologous_group_id': ['OG1', 'OG2', 'OG3'],
+            ...     'protein_id': ['9606.A,9606.B,9606.C,9598.A,9598.B,9598.C,10090.A',
+            ...                    '9606.A,9598.A,10090.A', '9606.A,9606.B,9606.C']}))
+            >>> cn.og_ids[cn.expanded([9606, 9598], [10090], fold=3)].tolist()
+            ['OG1']
+        """
+        group = self.mean_copies(taxids)
+        base = self.mean_copies(reference)
+        return (base > 0) & (group >= fold * base)
+
+    def single_copy(
+        self,
+        fraction: float = 0.95,
+        taxids: Optional[Iterable[int]] = None,
+        strict: bool = False,
+    ) -> np.ndarray:
+        """
+        Get a mask over the single-copy orthologous groups of a set of species.
+
+        An OG matches if at least the given fraction of the species carries exactly
+        one copy. With strict=True, none of the species may carry more than one.
+
+        Args:
+            fraction (float): Fraction of the species between 0 and 1. Defaults to 0.95.
+            taxids (Optional[Iterable[int]]): Species to consider. Defaults to all
+                                              species of the data.
+            strict (bool): Reject OGs with several copies in any of the species.
+                           Defaults to False.
+
+        Returns:
+            np.ndarray: Boolean array of length len(og_ids).
+
+        Examples:
+            >>> cn = build_copy_number_matrix(pd.DataFrame({
+            ...     'orthologous_group_id': ['OG1', 'OG2', 'OG3'],
+            ...     'protein_id': ['9606.A,9598.A,10090.A', '9606.A,9606.B,9598.A,10090.A',
+            ...                    '9606.A,9598.A']}))
+            >>> cn.og_ids[cn.single_copy(1.0)].tolist(), cn.og_ids[cn.single_copy(0.6)].tolist()
+            (['OG1'], ['OG1', 'OG2', 'OG3'])
+            >>> cn.og_ids[cn.single_copy(0.6, strict=True)].tolist()
+            ['OG1', 'OG3']
+        """
+        cols = (
+            np.ones(len(self.taxids), dtype=bool)
+            if taxids is None
+            else self.species_mask(taxids)
+        )
+        selected = cols[self.columns]
+        rows, counts = self.rows[selected], self.counts[selected]
+        n_single = np.bincount(rows[counts == 1], minlength=len(self.og_ids))
+        # same rounding as CoverageHistogram.min_species
+        mask = n_single >= int(np.ceil(round(fraction * cols.sum(), 9)))
+        if strict:
+            mask &= np.bincount(rows[counts > 1], minlength=len(self.og_ids)) == 0
+        return mask
+
+    def presence_matrix(self) -> PresenceMatrix:
+        """Get the OG x species presence matrix (species with at least one copy)."""
+        matrix = np.zeros((len(self.og_ids), len(self.taxids)), dtype=bool)
+        matrix[self.rows, self.columns] = True
+        return PresenceMatrix(self.og_ids, self.taxids, matrix)
+
+
+@profiled
+def build_copy_number_matrix(
+    df_members: pd.DataFrame,
+    column: str = "protein_id",
+    workers: Optional[int] = None,
+) -> CopyNumberMatrix:
+    """
+    Build the sparse OG x species copy number matrix from the members dataframe.
+
+    The taxid prefixes of the protein IDs are parsed in parallel (see
+    parse_taxid_column), keeping how often every taxid is listed per OG instead of
+    collapsing the list to a set of species. CopyNumberMatrix.presence_matrix()
+    derives the presence matrix from the same pass, without parsing again.
+
+    Args:
+        df_members (pd.DataFrame): Members dataframe (see dataframe_setup_members).
+        column (str): Column with the protein IDs, like "9606.ENSP1,9606.ENSP2".
+                      Defaults to "protein_id".
+        workers (Optional[int]): Number of parsing processes, see parse_taxid_column.
+
+    Returns:
+        CopyNumberMatrix: The copy numbers, rows in the order of df_members.
+
+    Raises:
+        KeyError: If the column is missing from the dataframe.
+        ValueError: If the column contains non-numeric taxonomic ID prefixes.
+
+    Examples:
+        >>> cn = build_copy_number_matrix(pd.DataFrame({
+        ...     'orthologous_group_id': ['OG1', 'OG2'],
+        ...     'protein_id': ['9606.A,9606.B,10090.C', '9606.D']}))
+        >>> cn
+        CopyNumberMatrix(2 OGs x 2 species, 3 entries)
+        >>> cn.counts.tolist()
+        [2, 1, 1]
+    """
+    try:
+        series = df_members[column]
+    except KeyError:
+        raise KeyError(
+            f"Column '{column}' not found in dataframe. "
+            f"Available columns: {list(df_members.columns)}"
+        )
+    index = parse_taxid_column(series, workers=workers, counts=True)
+    if "orthologous_group_id" in df_members.columns:
+        og_ids = df_members["orthologous_group_id"].to_numpy()
+    else:
+        og_ids = df_members.index.to_numpy()
+    counts = index.counts.astype(
+        np.min_scalar_type(max(index.counts.max(initial=1), 1))
+    )
+    return CopyNumberMatrix(og_ids, index.tokens, index.offsets, index.codes, counts)
+
+
+# -- Batched OG queries --
+@dataclass(frozen=True)
+class Query:
+    """
+    Declarative include/exclude/within question about orthologous groups.
+
+    An OG matches if it contains ALL species in include, at least one species of
+    every group in include_any, NONE of the species in exclude, no species outside
+    only_within (if given), and at least min_species_fraction of the reference
+    species: the species of only_within, or all species of the data if None.
+    Species that do not occur in the data count as absent.
+
+    Attributes:
+        name (str): Name of the query, used as column of the result.
+        include (Sequence[int]): Taxids that MUST all be present.
+        include_any (Sequence[Sequence[int]]): Groups of taxids of which at least
+                                               one per group must be present.
+        exclude (Sequence[int]): Taxids that MUST NOT be present.
+        only_within (Optional[Sequence[int]]): If given, taxids the OG is restricted to.
+        min_species_fraction (float): Minimum fraction of reference species present.
+    """
+
+    name: str
+    include: Sequence[int] = ()
+    include_any: Sequence[Sequence[int]] = ()
+    exclude: Sequence[int] = ()
+    only_within: Optional[Sequence[int]] = None
+    min_species_fraction: float = 0.0
+
+
+@profiled
+def run_queries(
+    queries: List[Query],
+    presence: PresenceMatrix,
+    block_rows: int = 65536,
+    workers: int = 1,
+) -> pd.DataFrame:
+    """
+    Answer many queries in a single pass over the presence matrix.
+
+    The species sets of all queries are stacked as columns of one indicator matrix
+    (include, include_any groups, exclude, within), so each block of OG rows is read
+    once and multiplied with it; every condition of every query is then a comparison
+    of the resulting per-OG counts. Hundreds of queries cost about one pass.
+
+    Args:
+        queries (List[Query]): The queries, with unique names.
+        presence (PresenceMatrix): The OG x species presence matrix.
+        block_rows (int): OG rows per block. Defaults to 65536.
+        workers (int): Processes answering blocks in parallel. The presence matrix
+                       is placed in shared memory once and attached by every
+                       worker without copying (see share_presence_matrix).
+                       Defaults to 1 (in-process).
+
+    Returns:
+        pd.DataFrame: Boolean DataFrame indexed by OG ID (in presence matrix order)
+                      with one column per query.
+
+    Raises:
+        ValueError: If query names are not unique.
+
+    Examples:
+        >>> pm = PresenceMatrix(['OG1', 'OG2', 'OG3'], [9606, 9598, 10090],
+        ...                     np.array([[1, 1, 0], [1, 1, 1], [1, 0, 1]], dtype=bool))
+        >>> run_queries([
+        ...     Query("apes_not_mouse", include=[9606, 9598], exclude=[10090]),
+        ...     Query("apes_only", only_within=[9606, 9598], min_species_fraction=1.0),
+        ...     Query("universal", min_species_fraction=0.99),
+        ... ], pm)
+             apes_not_mouse  apes_only  universal
+        OG1            True       True      False
+        OG2           False      False       True
+        OG3           False      False      False
+    """
+    names = [query.name for query in queries]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Query names must be unique, got: {names}")
+
+    columns, checks = _query_checks(
+        queries, presence.species_mask, len(presence.taxids)
+    )
+    indicator = np.zeros((len(presence.taxids), max(len(columns), 1)), dtype=np.float32)
+    for i, column in enumerate(columns):
+        indicator[:, i] = column
+
+    n_ogs = len(presence.og_ids)
+    if workers > 1:
+        # at least one block per worker
+        block_rows = max(min(block_rows, -(-n_ogs // workers)), 1)
+    starts = range(0, n_ogs, block_rows)
+    answer = functools.partial(
+        _answer_query_block,
+        block_rows=block_rows,
+        indicator=indicator,
+        checks=checks,
+        queries=queries,
+    )
+    if workers > 1 and len(starts) > 1:
+        with share_presence_matrix(presence) as shared:
+            parts = map_shared(answer, shared, starts, workers=workers)
+    else:
+        arrays = {"matrix": presence.matrix}
+        parts = [answer(arrays, start) for start in starts]
+    result = np.concatenate(parts or [np.ones((0, len(queries)), dtype=bool)])
+    return pd.DataFrame(result, index=pd.Index(presence.og_ids), columns=names)
+
+
+def _query_checks(
+    queries: List[Query], species_mask: Callable, n_species: int
+) -> Tuple[List[np.ndarray], list]:
+    """
+    Turn queries into species set columns and the checks run_queries compares
+    their per-OG counts with.
+
+    Args:
+        queries (List[Query]): The queries.
+        species_mask (Callable): Maps taxids to a boolean mask over the species
+                                 (e.g. PresenceMatrix.species_mask).
+        n_species (int): Number of species of the data.
+
+    Returns:
+        Tuple[List[np.ndarray], list]: One species mask per species set, and
+            (query index, column, kind, required count) per condition.
+    """
+    # one indicator column per species set, plus per query what to compare it with
+    columns = []
+    checks = []  # (query index, column, kind, required count)
+    for q, query in enumerate(queries):
+        if query.include:
+            checks.append((q, len(columns), "all", len(set(query.include))))
+            columns.append(species_mask(query.include))
+        for group in query.include_any:
+            checks.append((q, len(columns), "any", 1))
+            columns.append(species_mask(group))
+        if query.exclude:
+            checks.append((q, len(columns), "none", 0))
+            columns.append(species_mask(query.exclude))
+        if query.only_within is not None:
+            within = species_mask(query.only_within)
+            checks.append((q, len(columns), "within", int(within.sum())))
+            columns.append(within)
+        elif query.min_species_fraction > 0:
+            checks.append((q, None, "within", n_species))
+    return columns, checks
+
+
+def _evaluate_query_checks(
+    counts: np.ndarray, totals: np.ndarray, checks, queries
+) -> np.ndarray:
+    """
+    Answer the checks of _query_checks from per-OG species counts.
+
+    Args:
+        counts (np.ndarray): Species of every species set present, shape
+                             (OGs, species sets).
+        totals (np.ndarray): Species present, per OG.
+        checks (list): (query index, column, kind, required count) per condition.
+        queries (List[Query]): The queries.
+
+    Returns:
+        np.ndarray: Boolean array of shape (len(totals), len(queries)).
+    """
+    out = np.ones((len(totals), len(queries)), dtype=bool)
+    for q, col, kind, required in checks:
+        query = queries[q]
+        count = totals if col is None else counts[:, col]
+        if kind == "all":
+            out[:, q] &= count >= required
+        elif kind == "any":
+            out[:, q] &= count >= 1
+        elif kind == "none":
+            out[:, q] &= count == 0
+        else:
+            if query.only_within is not None:
+                out[:, q] &= totals - count == 0
+            if query.min_species_fraction > 0:
+                out[:, q] &= count >= query.min_species_fraction * required
+    return out
+
+
+def _answer_queries_sparse(queries: List[Query], index: TokenIndex) -> np.ndarray:
+    """
+    Answer queries on parsed taxids (see parse_taxid_column) without a presence
+    matrix.
+
+    Every species set is counted per row with a membership test of the CSR codes
+    and one np.bincount, so memory grows with the taxids listed, not with rows x
+    species.
+
+    Args:
+        queries (List[Query]): The queries.
+        index (TokenIndex): Distinct taxids per OG row.
+
+    Returns:
+        np.ndarray: Boolean array of shape (len(index), len(queries)), equal to
+                    run_queries on the presence matrix of the same rows.
+
+    Examples:
+        >>> index = parse_taxid_column(pd.Series(['9606,9598', '9606,9598,10090', '9606,10090']))
+        >>> _answer_queries_sparse([
+        ...     Query("apes_not_mouse", include=[9606, 9598], exclude=[10090]),
+        ...     Query("apes_only", only_within=[9606, 9598], min_species_fraction=1.0),
+        ... ], index).tolist()
+        [[True, True], [False, False], [False, False]]
+    """
+    columns, checks = _query_checks(queries, index.token_mask, len(index.tokens))
+    counts = np.zeros((len(index), len(columns)), dtype=np.int64)
+    for i, column in enumerate(columns):
+        hit = column[index.codes]
+        counts[:, i] = np.bincount(index.rows[hit], minlength=len(index))
+    return _evaluate_query_checks(counts, np.diff(index.offsets), checks, queries)
+
+
+def _answer_query_block(
+    arrays, start: int, block_rows: int, indicator: np.ndarray, checks, queries
+) -> np.ndarray:
+    """
+    Answer the prepared query checks of run_queries for one block of OG rows
+    (runs in worker processes, so it is a module level function).
+
+    Args:
+        arrays: Mapping with the presence "matrix" (a dict or SharedArrays).
+        start (int): First OG row of the block.
+        block_rows (int): OG rows per block.
+        indicator (np.ndarray): Species x species-set indicator matrix.
+        checks (list): (query index, column, kind, required count) per condition.
+        queries (List[Query]): The queries.
+
+    Returns:
+        np.ndarray: Boolean array of shape (rows of the block, len(queries)).
+    """
+    block = np.asarray(arrays["matrix"][start : start + block_rows]).astype(np.float32)
+    return _evaluate_query_checks(block @ indicator, block.sum(axis=1), checks, queries)
+
+
+# -- Functional categories --
+class CategoryMatrix:
+    """
+    Orthologous group x COG functional category matrix.
+
+    The multi-letter 'functional_category' strings of the annotations (e.g. "KT")
+    are encoded once (see build_category_matrix). As there are only ~25 categories,
+    the matrix is stored dense with one byte per cell: the 1-based position of the
+    letter in the original string, 0 if the OG is not in the category.
+
+    Attributes:
+        og_ids (np.ndarray): Orthologous group IDs, in annotation order.
+        categories (np.ndarray): Sorted category letters, one per column.
+        positions (np.ndarray): uint8 array of shape (len(og_ids), len(categories)).
+    """
+
+    def __init__(
+        self, og_ids: np.ndarray, categories: np.ndarray, positions: np.ndarray
+    ):
+        self.og_ids = np.asarray(og_ids)
+        self.categories = np.asarray(categories)
+        self.positions = positions
+        self.matrix = positions > 0
+        self._row = pd.Index(self.og_ids)
+
+    def __repr__(self) -> str:
+        return f"CategoryMatrix({len(self.og_ids)} OGs x {len(self.categories)} categories)"
+
+    def subset_masks(self, subsets: Dict[str, Iterable[str]]) -> np.ndarray:
+        """
+        Encode OG subsets as boolean masks over the matrix rows.
+        OG IDs without annotation are ignored.
+
+        Args:
+            subsets (Dict[str, Iterable[str]]): Mapping of a name to its OG IDs.
+
+        Returns:
+            np.ndarray: Boolean array of shape (len(subsets), len(self.og_ids)).
+        """
+        masks = np.zeros((len(subsets), len(self.og_ids)), dtype=bool)
+        for i, og_ids in enumerate(subsets.values()):
+            rows = self._row.get_indexer(list(og_ids))
+            masks[i, rows[rows >= 0]] = True
+        return masks
+
+    def counts(self, subsets: Dict[str, Iterable[str]]) -> pd.DataFrame:
+        """
+        Count the OGs per category for many OG subsets with one matrix product.
+
+        Args:
+            subsets (Dict[str, Iterable[str]]): Mapping of a name to its OG IDs.
+
+        Returns:
+            pd.DataFrame: Counts with one row per subset and one column per category.
+
+        Examples:
+            >>> cm = build_category_matrix(pd.DataFrame(
+            ...     {'orthologous_group_id': ['OG1', 'OG2', 'OG3'],
+            ...      'functional_category': ['KT', 'S', 'K']}))
+            >>> cm.counts({'a': ['OG1', 'OG3'], 'b': ['OG2']})
+               K  S  T
+            a  2  0  1
+            b  0  1  0
+        """
+        masks = self.subset_masks(subsets).astype(np.float32)
+        counts = masks @ self.matrix.astype(np.float32)
+        return pd.DataFrame(
+            counts.astype(np.int64), index=list(subsets), columns=self.categories
+        )
+
+    def category_counts(self, og_ids: Iterable[str]) -> pd.DataFrame:
+        """
+        Count the OGs per category for one subset, ordered like exploding the category
+        strings and calling value_counts: by count (descending), ties by first occurrence.
+
+        Args:
+            og_ids (Iterable[str]): OG IDs of the subset.
+
+        Returns:
+            pd.DataFrame: Columns category_code and count, categories with count 0 left out.
+
+        Examples:
+            >>> cm = build_category_matrix(pd.DataFrame(
+            ...     {'orthologous_group_id': ['OG1', 'OG2', 'OG3'],
+            ...      'functional_category': ['TK', 'S', 'K']}))
+            >>> cm.category_counts(['OG1', 'OG2', 'OG3'])
+              category_code  count
+            0             K      2
+            1             T      1
+            2             S      1
+        """
+        rows = self.subset_masks({"subset": og_ids})[0]
+        positions = self.positions[rows].astype(np.int64)
+        counts = (positions > 0).sum(axis=0)
+        # first occurrence of every category in the concatenated category strings
+        order = np.arange(len(positions))[:, None] * 256 + positions
+        first = np.where(positions > 0, order, np.iinfo(np.int64).max).min(
+            axis=0, initial=np.iinfo(np.int64).max
+        )
+        ranking = np.lexsort((first, -counts))
+        ranking = ranking[counts[ranking] > 0]
+        return pd.DataFrame(
+            {"category_code": self.categories[ranking], "count": counts[ranking]}
+        )
+
+    def enrichment(self, subsets: Dict[str, Iterable[str]]) -> pd.DataFrame:
+        """
+        Test every category for enrichment in many OG subsets at once.
+
+        Counts come from one matrix product (see counts); the one-sided p-value
+        P(X >= count) of the hypergeometric distribution uses all annotated OGs
+        as background.
+
+        Args:
+            subsets (Dict[str, Iterable[str]]): Mapping of a name to its OG IDs.
+
+        Returns:
+            pd.DataFrame: One row per subset and category with columns subset,
+                          category_code, count, subset_size, category_size,
+                          expected, fold_enrichment and p_value.
+
+        Examples:
+            >>> cm = build_category_matrix(pd.DataFrame(
+            ...     {'orthologous_group_id': ['OG1', 'OG2', 'OG3', 'OG4'],
+            ...      'functional_category': ['K', 'K', 'S', 'S']}))
+            >>> result = cm.enrichment({'a': ['OG1', 'OG2']})
+            >>> result[['category_code', 'count', 'p_value']].round(4)
+              category_code  count  p_value
+            0             K      2   0.1667
+            1             S      0   1.0000
+        """
+        counts = self.counts(subsets)
+        subset_sizes = self.subset_masks(subsets).sum(axis=1)
+        category_sizes = self.matrix.sum(axis=0)
+        population = len(self.og_ids)
+
+        k = counts.to_numpy().ravel()
+        n = np.repeat(subset_sizes, len(self.categories))
+        big_k = np.tile(category_sizes, len(subsets))
+        expected = n * big_k / max(population, 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fold = np.where(expected > 0, k / expected, np.nan)
+        return pd.DataFrame(
+            {
+                "subset": np.repeat(list(subsets), len(self.categories)),
+                "category_code": np.tile(self.categories, len(subsets)),
+                "count": k,
+                "subset_size": n,
+                "category_size": big_k,
+                "expected": expected,
+                "fold_enrichment": fold,
+                "p_value": _hypergeometric_sf(k, population, big_k, n),
+            }
+        )
+
+
+def _hypergeometric_sf(
+    k: np.ndarray,
+    population: int,
+    successes: np.ndarray,
+    draws: np.ndarray,
+    window: int = 32,
+) -> np.ndarray:
+    """
+    Vectorized P(X >= k) of the hypergeometric distribution for many tests at once.
+
+    Uses a table of log factorials up to the population size, so every term is a
+    table lookup. The probability terms decrease on both sides of the mode, so each
+    test sums them away from the mode only: P(X >= k) from k upwards if k is above
+    the mode, otherwise 1 - P(X <= k - 1) from k - 1 downwards. The terms of all
+    tests are evaluated together as a (tests x window) array; tests whose
+    remaining terms (bounded by a geometric series, as the ratio of neighbouring
+    terms keeps falling) can no longer change the sum are dropped and the others
+    continue with a doubled window, so a test costs about as many terms as its
+    tail actually has weight, not its whole support.
+
+    Args:
+        k (np.ndarray): Observed successes.
+        population (int): Population size.
+        successes (np.ndarray): Number of successes in the population.
+        draws (np.ndarray): Number of draws.
+        window (int): Terms evaluated per test in the first round. Defaults to 32.
+
+    Returns:
+        np.ndarray: p-values.
+
+    Examples:
+        >>> _hypergeometric_sf(np.array([2, 0]), 4, np.array([2, 2]), np.array([2, 2])).round(4).tolist()
+        [0.1667, 1.0]
+        >>> _hypergeometric_sf(np.array([3, 1, 2]), 10, np.array([2, 5, 5]), np.array([3, 3, 3])).round(4).tolist()
+        [0.0, 0.9167, 0.5]
+    """
+    k, successes, draws = (
+        np.asarray(values, dtype=np.int64) for values in (k, successes, draws)
+    )
+    log_factorial = np.concatenate(
+        ([0.0], np.cumsum(np.log(np.arange(1, population + 1))))
+    )
+    p_values = np.ones(len(k))
+    lower = np.maximum(0, draws - (population - successes))
+    upper = np.minimum(draws, successes)
+    p_values[k > upper] = 0.0
+    # tests with k at or below the lowest possible value keep p = 1
+    tests = np.flatnonzero((k > lower) & (k <= upper))
+    K, n = successes[tests], draws[tests]
+    mode = (n + 1) * (K + 1) // (population + 2)
+    # walk away from the mode: upwards from k, or downwards from k - 1
+    step = np.where(k[tests] > mode, 1, -1)
+    first = np.where(step > 0, k[tests], k[tests] - 1)
+    last = np.where(step > 0, upper[tests], lower[tests])
+    # log of C(K, x) C(N - K, n - x) / C(N, n), with the per-test factorials hoisted
+    constant = (
+        log_factorial[K]
+        + log_factorial[population - K]
+        + log_factorial[n]
+        + log_factorial[population - n]
+        - log_factorial[population]
+    )
+
+    def log_terms(rows, x):
+        Kr, nr = K[rows, None], n[rows, None]
+        return constant[rows, None] - (
+            log_factorial[x]
+            + log_factorial[Kr - x]
+            + log_factorial[nr - x]
+            + log_factorial[population - Kr - nr + x]
+        )
+
+    # sums are relative to the first (largest) term
+    log_first = log_terms(np.arange(len(tests)), first[:, None])[:, 0]
+    totals = np.zeros(len(tests))
+    pending = np.arange(len(tests))
+    done = 0
+    while len(pending):
+        offsets = done + np.arange(window)
+        x = first[pending, None] + step[pending, None] * offsets
+        remaining = np.abs(last[pending] - first[pending]) - done + 1
+        valid = offsets < done + remaining[:, None]
+        x = np.where(valid, x, first[pending, None])  # padding stays inside the table
+        terms = np.exp(log_terms(pending, x) - log_first[pending, None])
+        terms[~valid] = 0.0
+        totals[pending] += terms.sum(axis=1)
+        # ratio of the next to the last term bounds the rest by a geometric series
+        end = first[pending] + step[pending] * np.minimum(
+            done + window - 1, np.abs(last[pending] - first[pending])
+        )
+        Kp, n_p = K[pending], n[pending]
+        ratio = np.where(
+            step[pending] > 0,
+            (Kp - end)
+            * (n_p - end)
+            / ((end + 1) * (population - Kp - n_p + end + 1.0)),
+            end * (population - Kp - n_p + end) / ((Kp - end + 1.0) * (n_p - end + 1)),
+        )
+        rest = terms[:, -1] * ratio / np.maximum(1.0 - ratio, 1e-300)
+        finished = (remaining <= window) | (
+            (ratio < 1.0) & (rest <= 1e-17 * totals[pending])
+        )
+        pending = pending[~finished]
+        done += window
+        window *= 2
+    sums = np.exp(log_first) * totals
+    p_values[tests] = np.clip(np.where(step > 0, sums, 1.0 - sums), 0.0, 1.0)
+    return p_values
+
+
+@profiled
+def build_category_matrix(df_annotations: pd.DataFrame) -> CategoryMatrix:
+    """
+    Encode the functional categories of the annotations dataframe as a CategoryMatrix.
+
+    Args:
+        df_annotations (pd.DataFrame): Annotations dataframe (see
+                                       dataframe_setup_annotations).
+
+    Returns:
+        CategoryMatrix: The encoded categories, rows in annotation order.
+
+    Raises:
+        KeyError: If a required column is missing from the dataframe.
+
+    Examples:
+        >>> import pandas as pd
+        >>> cm = build_category_matrix(pd.DataFrame(
+        ...     {'orthologous_group_id': ['OG1', 'OG2'], 'functional_category': ['KT', 'S']}))
+        >>> cm
+        CategoryMatrix(2 OGs x 3 categories)
+        >>> cm.positions.tolist()
+        [[1, 0, 2], [0, 1, 0]]
+    """
+    try:
+        strings = df_annotations["functional_category"].fillna("").astype(str).tolist()
+        og_ids = df_annotations["orthologous_group_id"].to_numpy()
+    except KeyError as e:
+        raise KeyError(
+            f"Column {e} not found in dataframe. "
+            f"Available columns: {list(df_annotations.columns)}"
+        )
+    categories = np.array(sorted(set("".join(strings))))
+    column = {letter: i for i, letter in enumerate(categories)}
+    positions = np.zeros((len(strings), len(categories)), dtype=np.uint8)
+    for row, string in enumerate(strings):
+        for position, letter in enumerate(string, start=1):
+            positions[row, column[letter]] = position
+    return CategoryMatrix(og_ids, categories, positions)
+
+
+# -- Streaming members ingestion --
+MEMBERS_COLUMNS = [
+    "evolutionary_level",
+    "orthologous_group_id",
+    "num_of_proteins",
+    "num_of_species",
+    "protein_id",
+    "species_taxid_containing_protein",
+]
+MEMBERS_DTYPES = {
+    "orthologous_group_id": str,
+    "num_of_proteins": np.int64,
+    "num_of_species": np.int64,
+    "protein_id": str,
+    "species_taxid_containing_protein": str,
+}
+
+
+def _read_blocks_in_background(
+    path: str, block_size: int, max_blocks: int
+) -> Iterator[bytes]:
+    """
+    Yield decompressed blocks of a gzip file, decompressing in a background thread.
+    Files without the .gz suffix are read as they are.
+
+    zlib releases the GIL while decompressing, so decompression of the next blocks
+    overlaps with whatever the consumer does with the current one. At most
+    max_blocks blocks are buffered at any time.
+
+    Args:
+        path (str): Path of the .gz file.
+        block_size (int): Size of the decompressed blocks in bytes.
+        max_blocks (int): Maximum number of buffered blocks.
+
+    Yields:
+        bytes: Decompressed blocks, in file order.
+    """
+    blocks: queue.Queue = queue.Queue(maxsize=max_blocks)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def reader():
+        try:
+            opener = gzip.open if str(path).endswith(".gz") else open
+            with opener(path, "rb") as f:
+                for block in iter(lambda: f.read(block_size), b""):
+                    if not put(block):
+                        return
+        except BaseException as e:  # handed over to the consuming thread
+            put(e)
+            return
+        put(done)
+
+    thread = threading.Thread(target=reader, name="members-gunzip", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = blocks.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def iter_members_batches(
+    path: str = "data/zips/33208_members.tsv.gz", max_memory_mb: int = 256
+) -> Iterator[pd.DataFrame]:
+    """
+    Read the members table straight from the compressed file in typed batches.
+
+    The file is never extracted to disk or loaded as a whole: decompression runs in
+    a background thread (see _read_blocks_in_background) while the previous batch
+    is parsed. An eighth of max_memory_mb is used for buffered decompressed blocks
+    and a sixteenth for the text of one batch: the parsed batch and a consumer
+    reducing it sparsely (e.g. summarize_members_stream parsing its taxids) take
+    about five times the text, which stays well within the ceiling.
+
+    Args:
+        path (str): Path of the gzip compressed (or, without .gz suffix, plain)
+                    members file. Defaults to 'data/zips/33208_members.tsv.gz'.
+        max_memory_mb (int): Memory ceiling for the ingestion in megabytes. Defaults to 256.
+
+    Yields:
+        pd.DataFrame: Batches with the columns of dataframe_setup_members and a
+                      continuous RangeIndex over the whole file.
+
+    Raises:
+        FileNotFoundError: If the members file is not found.
+        pd.errors.ParserError: If the file is corrupted or malformed.
+    """
+    if not Path(path).exists():
+        raise FileNotFoundError(
+            f"File '{path}' not found. Run: bash runall.sh to download files."
+        )
+    budget = max_memory_mb * (1 << 20)
+    block_size = max(1 << 16, min(4 << 20, budget // 32))
+    max_blocks = max(2, budget // 8 // block_size)
+    # a batch takes about 5x its text while it is parsed and reduced
+    batch_bytes = max(block_size, budget // 16)
+
+    def parse(text: bytes, start: int) -> pd.DataFrame:
+        try:
+            batch = pd.read_csv(
+                io.BytesIO(text),
+                sep="\t",
+                header=None,
+                names=MEMBERS_COLUMNS,
+                dtype=MEMBERS_DTYPES,
+            )
+        except (pd.errors.ParserError, ValueError) as e:
+            raise pd.errors.ParserError(
+                f"File is corrupted or malformed. Re-download with: bash runall.sh\n"
+                f"Details: {e}"
+            )
+        batch.index = pd.RangeIndex(start, start + len(batch))
+        return batch
+
+    pending: List[bytes] = []
+    pending_size = 0
+    rows = 0
+    try:
+        for block in _read_blocks_in_background(path, block_size, max_blocks):
+            pending.append(block)
+            pending_size += len(block)
+            del block
+            if pending_size < batch_bytes:
+                continue
+            # cut after the last complete line, joining the batch text only once
+            last = pending[-1]
+            cut = last.rfind(b"\n") + 1
+            if cut == 0:
+                continue
+            text = b"".join(pending[:-1] + [last[:cut]])
+            pending = [last[cut:]]
+            pending_size = len(pending[0])
+            del last
+            batch = parse(text, rows)
+            del text
+            rows += len(batch)
+            yield batch
+            # not held while the next batch is read
+            del batch
+    except (OSError, EOFError) as e:
+        if isinstance(e, FileNotFoundError):
+            raise
+        raise pd.errors.ParserError(
+            f"File is corrupted or malformed. Re-download with: bash runall.sh\n"
+            f"Details: {e}"
+        )
+    text = b"".join(pending)
+    if text.strip():
+        yield parse(text, rows)
+
+
+class MembersSummary:
+    """
+    Per-OG and per-species aggregates of a members file, reduced batch by batch
+    (see summarize_members_stream).
+
+    Holds what questions 1-3 need instead of the presence matrix, so its size grows
+    with the number of OGs (a species count and one answer per query each), not
+    with OGs x species.
+
+    Attributes:
+        og_ids (np.ndarray or pd.Index): Orthologous group IDs, in file order.
+        species_counts (np.ndarray): Number of species present, per OG.
+        taxids (np.ndarray): Sorted taxids of all species in the file.
+        og_counts (np.ndarray): Number of OGs containing each species (taxids order).
+        answers (pd.DataFrame): Boolean answers of the queries, indexed by OG ID.
+        homologs (pd.DataFrame): Member rows containing ALL included and NONE of
+                                 the excluded species, with their original row index.
+
+    Examples:
+        >>> summary = MembersSummary(np.array(['OG1', 'OG2']), np.array([2, 1]),
+        ...                          np.array([9606, 10090]), np.array([2, 1]))
+        >>> summary.coverage().n_at_least_fraction(1.0), summary.og_count(9606)
+        (1, 2)
+    """
+
+    def __init__(
+        self,
+        og_ids: np.ndarray,
+        species_counts: np.ndarray,
+        taxids: np.ndarray,
+        og_counts: np.ndarray,
+        answers: Optional[pd.DataFrame] = None,
+        homologs: Optional[pd.DataFrame] = None,
+    ):
+        self.og_ids = og_ids
+        self.species_counts = species_counts
+        self.taxids = taxids
+        self.og_counts = og_counts
+        self.answers = (
+            answers if answers is not None else pd.DataFrame(index=pd.Index(og_ids))
+        )
+        self.homologs = (
+            homologs if homologs is not None else pd.DataFrame(columns=MEMBERS_COLUMNS)
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"MembersSummary({len(self.og_ids)} OGs, {len(self.taxids)} species, "
+            f"{len(self.homologs)} homologs)"
+        )
+
+    def coverage(self) -> CoverageHistogram:
+        """Species counts per OG and their distribution over all species (Q3)."""
+        return CoverageHistogram(self.species_counts, len(self.taxids))
+
+    def og_count(self, taxid: int) -> int:
+        """Number of OGs containing a species (0 if it does not occur)."""
+        i = np.searchsorted(self.taxids, int(taxid))
+        if i < len(self.taxids) and self.taxids[i] == int(taxid):
+            return int(self.og_counts[i])
+        return 0
+
+
+@profiled
+def summarize_members_stream(
+    include_ids: Optional[Iterable[int]] = None,
+    exclude_ids: Optional[Iterable[int]] = None,
+    path: str = "data/zips/33208_members.tsv.gz",
+    max_memory_mb: int = 256,
+    queries: Sequence[Query] = (),
+) -> MembersSummary:
+    """
+    Run the aggregations needed for questions 1-3 in one pass over the compressed
+    members file, without holding the members table in memory.
+
+    Every batch is parsed into its distinct taxids per OG (a sparse CSR
+    TokenIndex, see parse_taxid_column), reduced right away and dropped: to its
+    species count per OG (question 3), its OG count per species, the answers of
+    the queries (questions 1D/1E and 2, e.g. the include_any set sizes) and the
+    (few) member rows containing ALL included and NONE of the excluded species
+    (question 1). No batch ever becomes a dense OGs x species matrix, so the work
+    per batch grows with the text of the batch, not with the number of species.
+    Memory stays within max_memory_mb plus the per-OG results that accumulate
+    (the OG ID, its species count and one byte per query answer).
+
+    Args:
+        include_ids (Optional[Iterable[int]]): Taxids that MUST be present in the
+                                               homologs. None keeps no member rows.
+        exclude_ids (Optional[Iterable[int]]): Taxids that MUST NOT be present in the homologs.
+        path (str): Path of the gzip compressed members file.
+                    Defaults to 'data/zips/33208_members.tsv.gz'.
+        max_memory_mb (int): Memory ceiling for the ingestion, see iter_members_batches.
+        queries (Sequence[Query]): Queries to answer (see run_queries). Their species
+                                   coverage must be relative to only_within, since a
+                                   batch does not know all species of the file.
+
+    Returns:
+        MembersSummary: The per-OG and per-species aggregates and the homologs.
+
+    Raises:
+        FileNotFoundError: If the members file is not found.
+        pd.errors.ParserError: If the file is corrupted or malformed.
+        ValueError: If a query needs the coverage of all species of the file.
+
+    Examples:
+        Short OGs over many species stay within the ceiling (a dense presence
+        matrix of one batch alone would take several times of it):
+
+        >>> import gzip, tempfile, tracemalloc
+        >>> path = Path(tempfile.mkdtemp()) / 'members.tsv.gz'
+        >>> rng = np.random.default_rng(0)
+        >>> taxids = rng.integers(1000, 6000, size=(20000, 3)).astype(str)
+        >>> with gzip.open(path, 'wt') as f:
+        ...     for i, row in enumerate(taxids):
+        ...         proteins = ','.join(taxid + '.P' for taxid in row)
+        ...         line = ['1', f'OG{i}', '3', '3', proteins, ','.join(row)]
+        ...         _ = f.write(chr(9).join(line) + chr(10))
+        >>> tracemalloc.start()
+        >>> summary = summarize_members_stream([1000], path=path, max_memory_mb=2)
+        >>> peak = tracemalloc.get_traced_memory()[1]
+        >>> tracemalloc.stop()
+        >>> summary, peak < 2 * 2**20
+        (MembersSummary(20000 OGs, 5000 species, 14 homologs), True)
+    """
+    include_ids = list(include_ids) if include_ids is not None else None
+    exclude_ids = list(exclude_ids) if exclude_ids is not None else []
+    queries = list(queries)
+    for query in queries:
+        if query.only_within is None and query.min_species_fraction > 0:
+            raise ValueError(
+                f"Query '{query.name}' counts all species of the file, which a batch "
+                f"does not know. Use MembersSummary.coverage() instead."
+            )
+    if include_ids is not None:
+        homolog_query = [Query("homologs", include=include_ids, exclude=exclude_ids)]
+    homologs, og_ids, species_counts, answers = [], [], [], []
+    taxids = np.zeros(0, dtype=np.int64)
+    og_counts = np.zeros(0, dtype=np.int64)
+    for batch in iter_members_batches(path, max_memory_mb=max_memory_mb):
+        # distinct taxids per OG in CSR layout, never a dense OGs x species matrix
+        index = parse_taxid_column(batch["species_taxid_containing_protein"], workers=1)
+        if include_ids is not None:
+            homologs.append(batch[_answer_queries_sparse(homolog_query, index)[:, 0]])
+        # kept in the column's string storage, not as one Python object per OG
+        og_ids.append(batch["orthologous_group_id"].reset_index(drop=True))
+        species_counts.append(np.diff(index.offsets).astype(np.int32))
+        merged = np.union1d(taxids, index.tokens)
+        counts = np.zeros(len(merged), dtype=np.int64)
+        counts[np.searchsorted(merged, taxids)] += og_counts
+        counts[np.searchsorted(merged, index.tokens)] += np.bincount(
+            index.codes, minlength=len(index.tokens)
+        )
+        taxids, og_counts = merged, counts
+        if queries:
+            answers.append(_answer_queries_sparse(queries, index))
+        del batch, index
+
+    og_ids = pd.Index(pd.concat(og_ids, ignore_index=True) if og_ids else [], dtype=str)
+    answers = np.concatenate(answers or [np.zeros((len(og_ids), len(queries)), bool)])
+    return MembersSummary(
+        og_ids,
+        np.concatenate(species_counts or [np.zeros(0, dtype=np.int32)]),
+        taxids,
+        og_counts,
+        pd.DataFrame(
+            answers, index=pd.Index(og_ids), columns=[query.name for query in queries]
+        ),
+        pd.concat(homologs) if homologs else None,
+    )
+
+
+# -- Reverse protein ID -> OG index --
+PROTEIN_INDEX_DIR = CACHE_DIR / "protein_index"
+
+
+class ProteinIndex:
+    """
+    Memory-mapped reverse index from protein IDs to orthologous groups.
+
+    Stored as .npy files (see build_protein_index): the sorted protein IDs as
+    fixed-width bytes, the OG row of every protein ID and the OG IDs of all rows.
+    Opening it maps the files instead of reading them, and lookups are binary
+    searches (np.searchsorted), so short-lived scripts can resolve thousands of
+    protein IDs in milliseconds without loading the members table.
+
+    Attributes:
+        keys (np.memmap): Sorted protein IDs (bytes).
+        rows (np.memmap): OG row of every protein ID.
+        og_ids (np.memmap): OG IDs (bytes), indexed by row.
+    """
+
+    def __init__(self, keys: np.ndarray, rows: np.ndarray, og_ids: np.ndarray):
+        self.keys = keys
+        self.rows = rows
+        self.og_ids = og_ids
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __repr__(self) -> str:
+        return f"ProteinIndex({len(self)} proteins, {len(self.og_ids)} OGs)"
+
+    def lookup_rows(self, protein_ids: Iterable[str]) -> np.ndarray:
+        """
+        Get the OG rows (members file order) of many protein IDs at once.
+
+        Args:
+            protein_ids (Iterable[str]): Protein IDs, e.g. "9606.ENSP00000404705".
+
+        Returns:
+            np.ndarray: OG rows, -1 for protein IDs not in the index.
+        """
+        encoded = [str(protein_id).strip().encode() for protein_id in protein_ids]
+        if len(self.keys) == 0:
+            return np.full(len(encoded), -1, dtype=np.int64)
+        queries = np.array(encoded, dtype=self.keys.dtype)
+        positions = np.searchsorted(self.keys, queries)
+        positions = np.minimum(positions, len(self.keys) - 1)
+        found = self.keys[positions] == queries
+        # IDs longer than the stored width are truncated by the dtype, never a match
+        width = self.keys.dtype.itemsize
+        found &= np.array([0 < len(query) <= width for query in encoded], dtype=bool)
+        return np.where(found, self.rows[positions], -1).astype(np.int64)
+
+    def lookup(self, protein_ids: Iterable[str]) -> List[Optional[str]]:
+        """
+        Get the orthologous group IDs of many protein IDs at once.
+
+        Args:
+            protein_ids (Iterable[str]): Protein IDs.
+
+        Returns:
+            List[Optional[str]]: OG IDs, None for protein IDs not in the index.
+
+        Examples:
+            >>> index = ProteinIndex(np.array([b'10090.B', b'9606.A'], dtype='S7'),
+            ...                      np.array([1, 0]), np.array([b'OG1', b'OG2']))
+            >>> index.lookup(['9606.A', '10090.B', '562.C'])
+            ['OG1', 'OG2', None]
+        """
+        rows = self.lookup_rows(protein_ids)
+        return [self.og_ids[row].decode() if row >= 0 else None for row in rows]
+
+
+@profiled
+def build_protein_index(
+    path: str = "data/zips/33208_members.tsv.gz",
+    directory: Path = PROTEIN_INDEX_DIR,
+    max_memory_mb: int = 256,
+    force: bool = False,
+) -> ProteinIndex:
+    """
+    Build the reverse protein ID -> OG index from the members file and store it
+    as memory-mappable .npy files.
+
+    The members file is streamed (see iter_members_batches). The index is not
+    rebuilt if it was built from the same source file (path, size and modification
+    time) and all its .npy files exist, unless force is True.
+
+    Args:
+        path (str): Path of the (gzip compressed) members file.
+                    Defaults to 'data/zips/33208_members.tsv.gz'.
+        directory (Path): Directory of the index files. Defaults to data/cache/protein_index.
+        max_memory_mb (int): Memory ceiling for reading the members file.
+        force (bool): Rebuild even if the index is up to date. Defaults to False.
+
+    Returns:
+        ProteinIndex: The (memory-mapped) index.
+
+    Raises:
+        FileNotFoundError: If the members file is not found.
+        pd.errors.ParserError: If the file is corrupted or malformed.
+
+    Examples:
+        >>> import tempfile
+        >>> directory = Path(tempfile.mkdtemp())
+        >>> members = directory / 'members.tsv'
+        >>> row = ['33208', 'OG1', '2', '2', '9606.P1,10090.P2', '9606,10090']
+        >>> _ = members.write_text(chr(9).join(row) + chr(10))
+        >>> build_protein_index(members, directory / 'index').lookup(['9606.P1'])
+        ['OG1']
+        >>> (directory / 'index' / 'rows.npy').unlink()
+        >>> len(build_protein_index(members, directory / 'index'))
+        2
+    """
+    directory = Path(directory)
+    meta_file = directory / "meta.json"
+    if not Path(path).exists():
+        raise FileNotFoundError(
+            f"File '{path}' not found. Run: bash runall.sh to download files."
+        )
+    source = str(Path(path).resolve())
+    fingerprint = _file_fingerprint(Path(path), with_hash=False)
+    index_files = [directory / f"{name}.npy" for name in ("keys", "rows", "og_ids")]
+    if (
+        not force
+        and meta_file.exists()
+        and all(index_file.exists() for index_file in index_files)
+    ):
+        meta = json.loads(meta_file.read_text())
+        if meta.get("path") == source and {
+            k: meta["source"].get(k) for k in ("size", "mtime_ns")
+        } == {
+            "size": fingerprint["size"],
+            "mtime_ns": fingerprint["mtime_ns"],
+        }:
+            return load_protein_index(directory)
+
+    keys, rows, og_ids = [], [], []
+    n_rows = 0
+    for batch in iter_members_batches(path, max_memory_mb=max_memory_mb):
+        strings = batch["protein_id"].fillna("").astype(str).tolist()
+        lengths = [string.count(",") + 1 if string else 0 for string in strings]
+        joined = ",".join(string for string in strings if string)
+        keys.append(
+            np.array(
+                [key.strip().encode() for key in joined.split(",")] if joined else []
+            )
+        )
+        rows.append(np.repeat(np.arange(n_rows, n_rows + len(batch)), lengths))
+        og_ids.append(
+            batch["orthologous_group_id"].astype(str).str.encode("ascii").to_numpy()
+        )
+        n_rows += len(batch)
+
+    width = max([part.dtype.itemsize for part in keys if len(part)] or [1])
+    keys = np.concatenate(
+        [part.astype(f"S{width}") for part in keys] or [np.zeros(0, "S1")]
+    )
+    rows = np.concatenate(rows or [np.zeros(0, np.int64)]).astype(np.int32)
+    og_ids = np.array(
+        np.concatenate(og_ids or [np.zeros(0, object)]).tolist(), dtype=bytes
+    )
+    order = np.argsort(keys, kind="stable")
+
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, array in (
+        ("keys", keys[order]),
+        ("rows", rows[order]),
+        ("og_ids", og_ids),
+    ):
+        tmp_file = directory / f"{name}.tmp.npy"
+        np.save(tmp_file, array)
+        os.replace(tmp_file, directory / f"{name}.npy")
+    meta_file.write_text(json.dumps({"source": fingerprint, "path": source}))
+    return load_protein_index(directory)
+
+
+def load_protein_index(directory: Path = PROTEIN_INDEX_DIR) -> ProteinIndex:
+    """
+    Open a reverse protein ID -> OG index (see build_protein_index) memory-mapped.
+
+    Args:
+        directory (Path): Directory of the index files. Defaults to data/cache/protein_index.
+
+    Returns:
+        ProteinIndex: The index; no data is read until it is looked up.
+
+    Raises:
+        FileNotFoundError: If the index was not built yet.
+    """
+    directory = Path(directory)
+    try:
+        return ProteinIndex(
+            np.load(directory / "keys.npy", mmap_mode="r"),
+            np.load(directory / "rows.npy", mmap_mode="r"),
+            np.load(directory / "og_ids.npy", mmap_mode="r"),
+        )
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            f"Protein index not found in '{directory}'. Build it with build_protein_index()."
+        )
+
+
+# -- Local query server --
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8765
+# longest request line the server reads (requests may carry many OG IDs)
+SERVER_MAX_LINE = 2**26
+
+
+class QueryServer:
+    """
+    Answers JSON queries against eggNOG structures that are loaded once and kept
+    in memory, so every question costs milliseconds instead of a full main.py run.
+
+    The protocol is one JSON object per line in each direction (TCP on localhost or
+    a Unix socket). Requests name an "op":
+
+    - ping: sizes of the loaded data.
+    - query: OGs matching include/include_any/exclude/only_within/
+      min_species_fraction (see Query). Species are taxids or species names,
+      within_clade restricts to a clade given by name or taxid. Optional limit.
+    - universal: OGs present in at least "fraction" (default 0.99) of all species.
+    - clade: taxids and names of the species under a clade.
+    - categories: functional category counts of "og_ids" (needs categories).
+
+    Responses carry "ok": true and the result, or "ok": false and an "error".
+    Requests run on a thread pool, so slow queries do not block other clients.
+
+    Attributes:
+        presence (PresenceMatrix): The OG x species presence matrix.
+        taxonomy (TaxonomyIndex): Species names and lineages.
+        categories (Optional[CategoryMatrix]): Functional categories, if loaded.
+
+    Examples:
+        >>> taxonomy = build_taxonomy_index(pd.DataFrame({
+        ...     'species_taxid': [9606, 9598, 10090],
+        ...     'species_name': ['Homo sapiens', 'Pan troglodytes', 'Mus musculus'],
+        ...     'rank': ['species', 'species', 'species'],
+        ...     'named_lineage': ['root,Primates,Homo sapiens', 'root,Primates,Pan troglodytes',
+        ...                       'root,Rodentia,Mus musculus'],
+        ...     'tax_id_lineage': ['1,9443,9606', '1,9443,9598', '1,9989,10090']}))
+        >>> pm = PresenceMatrix(['OG1', 'OG2', 'OG3'], [9606, 9598, 10090],
+        ...                     np.array([[1, 1, 0], [1, 1, 1], [1, 0, 1]], dtype=bool))
+        >>> server = QueryServer(pm, taxonomy)
+        >>> server.handle({"op": "query", "include": ["Homo sapiens", 9598],
+        ...                "exclude": ["Mus musculus"]})
+        {'ok': True, 'count': 1, 'og_ids': ['OG1']}
+        >>> server.handle({"op": "query", "include": [9606], "within_clade": "Primates"})
+        {'ok': True, 'count': 1, 'og_ids': ['OG1']}
+        >>> server.handle({"op": "universal", "fraction": 1.0})
+        {'ok': True, 'min_species': 3, 'count': 1, 'og_ids': ['OG2']}
+        >>> server.handle({"op": "query", "include": ["Unknown species"]})
+        {'ok': False, 'error': "Species 'Unknown species' not found or has duplicate entries in dataframe."}
+    """
+
+    def __init__(
+        self,
+        presence: "PresenceMatrix",
+        taxonomy: TaxonomyIndex,
+        categories: Optional["CategoryMatrix"] = None,
+        max_workers: Optional[int] = None,
+    ):
+        self.presence = presence
+        self.taxonomy = taxonomy
+        self.categories = categories
+        self.max_workers = max_workers
+        self._coverage = None
+        self._operations = {
+            "ping": self._ping,
+            "query": self._query,
+            "universal": self._universal,
+            "clade": self._clade,
+            "categories": self._categories,
+        }
+
+    def handle(self, request: dict) -> dict:
+        """
+        Answer one request. Thread-safe: the loaded structures are only read.
+
+        Errors of any kind become an error response, so a failing operation never
+        takes the client connection down.
+
+        Args:
+            request (dict): The decoded JSON request with an "op" key.
+
+        Returns:
+            dict: The JSON-serializable response.
+
+        Examples:
+            >>> server = QueryServer(PresenceMatrix([], [], np.zeros((0, 0), dtype=bool)),
+            ...                      None)
+            >>> server._operations["broken"] = lambda request: 1 / 0
+            >>> server.handle({"op": "broken"})
+            {'ok': False, 'error': 'Internal error: ZeroDivisionError: division by zero'}
+        """
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "Request must be a JSON object."}
+        operation = self._operations.get(request.get("op"))
+        if operation is None:
+            return {
+                "ok": False,
+                "error": f"Unknown op {request.get('op')!r}. "
+                f"Available: {sorted(self._operations)}",
+            }
+        try:
+            return {"ok": True, **operation(request)}
+        except (KeyError, TypeError, ValueError) as e:
+            return {"ok": False, "error": str(e.args[0]) if e.args else repr(e)}
+        except Exception as e:
+            return {"ok": False, "error": f"Internal error: {type(e).__name__}: {e}"}
+
+    @staticmethod
+    def _encode(response: dict) -> bytes:
+        """
+        Encode a response as one JSON line, or an error if it is not serializable.
+
+        Examples:
+            >>> QueryServer._encode({"ok": True, "og_ids": {"OG1"}})
+            b'{"ok": false, "error": "Response is not JSON-serializable: Object of type set is not JSON serializable"}\\n'
+        """
+        try:
+            return json.dumps(response).encode() + b"\n"
+        except (TypeError, ValueError) as e:
+            error = {"ok": False, "error": f"Response is not JSON-serializable: {e}"}
+            return json.dumps(error).encode() + b"\n"
+
+    def _species(self, values) -> List[int]:
+        # species are given as taxids or as names
+        return [
+            self.taxonomy.id_by_name(value) if isinstance(value, str) else int(value)
+            for value in values
+        ]
+
+    def _clade_taxid(self, clade) -> int:
+        if isinstance(clade, str):
+            return self.taxonomy.clade_id_by_name(clade)
+        return int(clade)
+
+    def _og_ids(self, mask: np.ndarray, limit: Optional[int]) -> dict:
+        og_ids = self.presence.og_ids[mask]
+        if limit is not None:
+            og_ids = og_ids[: int(limit)]
+        return {"count": int(mask.sum()), "og_ids": og_ids.tolist()}
+
+    def _ping(self, request: dict) -> dict:
+        return {
+            "n_ogs": len(self.presence.og_ids),
+            "n_species": len(self.presence.taxids),
+            "categories": self.categories is not None,
+        }
+
+    def _query(self, request: dict) -> dict:
+        only_within = request.get("only_within")
+        if only_within is not None:
+            only_within = self._species(only_within)
+        if request.get("within_clade") is not None:
+            clade = self.taxonomy.clade_species(
+                self._clade_taxid(request["within_clade"])
+            ).tolist()
+            only_within = (
+                clade
+                if only_within is None
+                else sorted(set(only_within).intersection(clade))
+            )
+        query = Query(
+            "query",
+            include=self._species(request.get("include", ())),
+            include_any=[self._species(g) for g in request.get("include_any", ())],
+            exclude=self._species(request.get("exclude", ())),
+            only_within=only_within,
+            min_species_fraction=float(request.get("min_species_fraction", 0.0)),
+        )
+        mask = run_queries([query], self.presence)["query"].to_numpy()
+        return self._og_ids(mask, request.get("limit"))
+
+    def _universal(self, request: dict) -> dict:
+        if self._coverage is None:
+            self._coverage = self.presence.coverage()
+        fraction = float(request.get("fraction", 0.99))
+        mask = self._coverage.mask(fraction)
+        return {
+            "min_species": self._coverage.min_species(fraction),
+            **self._og_ids(mask, request.get("limit")),
+        }
+
+    def _clade(self, request: dict) -> dict:
+        taxids = self.taxonomy.clade_species(self._clade_taxid(request["clade"]))
+        return {
+            "taxids": taxids.tolist(),
+            "names": self.taxonomy.resolve_ids(taxids).tolist(),
+        }
+
+    def _categories(self, request: dict) -> dict:
+        if self.categories is None:
+            raise ValueError("Functional categories are not loaded on this server.")
+        counts = self.categories.category_counts(request["og_ids"])
+        return {"counts": dict(zip(counts["category_code"], counts["count"].tolist()))}
+
+    async def _serve_client(self, reader, writer, executor):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    # the rest of the line can not be told apart from the next
+                    # request, so answer and close the connection
+                    error = f"Request line longer than {SERVER_MAX_LINE} bytes."
+                    writer.write(self._encode({"ok": False, "error": error}))
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as e:  # also invalid UTF-8
+                    response = {"ok": False, "error": f"Invalid JSON: {e}"}
+                else:
+                    try:
+                        response = await loop.run_in_executor(
+                            executor, self.handle, request
+                        )
+                    except Exception as e:
+                        response = {
+                            "ok": False,
+                            "error": f"Internal error: {type(e).__name__}: {e}",
+                        }
+                writer.write(self._encode(response))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(
+        self,
+        host: str = SERVER_HOST,
+        port: int = SERVER_PORT,
+        unix_path: Optional[str] = None,
+        ready: Optional[Callable[[object], None]] = None,
+    ):
+        """
+        Serve requests until cancelled.
+
+        Args:
+            host (str): Interface to listen on. Defaults to localhost only.
+            port (int): TCP port. Defaults to SERVER_PORT.
+            unix_path (Optional[str]): Listen on this Unix socket instead of TCP.
+            ready (Optional[Callable]): Called with the bound socket address once
+                                        the server accepts connections.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+
+            def on_connect(reader, writer):
+                return self._serve_client(reader, writer, executor)
+
+            if unix_path is not None:
+                server = await asyncio.start_unix_server(
+                    on_connect, path=unix_path, limit=SERVER_MAX_LINE
+                )
+            else:
+                server = await asyncio.start_server(
+                    on_connect, host, port, limit=SERVER_MAX_LINE
+                )
+            if ready is not None:
+                ready(server.sockets[0].getsockname())
+            async with server:
+                await server.serve_forever()
+
+    def serve_forever(
+        self,
+        host: str = SERVER_HOST,
+        port: int = SERVER_PORT,
+        unix_path: Optional[str] = None,
+    ):
+        """Blocking version of serve(); stops on Ctrl+C."""
+        address = unix_path or f"{host}:{port}"
+        print(f"eggNOG query server listening on {address} (Ctrl+C to stop) ...")
+        try:
+            asyncio.run(self.serve(host, port, unix_path))
+        except KeyboardInterrupt:
+            pass
+
+
+class QueryClient:
+    """
+    Client for a running QueryServer (see main.py --serve). Keeps one connection open.
+
+    Examples:
+        Requires a running server, e.g. ``python main.py --serve``:
+
+        >>> with QueryClient() as client:  # doctest: +SKIP
+        ...     client.query(include=["Homo sapiens", "Pan troglodytes"],
+        ...                  exclude=["Mus musculus"])[:2]
+        ['1A3B4@33208', '1A3B7@33208']
+    """
+
+    def __init__(
+        self,
+        host: str = SERVER_HOST,
+        port: int = SERVER_PORT,
+        unix_path: Optional[str] = None,
+        timeout: Optional[float] = 60.0,
+    ):
+        try:
+            if unix_path is not None:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.settimeout(timeout)
+                self._socket.connect(unix_path)
+            else:
+                self._socket = socket.create_connection((host, port), timeout=timeout)
+        except OSError as e:
+            raise ConnectionError(
+                f"No eggNOG query server at {unix_path or f'{host}:{port}'} ({e}). "
+                f"Start one with: python main.py --serve"
+            )
+        self._file = self._socket.makefile("rwb")
+
+    def __enter__(self) -> "QueryClient":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def request(self, op: str, **params) -> dict:
+        """
+        Send one request and wait for its response.
+
+        Args:
+            op (str): The operation (see QueryServer).
+            **params: Parameters of the operation.
+
+        Returns:
+            dict: The response without the "ok" flag.
+
+        Raises:
+            ValueError: If the server could not answer the request.
+        """
+        self._file.write(json.dumps({"op": op, **params}).encode() + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("The eggNOG query server closed the connection.")
+        response = json.loads(line)
+        if not response.pop("ok"):
+            raise ValueError(response["error"])
+        return response
+
+    def query(
+        self,
+        include: Sequence = (),
+        include_any: Sequence[Sequence] = (),
+        exclude: Sequence = (),
+        only_within: Optional[Sequence] = None,
+        within_clade=None,
+        min_species_fraction: float = 0.0,
+        limit: Optional[int] = None,
+    ) -> List[str]:
+        """OG IDs matching the conditions (species as taxids or names, see Query)."""
+        return self.request(
+            "query",
+            include=list(include),
+            include_any=[list(group) for group in include_any],
+            exclude=list(exclude),
+            only_within=None if only_within is None else list(only_within),
+            within_clade=within_clade,
+            min_species_fraction=min_species_fraction,
+            limit=limit,
+        )["og_ids"]
+
+    def universal(
+        self, fraction: float = 0.99, limit: Optional[int] = None
+    ) -> List[str]:
+        """OG IDs present in at least the given fraction of all species."""
+        return self.request("universal", fraction=fraction, limit=limit)["og_ids"]
+
+    def clade_species(self, clade) -> List[int]:
+        """Taxids of the species under a clade given by name or taxid."""
+        return self.request("clade", clade=clade)["taxids"]
+
+    def category_counts(self, og_ids: Iterable[str]) -> Dict[str, int]:
+        """Functional category counts of the given OGs."""
+        return self.request("categories", og_ids=list(og_ids))["counts"]
+
+
+# -- Multi-level processing --
+# taxonomy shared by the workers of analyze_levels, set once per worker process
+_LEVEL_TAXONOMY: Optional[TaxonomyIndex] = None
+
+
+def _init_level_worker(taxonomy: TaxonomyIndex):
+    global _LEVEL_TAXONOMY
+    _LEVEL_TAXONOMY = taxonomy
+
+
+def summarize_level(
+    tax_level: int,
+    taxonomy: Optional[TaxonomyIndex] = None,
+    queries: Sequence[Query] = (),
+    universal_fraction: float = 0.99,
+    data_dir: str = DATA_DIR,
+    cache: bool = True,
+    stream: Optional[bool] = None,
+    max_memory_mb: int = 256,
+) -> dict:
+    """
+    Run the analyses on the members file of one taxonomic level.
+
+    Builds the level's presence matrix, answers the queries on it and counts the
+    universal OGs; streamed levels are reduced batch by batch instead, without a
+    presence matrix. The taxonomy gives the level's name and the number of species
+    of the clade, to see how many of them the level's OGs actually contain.
+
+    Args:
+        tax_level (int): The taxonomic level, e.g. 7742 for Vertebrata.
+        taxonomy (Optional[TaxonomyIndex]): The taxonomy. Defaults to the one
+            shared with the worker process by analyze_levels.
+        queries (Sequence[Query]): Queries to answer (see run_queries).
+        universal_fraction (float): Species fraction for universal OGs. Defaults to 0.99.
+        data_dir (str): Directory of the downloaded files. Defaults to "data".
+        cache (bool): Use the on-disk cache for the members table. Defaults to True.
+        stream (Optional[bool]): Reduce data_dir/zips/<tax_level>_members.tsv.gz
+                                 batch by batch in bounded memory instead of
+                                 loading the members table (summarize_members_stream).
+                                 Defaults to streaming if the level is not extracted.
+        max_memory_mb (int): Memory ceiling of the stream's batches; the per-OG
+                             results come on top (see summarize_members_stream).
+                             Does not apply to levels that are loaded.
+                             Defaults to 256.
+
+    Returns:
+        dict: tax_level, level_name, n_ogs, n_species, n_clade_species,
+              n_universal and the number of matching OGs per query name.
+
+    Raises:
+        FileNotFoundError: If the members file of the level is missing.
+    """
+    taxonomy = taxonomy if taxonomy is not None else _LEVEL_TAXONOMY
+    compressed_file = os.path.join(data_dir, "zips", f"{tax_level}_members.tsv.gz")
+    if stream is None:
+        stream = not os.path.exists(
+            os.path.join(data_dir, f"{tax_level}_members.tsv")
+        ) and os.path.exists(compressed_file)
+    if stream:
+        # large levels (e.g. Eukaryota) are never held in memory as a whole
+        summary = summarize_members_stream(
+            path=compressed_file, max_memory_mb=max_memory_mb, queries=queries
+        )
+        n_ogs, coverage = len(summary.og_ids), summary.coverage()
+        answers = summary.answers
+    else:
+        df_members = dataframe_setup_members(
+            cache=cache, tax_level=tax_level, data_dir=data_dir
+        )
+        # level workers already run in parallel, so parse the taxids in-process
+        presence = build_presence_matrix(df_members, workers=1)
+        n_ogs, coverage = len(presence.og_ids), presence.coverage()
+        answers = run_queries(list(queries), presence) if queries else None
+    row = {
+        "tax_level": tax_level,
+        "level_name": None,
+        "n_ogs": n_ogs,
+        "n_species": coverage.n_species,
+        "n_clade_species": None,
+        "n_universal": coverage.n_at_least_fraction(universal_fraction),
+    }
+    if taxonomy is not None and tax_level in taxonomy.clade_taxids:
+        row["level_name"] = taxonomy.clade_name_by_id(tax_level)
+        row["n_clade_species"] = int(taxonomy.clade_mask(tax_level).sum())
+    if queries:
+        for query in queries:
+            row[query.name] = int(answers[query.name].sum())
+    return row
+
+
+def analyze_levels(
+    tax_levels: Iterable[int],
+    queries: Sequence[Query] = (),
+    universal_fraction: float = 0.99,
+    taxonomy: Optional[TaxonomyIndex] = None,
+    data_dir: str = DATA_DIR,
+    workers: Optional[int] = None,
+    stream: Optional[bool] = None,
+    max_memory_mb: int = 256,
+) -> pd.DataFrame:
+    """
+    Run summarize_level for several taxonomic levels concurrently in a process pool.
+
+    The taxonomy index is built once (or taken as given) and handed to each worker
+    process once through the pool initializer, instead of being rebuilt per level.
+    max_memory_mb is shared by the levels streamed at the same time: every worker
+    streams with its part of it.
+
+    Args:
+        tax_levels (Iterable[int]): The levels, e.g. [7742, 40674, 2759].
+        queries (Sequence[Query]): Queries to answer on every level.
+        universal_fraction (float): Species fraction for universal OGs. Defaults to 0.99.
+        taxonomy (Optional[TaxonomyIndex]): The taxonomy. Built from
+            e5.taxid_info.tsv in data_dir if None.
+        data_dir (str): Directory of the downloaded files. Defaults to "data".
+        workers (Optional[int]): Worker processes. Defaults to min(number of
+                                 levels, number of CPUs); 1 runs in-process.
+        stream (Optional[bool]): Stream the compressed members files, see
+                                 summarize_level. Defaults to streaming the levels
+                                 that are not extracted.
+        max_memory_mb (int): Memory ceiling of all concurrent streams together,
+                             split evenly between the workers (plus the per-OG
+                             results of each level, see summarize_level).
+                             Defaults to 256.
+
+    Returns:
+        pd.DataFrame: One row per level (in the given order), see summarize_level.
+
+    Raises:
+        FileNotFoundError: If the members file of a level is missing.
+    """
+    tax_levels = [int(level) for level in tax_levels]
+    if taxonomy is None:
+        taxonomy = build_taxonomy_index(
+            dataframe_setup_taxid_info(cache=True, data_dir=data_dir)
+        )
+    if workers is None:
+        workers = min(len(tax_levels), os.cpu_count() or 1)
+    arguments = dict(
+        queries=tuple(queries),
+        universal_fraction=universal_fraction,
+        data_dir=data_dir,
+        stream=stream,
+        # the workers stream at the same time
+        max_memory_mb=max(1, max_memory_mb // max(workers, 1)),
+    )
+    if workers <= 1:
+        rows = [summarize_level(level, taxonomy, **arguments) for level in tax_levels]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_level_worker,
+            initargs=(taxonomy,),
+        ) as pool:
+            futures = [
+                pool.submit(summarize_level, level, None, **arguments)
+                for level in tax_levels
+            ]
+            rows = [future.result() for future in futures]
+    return pd.DataFrame(rows)
+
+
+# -- Compact in-memory layout --
+class CompactMembers:
+    """
+    Members table in a compact columnar layout without Python objects per row.
+
+    - evolutionary_level and orthologous_group_id are categoricals (a code per row
+      plus the distinct values once),
+    - num_of_proteins / num_of_species use the smallest unsigned integer type that
+      holds them (e.g. uint16 for species counts),
+    - the comma-separated protein IDs of all rows are one UTF-8 byte buffer with
+      the byte offset of every row (CSR layout),
+    - the species taxids are a TokenIndex parsed from the taxid prefixes of the
+      protein IDs (see parse_taxid_column) whose codes use the smallest unsigned
+      type for the number of species (uint8 for <= 256), with the number of
+      proteins (copies) of every species.
+
+    Build it with compact_members; memory_usage / memory_report show the savings.
+    The analyses work on it directly: presence_matrix and copy_number_matrix come
+    from the parsed taxids, protein_ids decodes the protein IDs of selected rows.
+
+    Attributes:
+        table (pd.DataFrame): evolutionary_level, orthologous_group_id (categoricals),
+                              num_of_proteins, num_of_species (unsigned integers).
+        protein_buffer (np.ndarray): uint8 bytes of the protein_id strings of all rows.
+        protein_offsets (np.ndarray): Row boundaries into protein_buffer, length rows + 1.
+        taxids (TokenIndex): Distinct species taxids of every row, sorted, with
+                             their copy numbers (TokenIndex.counts).
+    """
+
+    def __init__(
+        self,
+        table: pd.DataFrame,
+        protein_buffer: np.ndarray,
+        protein_offsets: np.ndarray,
+        taxids: TokenIndex,
+    ):
+        self.table = table
+        self.protein_buffer = protein_buffer
+        self.protein_offsets = protein_offsets
+        self.taxids = taxids
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __repr__(self) -> str:
+        return f"CompactMembers({len(self)} OGs, {len(self.taxids.tokens)} species)"
+
+    def _protein_string(self, row: int) -> str:
+        start, end = self.protein_offsets[row], self.protein_offsets[row + 1]
+        return self.protein_buffer[start:end].tobytes().decode()
+
+    def protein_ids(self, rows: Iterable[int]) -> List[str]:
+        """
+        Get the protein IDs of the given rows, row after row.
+
+        Args:
+            rows (Iterable[int]): Row positions (or a boolean mask over the rows).
+
+        Returns:
+            List[str]: The protein IDs in file order.
+        """
+        proteins = []
+        for row in np.arange(len(self))[np.asarray(rows)]:
+            string = self._protein_string(row)
+            if string:
+                proteins += string.split(",")
+        return proteins
+
+    def species(self, row: int) -> np.ndarray:
+        """Get the taxids of the species of one row."""
+        codes = self.taxids.codes[
+            self.taxids.offsets[row] : self.taxids.offsets[row + 1]
+        ]
+        return self.taxids.tokens[codes]
+
+    @property
+    def og_ids(self) -> np.ndarray:
+        """Orthologous group IDs, one per row."""
+        return self.table["orthologous_group_id"].astype(str).to_numpy()
+
+    def presence_matrix(self) -> "PresenceMatrix":
+        """Build the OG x species PresenceMatrix from the encoded taxids."""
+        return _presence_matrix_from_index(
+            self.table[["orthologous_group_id"]].astype(str), self.taxids
+        )
+
+    def copy_number_matrix(self) -> "CopyNumberMatrix":
+        """Build the OG x species CopyNumberMatrix on the encoded taxids (not copied)."""
+        return CopyNumberMatrix(
+            self.og_ids,
+            self.taxids.tokens,
+            self.taxids.offsets,
+            self.taxids.codes,
+            self.taxids.counts,
+        )
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Decode back into the layout of dataframe_setup_members (species taxids sorted).
+
+        Returns:
+            pd.DataFrame: The members dataframe with plain string and int64 columns.
+        """
+        df = self.table.astype(
+            {
+                "evolutionary_level": np.int64,
+                "orthologous_group_id": str,
+                "num_of_proteins": np.int64,
+                "num_of_species": np.int64,
+            }
+        )
+        df["protein_id"] = [self._protein_string(row) for row in range(len(self))]
+        taxids = self.taxids.tokens[self.taxids.codes].astype(str)
+        df["species_taxid_containing_protein"] = [
+            ",".join(taxids[start:end])
+            for start, end in zip(self.taxids.offsets[:-1], self.taxids.offsets[1:])
+        ]
+        return df[MEMBERS_COLUMNS]
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes held by every component (deep, including categories)."""
+        usage = {
+            f"table.{column}": int(size)
+            for column, size in self.table.memory_usage(index=False, deep=True).items()
+        }
+        usage["protein_buffer"] = self.protein_buffer.nbytes
+        usage["protein_offsets"] = self.protein_offsets.nbytes
+        usage["taxids"] = (
+            self.taxids.tokens.nbytes
+            + self.taxids.offsets.nbytes
+            + self.taxids.codes.nbytes
+            + (self.taxids.counts.nbytes if self.taxids.counts is not None else 0)
+        )
+        return usage
+
+
+def _smallest_unsigned(values: pd.Series) -> pd.Series:
+    # counts are never negative; uint16 for species counts, uint32 for large OGs
+    return pd.to_numeric(values, downcast="unsigned")
+
+
+@profiled
+def compact_members(
+    df_members: pd.DataFrame, workers: Optional[int] = None
+) -> CompactMembers:
+    """
+    Encode a members dataframe (see dataframe_setup_members) as CompactMembers.
+
+    The taxids are parsed from the protein IDs once, keeping the copy numbers, so
+    the species taxid column is not needed afterwards.
+
+    Args:
+        df_members (pd.DataFrame): The members dataframe.
+        workers (Optional[int]): Processes for parsing the taxids (see
+                                 parse_taxid_column). Defaults to all CPUs.
+
+    Returns:
+        CompactMembers: The encoded table.
+
+    Raises:
+        KeyError: If a required column is missing from the dataframe.
+        ValueError: If the taxid column contains non-numeric taxids.
+
+    Examples:
+        >>> compact = compact_members(pd.DataFrame({
+        ...     'evolutionary_level': [33208, 33208], 'orthologous_group_id': ['OG1', 'OG2'],
+        ...     'num_of_proteins': [3, 1], 'num_of_species': [2, 1],
+        ...     'protein_id': ['9606.A,9606.B,10090.C', '562.D'],
+        ...     'species_taxid_containing_protein': ['9606,10090', '562']}), workers=1)
+        >>> compact
+        CompactMembers(2 OGs, 3 species)
+        >>> compact.table.dtypes.astype(str).tolist()
+        ['category', 'category', 'uint8', 'uint8']
+        >>> compact.protein_ids([0])
+        ['9606.A', '9606.B', '10090.C']
+        >>> compact.species(0).tolist()
+        [9606, 10090]
+        >>> compact.copy_number_matrix().copies([9606, 562]).tolist()
+        [[2, 0], [0, 1]]
+        >>> compact.to_dataframe()["protein_id"].tolist()
+        ['9606.A,9606.B,10090.C', '562.D']
+    """
+    try:
+        table = pd.DataFrame(
+            {
+                "evolutionary_level": df_members["evolutionary_level"].astype(
+                    "category"
+                ),
+                "orthologous_group_id": df_members["orthologous_group_id"].astype(
+                    "category"
+                ),
+                "num_of_proteins": _smallest_unsigned(df_members["num_of_proteins"]),
+                "num_of_species": _smallest_unsigned(df_members["num_of_species"]),
+            }
+        ).reset_index(drop=True)
+        proteins = df_members["protein_id"].fillna("").astype(str)
+    except KeyError as e:
+        raise KeyError(
+            f"Column {e} not found in dataframe. "
+            f"Available columns: {list(df_members.columns)}"
+        )
+
+    encoded = [string.encode() for string in proteins.tolist()]
+    protein_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=protein_offsets[1:])
+    buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    taxids = parse_taxid_column(proteins, workers=workers, counts=True)
+    codes = np.asarray(taxids.codes)
+    if len(codes):
+        codes = pd.to_numeric(pd.Series(codes), downcast="unsigned").to_numpy()
+    counts = taxids.counts.astype(
+        np.min_scalar_type(max(taxids.counts.max(initial=1), 1))
+    )
+    return CompactMembers(
+        table,
+        buffer,
+        protein_offsets,
+        TokenIndex(taxids.tokens, taxids.offsets, codes, counts),
+    )
+
+
+def compact_annotations(df_annotations: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the annotations dataframe (see dataframe_setup_annotations) to compact dtypes:
+    categoricals for evolutionary_level, orthologous_group_id and functional_category.
+
+    Args:
+        df_annotations (pd.DataFrame): The annotations dataframe.
+
+    Returns:
+        pd.DataFrame: A copy with compact dtypes; functional_description is unchanged.
+
+    Examples:
+        >>> compact_annotations(pd.DataFrame({
+        ...     'evolutionary_level': [33208, 33208], 'orthologous_group_id': ['OG1', 'OG2'],
+        ...     'functional_category': ['S', 'S'], 'functional_description': ['a', 'b']}
+        ... )).dtypes.astype(str).tolist()[:3]
+        ['category', 'category', 'category']
+    """
+    columns = ["evolutionary_level", "orthologous_group_id", "functional_category"]
+    missing = [column for column in columns if column not in df_annotations.columns]
+    if missing:
+        raise KeyError(
+            f"Column {missing[0]!r} not found in dataframe. "
+            f"Available columns: {list(df_annotations.columns)}"
+        )
+    return df_annotations.astype({column: "category" for column in columns})
+
+
+def memory_report(tables: Dict[str, object]) -> pd.DataFrame:
+    """
+    Report the memory held by dataframes, CompactMembers, presence matrices or arrays.
+
+    Args:
+        tables (Dict[str, object]): Mapping of a name to the object to measure.
+
+    Returns:
+        pd.DataFrame: Columns table, component, dtype and megabytes (deep sizes,
+                      including the Python string objects of object columns).
+
+    Examples:
+        >>> report = memory_report({"ids": pd.DataFrame({"count": np.zeros(4, np.int64)})})
+        >>> report[["table", "component", "dtype"]].values.tolist()
+        [['ids', 'count', 'int64']]
+        >>> float(report["megabytes"].iloc[0] * 2**20)
+        32.0
+    """
+    rows = []
+    for name, value in tables.items():
+        if isinstance(value, pd.DataFrame):
+            usage = value.memory_usage(index=False, deep=True)
+            for column, size in usage.items():
+                rows.append((name, column, str(value[column].dtype), size))
+        elif isinstance(value, CompactMembers):
+            for component, size in value.memory_usage().items():
+                column = component.split(".", 1)[-1]
+                if component.startswith("table."):
+                    dtype = str(value.table[column].dtype)
+                elif component == "taxids":
+                    dtype = str(value.taxids.codes.dtype)
+                else:
+                    dtype = str(getattr(value, component).dtype)
+                rows.append((name, component, dtype, size))
+        elif isinstance(value, PresenceMatrix):
+            rows.append((name, "matrix", str(value.matrix.dtype), value.matrix.nbytes))
+        elif isinstance(value, np.ndarray):
+            rows.append((name, "array", str(value.dtype), value.nbytes))
+        else:
+            raise TypeError(f"Cannot measure the memory of {type(value).__name__}.")
+    report = pd.DataFrame(rows, columns=["table", "component", "dtype", "bytes"])
+    report["megabytes"] = report.pop("bytes") / 2**20
+    return report
+
+
+# -- Incremental stage pipeline --
+PIPELINE_DIR = CACHE_DIR / "pipeline"
+
+
+def _json_default(value):
+    """Stable JSON form of the values that go into stage fingerprints."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    if isinstance(value, Path):
+        return str(value)
+    if hasattr(value, "__dataclass_fields__"):
+        return {"__type__": type(value).__name__, **vars(value)}
+    return repr(value)
+
+
+def _code_hash(function: Callable) -> str:
+    """Hash of a function's source (bytecode if the source is unavailable)."""
+    try:
+        code = inspect.getsource(function).encode()
+    except (OSError, TypeError):
+        code = getattr(function, "__code__", None)
+        code = code.co_code if code is not None else repr(function).encode()
+    return hashlib.sha256(code).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _library_hash() -> str:
+    """Hash of this module's source; stage functions mostly call into it."""
+    return hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+
+
+class Pipeline:
+    """
+    Dependency graph of named stages whose outputs are persisted between runs.
+
+    Every stage is fingerprinted by its name, version, source code, the source of
+    this library, parameters, the size and modification time of its source files
+    and the fingerprints of its input stages. get() loads a stage from disk if its fingerprint is
+    unchanged and otherwise recomputes it (getting its inputs the same way), so a
+    rerun only recomputes invalid stages and the stages downstream of them. Valid
+    stages never load their inputs.
+
+    Outputs are pickled to directory/<stage>.pkl next to <stage>.json holding the
+    fingerprint. Computed stages are timed as profiling stages (see profile_stage).
+
+    Attributes:
+        directory (Path): Where the stage outputs are persisted.
+        force (bool): Recompute every stage that is requested, ignoring the files.
+        computed (List[str]): Stages computed in this session, in order.
+        loaded (List[str]): Stages loaded from disk in this session.
+
+    Examples:
+        >>> import tempfile
+        >>> def build(directory, n):
+        ...     pipeline = Pipeline(directory)
+        ...     pipeline.add("numbers", lambda: list(range(n)), params={"n": n})
+        ...     pipeline.add("total", lambda numbers: sum(numbers), inputs=["numbers"])
+        ...     return pipeline
+        >>> directory = tempfile.mkdtemp()
+        >>> pipeline = build(directory, 4)
+        >>> pipeline.get("total"), pipeline.computed
+        (6, ['numbers', 'total'])
+        >>> rerun = build(directory, 4)
+        >>> rerun.get("total"), rerun.computed, rerun.loaded
+        (6, [], ['total'])
+        >>> changed = build(directory, 5)
+        >>> changed.get("total"), changed.computed
+        (10, ['numbers', 'total'])
+    """
+
+    def __init__(self, directory: Path = PIPELINE_DIR, force: bool = False):
+        self.directory = Path(directory)
+        self.force = force
+        self.computed = []
+        self.loaded = []
+        self._stages = {}
+        self._values = {}
+        self._fingerprints = {}
+
+    def __repr__(self) -> str:
+        return f"Pipeline({len(self._stages)} stages in '{self.directory}')"
+
+    def add(
+        self,
+        name: str,
+        function: Callable,
+        inputs: Sequence[str] = (),
+        params=None,
+        sources: Sequence[str] = (),
+        version: int = 1,
+    ) -> Callable:
+        """
+        Register a stage.
+
+        Args:
+            name (str): Name of the stage (used as file name).
+            function (Callable): Computes the output from the input stages' outputs,
+                                 passed positionally in the order of inputs.
+            inputs (Sequence[str]): Names of already registered input stages.
+            params: JSON-serializable parameters, or a function returning them
+                    (evaluated only when the fingerprint is needed).
+            sources (Sequence[str]): Files the stage reads directly.
+            version (int): Bump to invalidate stored outputs by hand. Defaults to 1.
+
+        Returns:
+            Callable: function, so add can be used like a decorator.
+
+        Raises:
+            ValueError: If an input stage is not registered.
+        """
+        for stage in inputs:
+            if stage not in self._stages:
+                raise ValueError(
+                    f"Stage '{name}' depends on unknown stage '{stage}'. "
+                    f"Add '{stage}' first."
+                )
+        self._stages[name] = {
+            "function": function,
+            "inputs": tuple(inputs),
+            "params": params,
+            "sources": tuple(str(source) for source in sources),
+            "version": version,
+        }
+        self._fingerprints.pop(name, None)
+        self._values.pop(name, None)
+        return function
+
+    def _spec(self, name: str) -> dict:
+        try:
+            return self._stages[name]
+        except KeyError:
+            raise KeyError(
+                f"Stage '{name}' is not registered. Available: {sorted(self._stages)}"
+            )
+
+    def fingerprint(self, name: str) -> str:
+        """
+        Get the fingerprint of a stage (sha256 of everything its output depends on).
+
+        Args:
+            name (str): Name of the stage.
+
+        Returns:
+            str: Hex digest.
+        """
+        if name not in self._fingerprints:
+            spec = self._spec(name)
+            params = spec["params"]() if callable(spec["params"]) else spec["params"]
+            sources = {}
+            for source in spec["sources"]:
+                path = Path(source)
+                sources[source] = (
+                    _file_fingerprint(path, with_hash=False) if path.exists() else None
+                )
+            payload = {
+                "name": name,
+                "version": spec["version"],
+                "code": _code_hash(spec["function"]),
+                # stage functions are thin; a fix in the library they call must
+                # invalidate their stored outputs too
+                "library": _library_hash(),
+                "params": params,
+                "sources": sources,
+                "inputs": {stage: self.fingerprint(stage) for stage in spec["inputs"]},
+            }
+            self._fingerprints[name] = hashlib.sha256(
+                json.dumps(payload, sort_keys=True, default=_json_default).encode()
+            ).hexdigest()
+        return self._fingerprints[name]
+
+    def _paths(self, name: str) -> Tuple[Path, Path]:
+        return self.directory / f"{name}.pkl", self.directory / f"{name}.json"
+
+    def is_valid(self, name: str) -> bool:
+        """Whether the stored output of a stage matches its current fingerprint."""
+        data_file, meta_file = self._paths(name)
+        if self.force or not data_file.exists() or not meta_file.exists():
+            return False
+        try:
+            meta = json.loads(meta_file.read_text())
+        except ValueError:
+            return False
+        return meta.get("fingerprint") == self.fingerprint(name)
+
+    def get(self, name: str):
+        """
+        Get the output of a stage, from memory, from disk or by computing it.
+
+        Args:
+            name (str): Name of the stage.
+
+        Returns:
+            The output of the stage.
+        """
+        if name in self._values:
+            return self._values[name]
+        spec = self._spec(name)
+        data_file, meta_file = self._paths(name)
+        if self.is_valid(name):
+            try:
+                with open(data_file, "rb") as f:
+                    self._values[name] = pickle.load(f)
+                self.loaded.append(name)
+                return self._values[name]
+            except (OSError, EOFError, pickle.UnpicklingError, AttributeError) as e:
+                warnings.warn(
+                    f"Recomputing stage '{name}': stored output unreadable ({e})"
+                )
+
+        arguments = [self.get(stage) for stage in spec["inputs"]]
+        with profile_stage(name):
+            value = spec["function"](*arguments)
+        self._values[name] = value
+        self.computed.append(name)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_file = data_file.with_name(data_file.name + ".tmp")
+            with open(tmp_file, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, data_file)
+            meta_file.write_text(
+                json.dumps(
+                    {"fingerprint": self.fingerprint(name), "inputs": spec["inputs"]}
+                )
+            )
+        except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+            warnings.warn(f"Could not persist stage '{name}': {e}")
+        return value
+
+    def status(self) -> pd.DataFrame:
+        """
+        Get the state of every registered stage without computing anything.
+
+        Returns:
+            pd.DataFrame: Columns stage, inputs and valid.
+        """
+        return pd.DataFrame(
+            {
+                "stage": list(self._stages),
+                "inputs": [",".join(spec["inputs"]) for spec in self._stages.values()],
+                "valid": [self.is_valid(name) for name in self._stages],
+            }
+        )
+
+
+# -- Result writers --
+@contextmanager
+def atomic_output(path, binary: bool = False, compress: Optional[str] = None):
+    """
+    Open a result file for writing so that it only appears once it is complete.
+
+    Everything is written to a temporary file next to path, which replaces path
+    when the block ends without an error (and is deleted otherwise), so readers
+    never see a half-written result.
+
+    Args:
+        path (str or Path): The result file.
+        binary (bool): Yield a binary instead of a text file. Defaults to False.
+        compress (Optional[str]): "gzip" to compress, None for plain files.
+                                  Defaults to gzip for paths ending in ".gz".
+
+    Yields:
+        The open file object.
+
+    Raises:
+        ValueError: If compress is not None or "gzip".
+
+    Examples:
+        >>> import tempfile
+        >>> path = Path(tempfile.mkdtemp()) / 'ids.txt.gz'
+        >>> with atomic_output(path) as f:
+        ...     _ = f.write('9606.ENSP1')
+        >>> gzip.open(path, 'rt').read()
+        '9606.ENSP1'
+    """
+    path = Path(path)
+    if compress is None and path.suffix == ".gz":
+        compress = "gzip"
+    if compress not in (None, "gzip"):
+        raise ValueError(f"Unknown compression '{compress}'. Use None or 'gzip'.")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(path.name + ".tmp")
+    try:
+        with open(tmp_file, "wb") as raw:
+            stream = raw
+            if compress == "gzip":
+                # fixed header (name, no timestamp) so identical results give identical files
+                stream = gzip.GzipFile(
+                    filename=path.name[: -len(".gz")], mode="wb", fileobj=raw, mtime=0
+                )
+            with stream:
+                if binary:
+                    yield stream
+                else:
+                    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+                    yield text
+                    text.flush()
+                    text.detach()
+        os.replace(tmp_file, path)
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
+
+
+def write_lines(
+    path, lines: Iterable[str], batch_lines: int = 65536, compress: Optional[str] = None
+) -> int:
+    """
+    Stream lines to a result file in buffered batches, atomically.
+
+    Lines are separated by newlines, without a newline after the last one (like
+    the files in results/), and only batch_lines of them are joined at a time.
+
+    Args:
+        path (str or Path): The result file, gzip-compressed if it ends in ".gz".
+        lines (Iterable[str]): The lines, e.g. a generator or an array of IDs.
+        batch_lines (int): Lines joined per write. Defaults to 65536.
+        compress (Optional[str]): See atomic_output.
+
+    Returns:
+        int: Number of lines written.
+
+    Examples:
+        >>> import tempfile
+        >>> path = Path(tempfile.mkdtemp()) / 'ids.txt'
+        >>> write_lines(path, (f'OG{i}' for i in range(3)), batch_lines=2)
+        3
+        >>> path.read_text()
+        'OG0\\nOG1\\nOG2'
+    """
+    n_lines = 0
+    iterator = iter(lines)
+    with atomic_output(path, compress=compress) as f:
+        while True:
+            batch = [str(line) for line in itertools.islice(iterator, batch_lines)]
+            if not batch:
+                break
+            if n_lines:
+                f.write("\n")
+            f.write("\n".join(batch))
+            n_lines += len(batch)
+    return n_lines
+
+
+def write_table(
+    path,
+    table,
+    sep: str = "\t",
+    batch_rows: int = 100000,
+    compress: Optional[str] = None,
+    **to_csv_kwargs,
+) -> int:
+    """
+    Stream a table to a result file in batches of rows, atomically.
+
+    The format follows the file name: ".parquet" writes the binary columnar
+    parquet format (needs pyarrow) one row group per batch, anything else is
+    delimited text (gzip-compressed for ".gz") written with DataFrame.to_csv,
+    the header only once. Text output is identical to a single to_csv call.
+
+    Args:
+        path (str or Path): The result file.
+        table (pd.DataFrame or Iterable[pd.DataFrame]): The table, or its parts
+                                                         with equal columns.
+        sep (str): Column separator of text files. Defaults to tab.
+        batch_rows (int): Rows per write of a DataFrame. Defaults to 100000.
+        compress (Optional[str]): See atomic_output; ignored for parquet.
+        **to_csv_kwargs: Passed to DataFrame.to_csv, e.g. index=False.
+
+    Returns:
+        int: Number of rows written.
+
+    Raises:
+        ImportError: If a parquet file is requested and pyarrow is not installed.
+
+    Examples:
+        >>> import tempfile
+        >>> path = Path(tempfile.mkdtemp()) / 'ogs.tsv'
+        >>> df = pd.DataFrame({'orthologous_group_id': ['OG1', 'OG2', 'OG3'],
+        ...                    'actual_sp_count': [161, 160, 161]})
+        >>> write_table(path, df, index=False, batch_rows=2)
+        3
+        >>> path.read_text() == df.to_csv(sep='\\t', index=False)
+        True
+    """
+    path = Path(path)
+    if isinstance(table, pd.DataFrame):
+        parts = (
+            table.iloc[start : start + batch_rows]
+            for start in range(0, max(len(table), 1), batch_rows)
+        )
+    else:
+        parts = iter(table)
+
+    n_rows = 0
+    if path.suffix == ".parquet":
+        if not _parquet_available():
+            raise ImportError(
+                "Writing parquet files requires pyarrow. Run: pip install pyarrow"
+            )
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        with atomic_output(path, binary=True) as f:
+            writer = None
+            for part in parts:
+                batch = pa.Table.from_pandas(
+                    part, preserve_index=to_csv_kwargs.get("index", True)
+                )
+                if writer is None:
+                    writer = pq.ParquetWriter(f, batch.schema)
+                writer.write_table(batch)
+                n_rows += len(part)
+            if writer is not None:
+                writer.close()
+        return n_rows
+
+    with atomic_output(path, compress=compress) as f:
+        header = to_csv_kwargs.pop("header", True)
+        for part in parts:
+            part.to_csv(f, sep=sep, header=header, **to_csv_kwargs)
+            header = False
+            n_rows += len(part)
+    return n_rows
+
+
+class ResultWriter:
+    """
+    Writes result files on a background thread while the analysis continues.
+
+    Each write (write_lines, write_table or any function) is queued to a single
+    worker thread and runs atomically, so results never appear half-written. The
+    data handed over must not be modified afterwards. close() (or leaving the
+    with block) waits for all writes, re-raises the first error and only then
+    prints the messages queued with announce().
+
+    Args:
+        workers (int): Number of writer threads. Defaults to 1.
+        output_format (Optional[str]): None to write the paths as given, "gzip"
+                                       to gzip-compress every file (".gz" is
+                                       appended) or "parquet" to write tables as
+                                       parquet (suffix ".parquet"; ID lists and
+                                       texts stay plain text).
+
+    Raises:
+        ValueError: If output_format is not None, "gzip" or "parquet".
+
+    Examples:
+        >>> import tempfile
+        >>> directory = Path(tempfile.mkdtemp())
+        >>> with ResultWriter() as writer:
+        ...     _ = writer.lines(directory / 'ids.txt', ['9606.ENSP1', '9598.ENSP2'])
+        ...     _ = writer.text(directory / 'summary.txt', 'done')
+        ...     writer.announce('IDs saved')
+        IDs saved
+        >>> sorted(writer.written)
+        ['ids.txt', 'summary.txt']
+        >>> writer = ResultWriter(output_format='gzip')
+        >>> writer.output_path('results/3_universal_ogs.tsv', table=True)
+        'results/3_universal_ogs.tsv.gz'
+        >>> ResultWriter(output_format='parquet').output_path('results/ogs.tsv', table=True)
+        'results/ogs.parquet'
+    """
+
+    FORMATS = (None, "gzip", "parquet")
+
+    def __init__(self, workers: int = 1, output_format: Optional[str] = None):
+        if output_format not in self.FORMATS:
+            raise ValueError(
+                f"Unknown output format '{output_format}'. "
+                "Use None, 'gzip' or 'parquet'."
+            )
+        self.output_format = output_format
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="result-writer"
+        )
+        self._pending = []
+        self._messages = []
+        self.written = []
+
+    def __enter__(self) -> "ResultWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(wait=True)
+
+    def output_path(self, path, table: bool = False) -> str:
+        """
+        Get the file a result path is written to in the output format.
+
+        Args:
+            path (str or Path): The result path, e.g. "results/3_universal_ogs.tsv".
+            table (bool): Whether the result is a table (written as parquet in the
+                          "parquet" format). Defaults to False.
+
+        Returns:
+            str: The path with the suffix of the output format.
+        """
+        path = str(path)
+        if self.output_format == "gzip" and not path.endswith(".gz"):
+            return path + ".gz"
+        if self.output_format == "parquet" and table:
+            return str(Path(path).with_suffix(".parquet"))
+        return path
+
+    def submit(self, path, function: Callable, *args, **kwargs):
+        """Queue function(path, *args, **kwargs) and return its Future."""
+
+        def run():
+            result = function(path, *args, **kwargs)
+            self.written.append(Path(path).name)
+            return result
+
+        future = self._pool.submit(run)
+        self._pending.append(future)
+        return future
+
+    def lines(self, path, lines: Iterable[str], **kwargs):
+        """Queue write_lines(path, lines, **kwargs) to the output path."""
+        return self.submit(self.output_path(path), write_lines, lines, **kwargs)
+
+    def table(self, path, table, **kwargs):
+        """Queue write_table(path, table, **kwargs) to the output path."""
+        return self.submit(
+            self.output_path(path, table=True), write_table, table, **kwargs
+        )
+
+    def text(self, path, text: str, **kwargs):
+        """Queue writing one string to the output path, atomically."""
+
+        def write_text(path, text, compress=None):
+            with atomic_output(path, compress=compress) as f:
+                f.write(text)
+
+        return self.submit(self.output_path(path), write_text, text, **kwargs)
+
+    def announce(self, message: str):
+        """Queue a message printed by close() once all writes have succeeded."""
+        self._messages.append(message)
+
+    def close(self, wait: bool = True):
+        """Wait for all queued writes, raise the first error or print the messages."""
+        self._pool.shutdown(wait=wait)
+        pending, self._pending = self._pending, []
+        messages, self._messages = self._messages, []
+        for future in pending:
+            future.result()
+        for message in messages:
+            print(message)
+
+
+# -- Phylogenetic profile similarity --
+PROFILE_INDEX_DIR = CACHE_DIR / "profile_index"
+
+
+def _bit_count(words: np.ndarray) -> np.ndarray:
+    """Number of set bits of every element of a uint64 array."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    # NumPy < 2.0
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    as_bytes = np.ascontiguousarray(words).view(np.uint8)
+    return table[as_bytes].reshape(*words.shape, 8).sum(axis=-1, dtype=np.uint8)
+
+
+def _minhash_signatures(
+    bits: np.ndarray, n_species: int, n_hashes: int, seed: int, block_rows: int = 4096
+) -> np.ndarray:
+    """
+    MinHash signatures of packed species sets: for every one of n_hashes random
+    hash functions over the species columns, the smallest hash value of the
+    species present (2**32 - 1 for OGs without species).
+    """
+    rng = np.random.default_rng(seed)
+    # random universal hashes (a * column + b) mod p of the species columns
+    prime = np.uint64(4294967311)
+    a = rng.integers(1, 2**32, size=(n_hashes, 1), dtype=np.uint64)
+    b = rng.integers(0, 2**32, size=(n_hashes, 1), dtype=np.uint64)
+    columns = np.arange(n_species, dtype=np.uint64)[None, :]
+    values = ((a * columns + b) % prime).astype(np.uint32)  # n_hashes x n_species
+    empty = np.uint32(np.iinfo(np.uint32).max)
+
+    signatures = np.empty((len(bits), n_hashes), dtype=np.uint32)
+    for start in range(0, len(bits), block_rows):
+        present = np.unpackbits(
+            bits[start : start + block_rows].view(np.uint8),
+            axis=1,
+            count=n_species,
+        ).astype(bool)
+        for j in range(n_hashes):
+            signatures[start : start + block_rows, j] = np.where(
+                present, values[j], empty
+            ).min(axis=1, initial=empty)
+    return signatures
+
+
+class ProfileIndex:
+    """
+    Similarity index over the phylogenetic profiles (species sets) of all OGs.
+
+    Every OG's species set is a packed bitset (one bit per species, uint64 words),
+    so the Jaccard similarity |A & B| / |A | B| of two OGs is a popcount of AND-ed
+    words. Exact searches scan all OGs in blocks; the approximate mode only scores
+    the candidates sharing a locality-sensitive hashing (LSH) bucket: the MinHash
+    signature of every OG is cut into bands, and OGs whose signatures agree in all
+    values of a band share that band's bucket. Built with build_profile_index,
+    stored with save() and opened memory-mapped with load_profile_index().
+
+    Attributes:
+        og_ids (np.ndarray): Orthologous group IDs, one per row.
+        taxids (np.ndarray): Species taxids, one per bit.
+        bits (np.ndarray): uint64 array of shape (len(og_ids), words per profile).
+        sizes (np.ndarray): Number of species per OG.
+        signatures (np.ndarray): uint32 MinHash signatures, one row per OG.
+        band_keys (np.ndarray): Sorted bucket keys per band, shape (bands, len(og_ids)).
+        band_rows (np.ndarray): OG rows in the order of band_keys.
+    """
+
+    def __init__(
+        self,
+        og_ids: np.ndarray,
+        taxids: np.ndarray,
+        bits: np.ndarray,
+        sizes: np.ndarray,
+        signatures: np.ndarray,
+        band_keys: np.ndarray,
+        band_rows: np.ndarray,
+    ):
+        self.og_ids = og_ids
+        self.taxids = taxids
+        self.bits = bits
+        self.sizes = sizes
+        self.signatures = signatures
+        self.band_keys = band_keys
+        self.band_rows = band_rows
+        self._row = None
+
+    def __len__(self) -> int:
+        return len(self.og_ids)
+
+    def __repr__(self) -> str:
+        return (
+            f"ProfileIndex({len(self)} OGs x {len(self.taxids)} species, "
+            f"{len(self.band_keys)} LSH bands)"
+        )
+
+    def row(self, og_id: str) -> int:
+        """
+        Get the row of an orthologous group.
+
+        Raises:
+            ValueError: If the OG is not in the index.
+        """
+        if self._row is None:
+            ids = np.asarray(self.og_ids)
+            if ids.dtype.kind == "S":
+                ids = np.char.decode(ids)
+            self._row = {str(og): i for i, og in enumerate(ids.tolist())}
+        row = self._row.get(str(og_id))
+        if row is None:
+            raise ValueError(f"Orthologous group '{og_id}' not found in index.")
+        return row
+
+    def _og_id(self, rows: np.ndarray) -> np.ndarray:
+        ids = np.asarray(self.og_ids)[rows]
+        return np.char.decode(ids) if ids.dtype.kind == "S" else ids
+
+    def jaccard(
+        self, query: np.ndarray, rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Jaccard similarity of query profiles to the profiles of some or all OGs.
+
+        Args:
+            query (np.ndarray): Rows of the query OGs.
+            rows (Optional[np.ndarray]): Rows to compare to. Defaults to all OGs.
+
+        Returns:
+            np.ndarray: float32 array of shape (len(query), len(rows)); 0 where
+                        both OGs have no species.
+        """
+        query = np.asarray(query, dtype=np.int64)
+        bits = self.bits if rows is None else self.bits[rows]
+        sizes = self.sizes if rows is None else self.sizes[rows]
+        # per-pair counts fit the smallest type holding the number of species
+        shared = np.zeros(
+            (len(query), len(bits)), dtype=np.min_scalar_type(len(self.taxids))
+        )
+        for word in range(self.bits.shape[1]):
+            shared += _bit_count(self.bits[query, word][:, None] & bits[None, :, word])
+        shared = shared.astype(np.float32)
+        union = (
+            self.sizes[query].astype(np.float32)[:, None]
+            + sizes.astype(np.float32)[None, :]
+            - shared
+        )
+        return np.divide(shared, union, out=np.zeros_like(shared), where=union > 0)
+
+    def candidates(self, row: int) -> np.ndarray:
+        """
+        Get the rows sharing at least one LSH bucket with an OG (itself excluded).
+
+        Args:
+            row (int): Row of the query OG.
+
+        Returns:
+            np.ndarray: Sorted candidate rows.
+        """
+        query_keys = _band_keys(self.signatures[row : row + 1], len(self.band_keys))
+        found = []
+        for band, keys in enumerate(self.band_keys):
+            start = np.searchsorted(keys, query_keys[band, 0], side="left")
+            end = np.searchsorted(keys, query_keys[band, 0], side="right")
+            found.append(np.asarray(self.band_rows[band, start:end], dtype=np.int64))
+        rows = np.sort(np.concatenate(found)) if found else np.zeros(0, np.int64)
+        keep = np.ones(len(rows), dtype=bool)
+        keep[1:] = rows[1:] != rows[:-1]
+        rows = rows[keep]
+        return rows[rows != row]
+
+    def similar_ogs(
+        self, og_id: str, k: int = 10, approximate: bool = False
+    ) -> pd.DataFrame:
+        """
+        Get the k OGs with the most similar phylogenetic profile to an OG.
+
+        Args:
+            og_id (str): The query orthologous group.
+            k (int): Number of neighbours. Defaults to 10.
+            approximate (bool): Only score the OGs sharing an LSH bucket with the
+                                query (fast on very large indexes, may miss
+                                neighbours of low similarity). Defaults to False
+                                (exact scan of all OGs).
+
+        Returns:
+            pd.DataFrame: Columns orthologous_group_id and jaccard, most similar
+                          first (ties in row order), without the query itself.
+
+        Raises:
+            ValueError: If the OG is not in the index.
+
+        Examples:
+            >>> pm = PresenceMatrix(['OG1', 'OG2', 'OG3', 'OG4'], [7955, 9598, 9606, 10090],
+            ...                     np.array([[1, 1, 1, 1], [1, 1, 1, 0], [0, 0, 1, 1], [1, 1, 1, 0]],
+            ...                              dtype=bool))
+            >>> index = build_profile_index(pm, n_hashes=8, bands=4)
+            >>> index.similar_ogs('OG2', k=2)
+              orthologous_group_id  jaccard
+            0                  OG4     1.00
+            1                  OG1     0.75
+            >>> index.similar_ogs('OG2', k=1, approximate=True)
+              orthologous_group_id  jaccard
+            0                  OG4      1.0
+        """
+        row = self.row(og_id)
+        if approximate:
+            rows = self.candidates(row)
+        else:
+            rows = np.arange(len(self))
+            rows = rows[rows != row]
+        similarity = self.jaccard([row], rows)[0]
+        # rows are sorted, so a stable sort keeps ties in row order
+        order = np.argsort(-similarity, kind="stable")[:k]
+        return pd.DataFrame(
+            {
+                "orthologous_group_id": self._og_id(rows[order]),
+                "jaccard": similarity[order],
+            }
+        )
+
+    def top_k(
+        self,
+        k: int = 10,
+        og_ids: Optional[Iterable[str]] = None,
+        block_rows: int = 128,
+        workers: Optional[int] = None,
+    ) -> pd.DataFrame:
+        """
+        Exact k most similar OGs of many query OGs, by blocked popcount.
+
+        The queries are scored against all OGs block by block (block_rows x all
+        OGs per step), on a thread pool (NumPy releases the GIL in the popcount).
+
+        Args:
+            k (int): Neighbours per OG. Defaults to 10.
+            og_ids (Optional[Iterable[str]]): Query OGs. Defaults to all OGs
+                                              (quadratic in the number of OGs).
+            block_rows (int): Query OGs per block. Defaults to 128.
+            workers (Optional[int]): Number of threads. Defaults to os.cpu_count().
+
+        Returns:
+            pd.DataFrame: Columns orthologous_group_id, rank (1 = most similar),
+                          neighbour_og_id and jaccard.
+
+        Examples:
+            >>> pm = PresenceMatrix(['OG1', 'OG2', 'OG3'], [9598, 9606, 10090],
+            ...                     np.array([[1, 1, 1], [1, 1, 0], [0, 0, 1]], dtype=bool))
+            >>> build_profile_index(pm, n_hashes=4, bands=2).top_k(k=1)
+              orthologous_group_id  rank neighbour_og_id   jaccard
+            0                  OG1     1             OG2  0.666667
+            1                  OG2     1             OG1  0.666667
+            2                  OG3     1             OG1  0.333333
+        """
+        queries = (
+            np.arange(len(self))
+            if og_ids is None
+            else np.array([self.row(og) for og in og_ids], dtype=np.int64)
+        )
+        k = min(k, len(self) - 1)
+
+        def block_top_k(start: int) -> Tuple[np.ndarray, np.ndarray]:
+            rows = queries[start : start + block_rows]
+            similarity = self.jaccard(rows)
+            # most similar first, ties in row order: one integer key per pair
+            # (quantized dissimilarity, then row) lets np.partition pick the top k
+            quantized = np.rint((1.0 - similarity.astype(np.float64)) * 2**30)
+            keys = (quantized.astype(np.int64) << 32) | np.arange(len(self))
+            keys[np.arange(len(rows)), rows] = np.iinfo(np.int64).max
+            if k < len(self):
+                keys = np.partition(keys, k - 1, axis=1)[:, :k]
+            keys.sort(axis=1)
+            order = keys & 0xFFFFFFFF
+            return order, np.take_along_axis(similarity, order, axis=1)
+
+        starts = range(0, len(queries), block_rows)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers > 1 and len(starts) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(starts))) as pool:
+                parts = list(pool.map(block_top_k, starts))
+        else:
+            parts = [block_top_k(start) for start in starts]
+        neighbours = np.concatenate([p[0] for p in parts] or [np.zeros((0, k), int)])
+        similarity = np.concatenate([p[1] for p in parts] or [np.zeros((0, k))])
+        return pd.DataFrame(
+            {
+                "orthologous_group_id": np.repeat(self._og_id(queries), k),
+                "rank": np.tile(np.arange(1, k + 1), len(queries)),
+                "neighbour_og_id": self._og_id(neighbours.ravel()),
+                "jaccard": similarity.ravel(),
+            }
+        )
+
+    def save(self, directory: Path = PROFILE_INDEX_DIR):
+        """Store the index as .npy files in directory (see load_profile_index)."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        og_ids = np.asarray(self.og_ids)
+        if og_ids.dtype.kind != "S":
+            og_ids = np.array([str(og).encode() for og in og_ids], dtype=bytes)
+        for name, array in (
+            ("og_ids", og_ids),
+            ("taxids", np.asarray(self.taxids, dtype=np.int64)),
+            ("bits", self.bits),
+            ("sizes", self.sizes),
+            ("signatures", self.signatures),
+            ("band_keys", self.band_keys),
+            ("band_rows", self.band_rows),
+        ):
+            tmp_file = directory / f"{name}.tmp.npy"
+            np.save(tmp_file, array)
+            os.replace(tmp_file, directory / f"{name}.npy")
+
+
+def _band_keys(signatures: np.ndarray, bands: int) -> np.ndarray:
+    """Bucket key of every band of the MinHash signatures, shape (bands, rows)."""
+    width = signatures.shape[1] // bands
+    rng = np.random.default_rng(width)
+    multipliers = rng.integers(1, 2**63, size=width, dtype=np.uint64) | np.uint64(1)
+    keys = np.empty((bands, len(signatures)), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for band in range(bands):
+            values = signatures[:, band * width : (band + 1) * width].astype(np.uint64)
+            keys[band] = (values * multipliers).sum(axis=1, dtype=np.uint64)
+    return keys
+
+
+@profiled
+def build_profile_index(
+    presence: PresenceMatrix, n_hashes: int = 64, bands: int = 16, seed: int = 0
+) -> ProfileIndex:
+    """
+    Build the phylogenetic profile similarity index from the presence matrix.
+
+    Args:
+        presence (PresenceMatrix): OG x species presence matrix.
+        n_hashes (int): MinHash values per OG. Defaults to 64.
+        bands (int): LSH bands; n_hashes must be a multiple. More bands (fewer
+                     values per band) find neighbours of lower similarity, at the
+                     cost of more candidates. Defaults to 16.
+        seed (int): Seed of the MinHash functions. Defaults to 0.
+
+    Returns:
+        ProfileIndex: The index.
+
+    Raises:
+        ValueError: If n_hashes is not a multiple of bands.
+    """
+    if bands < 1 or n_hashes % bands:
+        raise ValueError(
+            f"n_hashes ({n_hashes}) must be a positive multiple of bands ({bands})."
+        )
+    n_ogs, n_species = presence.matrix.shape
+    packed = np.packbits(presence.matrix, axis=1)
+    n_words = max((packed.shape[1] + 7) // 8, 1)
+    padded = np.zeros((n_ogs, n_words * 8), dtype=np.uint8)
+    padded[:, : packed.shape[1]] = packed
+    bits = padded.view(np.uint64)
+    signatures = _minhash_signatures(bits, n_species, n_hashes, seed)
+    keys = _band_keys(signatures, bands)
+    band_rows = np.argsort(keys, axis=1, kind="stable")
+    return ProfileIndex(
+        presence.og_ids,
+        presence.taxids,
+        bits,
+        presence.matrix.sum(axis=1),
+        signatures,
+        np.take_along_axis(keys, band_rows, axis=1),
+        band_rows.astype(np.int32),
+    )
+
+
+def load_profile_index(directory: Path = PROFILE_INDEX_DIR) -> ProfileIndex:
+    """
+    Open a phylogenetic profile index (see ProfileIndex.save) memory-mapped.
+
+    Args:
+        directory (Path): Directory of the index files. Defaults to data/cache/profile_index.
+
+    Returns:
+        ProfileIndex: The index.
+
+    Raises:
+        FileNotFoundError: If the index was not saved yet.
+    """
+    directory = Path(directory)
+    names = (
+        "og_ids",
+        "taxids",
+        "bits",
+        "sizes",
+        "signatures",
+        "band_keys",
+        "band_rows",
+    )
+    try:
+        arrays = [np.load(directory / f"{name}.npy", mmap_mode="r") for name in names]
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            f"Profile index not found in '{directory}'. "
+            "Build it with build_profile_index() and save it with ProfileIndex.save()."
+        )
+    return ProfileIndex(*arrays)
+
+
+# -- Shared-memory data store --
+@dataclass(frozen=True)
+class SharedArraysHandle:
+    """
+    Picklable reference to SharedArrays: pass it to worker processes (it is a few
+    names and shapes) and attach() there to map the arrays without copying them.
+
+    Attributes:
+        specs (Tuple[Tuple[str, str, Tuple[int, ...], str], ...]): Per array its
+            name, dtype, shape and shared memory segment (or .npy file) name.
+        directory (Optional[str]): Directory of the .npy files, None for shared memory.
+    """
+
+    specs: Tuple[Tuple[str, str, Tuple[int, ...], str], ...]
+    directory: Optional[str] = None
+
+    def attach(self) -> "SharedArrays":
+        """Map the arrays read-only into this process, without copying."""
+        arrays, segments = {}, []
+        for name, dtype, shape, location in self.specs:
+            if self.directory is not None:
+                arrays[name] = np.load(
+                    os.path.join(self.directory, location), mmap_mode="r"
+                )
+                continue
+            segment = _open_shared_memory(location)
+            segments.append(segment)
+            array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+            array.flags.writeable = False
+            arrays[name] = array
+        return SharedArrays(arrays, segments, self, owner=False)
+
+
+def _open_shared_memory(name: str):
+    from multiprocessing import shared_memory
+
+    try:
+        # Python >= 3.13: attaching processes must not unlink the segment on exit
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedArrays:
+    """
+    Named NumPy arrays in shared memory (or memory-mapped .npy files) that worker
+    processes attach to by handle instead of receiving pickled copies.
+
+    The creating process owns the data: close() (or leaving the with block)
+    releases the shared memory. Attached copies (SharedArraysHandle.attach) are
+    read-only views and only unmap on close(). The arrays are only valid while
+    their SharedArrays is open and referenced, so objects built on them (e.g. by
+    attach_presence_matrix) keep a reference to it.
+
+    Examples:
+        >>> with SharedArrays.create({"counts": np.arange(4)}) as shared:
+        ...     attached = shared.handle.attach()
+        ...     attached["counts"].tolist(), attached["counts"].flags.writeable
+        ([0, 1, 2, 3], False)
+        >>> attached.close()
+    """
+
+    def __init__(
+        self,
+        arrays: Dict[str, np.ndarray],
+        segments: list,
+        handle: SharedArraysHandle,
+        owner: bool,
+    ):
+        self.arrays = arrays
+        self.handle = handle
+        self.owner = owner
+        self._segments = segments
+
+    @classmethod
+    def create(
+        cls, arrays: Dict[str, np.ndarray], directory: Optional[Path] = None
+    ) -> "SharedArrays":
+        """
+        Copy arrays into shared memory once.
+
+        Args:
+            arrays (Dict[str, np.ndarray]): Numeric or fixed-width bytes arrays
+                                            (no Python objects) by name.
+            directory (Optional[Path]): Store the arrays as .npy files in this
+                                        directory and memory-map them instead,
+                                        e.g. to keep them across runs. Defaults
+                                        to None (shared memory).
+
+        Returns:
+            SharedArrays: The owning store.
+
+        Raises:
+            TypeError: If an array holds Python objects.
+        """
+        from multiprocessing import shared_memory
+
+        specs, shared, segments = [], {}, []
+        try:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                if array.dtype.hasobject:
+                    raise TypeError(
+                        f"Array '{name}' holds Python objects and cannot be shared. "
+                        "Encode it first, e.g. strings as bytes (dtype 'S')."
+                    )
+                if directory is not None:
+                    Path(directory).mkdir(parents=True, exist_ok=True)
+                    tmp_file = Path(directory) / f"{name}.tmp.npy"
+                    np.save(tmp_file, array)
+                    os.replace(tmp_file, Path(directory) / f"{name}.npy")
+                    location = f"{name}.npy"
+                    shared[name] = np.load(Path(directory) / location, mmap_mode="r")
+                else:
+                    segment = shared_memory.SharedMemory(
+                        create=True, size=max(array.nbytes, 1)
+                    )
+                    segments.append(segment)
+                    view = np.ndarray(
+                        array.shape, dtype=array.dtype, buffer=segment.buf
+                    )
+                    view[...] = array
+                    location = segment.name
+                    shared[name] = view
+                specs.append((name, array.dtype.str, tuple(array.shape), location))
+        except BaseException:
+            for segment in segments:
+                segment.close()
+                segment.unlink()
+            raise
+        handle = SharedArraysHandle(
+            tuple(specs), None if directory is None else str(directory)
+        )
+        return cls(shared, segments, handle, owner=True)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.arrays
+
+    def __repr__(self) -> str:
+        where = "shared memory" if self.handle.directory is None else "mapped files"
+        return (
+            f"SharedArrays({len(self.arrays)} arrays, "
+            f"{self.nbytes / 2**20:.1f} MB in {where})"
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Total size of the arrays in bytes."""
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def __enter__(self) -> "SharedArrays":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unmap the arrays; the owner also frees the shared memory."""
+        self.arrays = {}
+        for segment in self._segments:
+            segment.close()
+            if self.owner:
+                segment.unlink()
+        self._segments = []
+
+
+# arrays attached by a worker process of map_shared
+_WORKER_ARRAYS: Optional[SharedArrays] = None
+
+
+def _attach_worker_arrays(handle: SharedArraysHandle):
+    global _WORKER_ARRAYS
+    _WORKER_ARRAYS = handle.attach()
+
+
+def _call_with_worker_arrays(function: Callable, item):
+    return function(_WORKER_ARRAYS, item)
+
+
+def map_shared(
+    function: Callable,
+    shared: SharedArrays,
+    items: Iterable,
+    workers: Optional[int] = None,
+) -> list:
+    """
+    Run function(arrays, item) for every item on a process pool whose workers
+    attach the shared arrays once at startup instead of receiving copies.
+
+    Callers running this from a script must guard the script's entry point with
+    ``if __name__ == "__main__":`` (required by multiprocessing on spawn platforms).
+
+    Args:
+        function (Callable): Module level function (picklable) taking the attached
+                             SharedArrays and one item.
+        shared (SharedArrays): The arrays, e.g. from share_presence_matrix.
+        items (Iterable): Work items, e.g. first rows of blocks.
+        workers (Optional[int]): Number of processes. Defaults to os.cpu_count().
+
+    Returns:
+        list: The results, in the order of items.
+    """
+    items = list(items)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(
+        max_workers=max(min(workers, len(items)), 1),
+        initializer=_attach_worker_arrays,
+        initargs=(shared.handle,),
+    ) as pool:
+        return list(
+            pool.map(functools.partial(_call_with_worker_arrays, function), items)
+        )
+
+
+def _encode_labels(values: np.ndarray) -> np.ndarray:
+    # fixed-width bytes can live in shared memory, Python strings cannot
+    return np.array([str(value).encode() for value in values], dtype=bytes)
+
+
+def share_presence_matrix(
+    presence: PresenceMatrix, directory: Optional[Path] = None
+) -> SharedArrays:
+    """
+    Place a presence matrix in shared memory (see attach_presence_matrix).
+
+    Args:
+        presence (PresenceMatrix): The matrix.
+        directory (Optional[Path]): Use memory-mapped files there instead.
+
+    Returns:
+        SharedArrays: Arrays matrix, taxids and og_ids (bytes).
+
+    Examples:
+        >>> pm = PresenceMatrix(['OG1', 'OG2'], [9606, 10090],
+        ...                     np.array([[1, 0], [1, 1]], dtype=bool))
+        >>> with share_presence_matrix(pm) as shared:
+        ...     attached = attach_presence_matrix(shared.handle.attach())
+        ...     attached.og_set([10090])
+        {'OG2'}
+    """
+    return SharedArrays.create(
+        {
+            "matrix": presence.matrix,
+            "taxids": np.asarray(presence.taxids, dtype=np.int64),
+            "og_ids": _encode_labels(presence.og_ids),
+        },
+        directory,
+    )
+
+
+def attach_presence_matrix(shared: SharedArrays) -> PresenceMatrix:
+    """
+    Get a PresenceMatrix over attached shared arrays (see share_presence_matrix).
+    The matrix is not copied; only the OG IDs are decoded to strings.
+    """
+    presence = PresenceMatrix(
+        np.char.decode(shared["og_ids"]).astype(object),
+        shared["taxids"],
+        shared["matrix"],
+    )
+    # the arrays are unmapped when the SharedArrays is garbage collected
+    presence._shared = shared
+    return presence
+
+
+def share_compact_members(
+    compact: CompactMembers, directory: Optional[Path] = None
+) -> SharedArrays:
+    """
+    Place the encoded members table in shared memory (see attach_compact_members):
+    category codes, counts, the protein ID buffer and offsets and the taxid
+    tokens, offsets, codes and copy numbers.
+
+    Args:
+        compact (CompactMembers): The encoded table (see compact_members).
+        directory (Optional[Path]): Use memory-mapped files there instead.
+
+    Returns:
+        SharedArrays: The encoded arrays.
+
+    Examples:
+        >>> compact = compact_members(pd.DataFrame({
+        ...     'evolutionary_level': [33208, 33208], 'orthologous_group_id': ['OG1', 'OG2'],
+        ...     'num_of_proteins': [3, 1], 'num_of_species': [2, 1],
+        ...     'protein_id': ['9606.A,9606.B,10090.C', '562.D'],
+        ...     'species_taxid_containing_protein': ['9606,10090', '562']}), workers=1)
+        >>> with share_compact_members(compact) as shared:
+        ...     attached = attach_compact_members(shared.handle.attach())
+        ...     attached.protein_ids([1]), attached.species(0).tolist()
+        (['562.D'], [9606, 10090])
+    """
+    table = compact.table
+    arrays = {}
+    for column in ("evolutionary_level", "orthologous_group_id"):
+        values = table[column].cat
+        arrays[f"{column}.codes"] = values.codes.to_numpy()
+        arrays[f"{column}.categories"] = _encode_labels(values.categories)
+    for column in ("num_of_proteins", "num_of_species"):
+        arrays[column] = table[column].to_numpy()
+    arrays["protein_buffer"] = compact.protein_buffer
+    arrays["protein_offsets"] = compact.protein_offsets
+    arrays["taxids.tokens"] = np.asarray(compact.taxids.tokens, dtype=np.int64)
+    arrays["taxids.offsets"] = compact.taxids.offsets
+    arrays["taxids.codes"] = compact.taxids.codes
+    if compact.taxids.counts is not None:
+        arrays["taxids.counts"] = compact.taxids.counts
+    return SharedArrays.create(arrays, directory)
+
+
+def attach_compact_members(shared: SharedArrays) -> CompactMembers:
+    """
+    Get CompactMembers over attached shared arrays (see share_compact_members).
+    Counts, protein IDs and taxids are not copied; only the category labels are
+    decoded.
+    """
+    table = pd.DataFrame(
+        {
+            "evolutionary_level": pd.Categorical.from_codes(
+                shared["evolutionary_level.codes"],
+                np.char.decode(shared["evolutionary_level.categories"]).astype(
+                    np.int64
+                ),
+            ),
+            "orthologous_group_id": pd.Categorical.from_codes(
+                shared["orthologous_group_id.codes"],
+                np.char.decode(shared["orthologous_group_id.categories"]),
+            ),
+            "num_of_proteins": shared["num_of_proteins"],
+            "num_of_species": shared["num_of_species"],
+        },
+        copy=False,
+    )
+    compact = CompactMembers(
+        table,
+        shared["protein_buffer"],
+        shared["protein_offsets"],
+        TokenIndex(
+            shared["taxids.tokens"],
+            shared["taxids.offsets"],
+            shared["taxids.codes"],
+            shared["taxids.counts"] if "taxids.counts" in shared else None,
+        ),
+    )
+    # the arrays are unmapped when the SharedArrays is garbage collected
+    compact._shared = shared
+    return compact
@@ -1,5 +1,8 @@
-import eggnog_library as eggnog
-import csv
+import argparse
+from functools import cached_property
+
+# eggnog_library (and with it pandas/numpy) is only imported once an analysis
+# actually runs, so `python main.py --help` and argument errors return immediately
 
 # set up result file directory
 
@@ -8,267 +11,888 @@ result_1B = "results/1_B_unique_protein_IDs.txt"
 result_1C = "results/1_C_functional_category_counts.csv"
 result_detailed_2 = "results/2_detailed_results.txt"
 result_3 = "results/3_universal_ogs.tsv"
+# shared OG counts and Jaccard similarity of all species pairs
+result_shared = "results/species_shared_ogs.tsv"
+result_jaccard = "results/species_jaccard.tsv"
+# OGs lost in every clade of the taxonomy tree
+result_losses = "results/lineage_losses.tsv"
+# copy number analyses: single-copy OGs and paralog expansions
+result_single_copy = "results/single_copy_ogs.tsv"
+result_expanded = "results/primate_expansions.tsv"
+# OGs with the most similar phylogenetic profiles to the 1A homologs
+result_neighbours = "results/profile_neighbours.tsv"
 summary_file = "results/COMPLETE_SUMMARY.txt"
+# stage timings of --profile runs (.json and .tsv)
+profile_prefix = "results/profile"
+# per-level counts of --levels runs
+result_levels = "results/levels_summary.tsv"
+# memory held by the loaded tables, as loaded and in the compact layout
+result_memory = "results/memory_report.tsv"
+
+# analyses selectable on the command line, in the order they are run
+ANALYSES = (
+    "homologs",
+    "categories",
+    "lineage-loss",
+    "universal",
+    "cooccurrence",
+    "loss-scan",
+    "copy-number",
+    "profiles",
+)
 
-# Dataframe setup
-print("Setting up dataframes ...")
-df_annotations = eggnog.dataframe_setup_annotations()
-df_members = eggnog.dataframe_setup_members()
-df_species = eggnog.dataframe_setup_taxid_info()
-df_functional_categories_description = eggnog.dataframe_setup_functional_categories()
+# --output-format: ResultWriter output format of the result files
+OUTPUT_FORMATS = {"text": None, "gzip": "gzip", "parquet": "parquet"}
+
+
+class Tables:
+    """Loads the eggNOG tables and derived structures on first use.
+
+    Every attribute is computed once, when an analysis first asks for it, so a
+    run of e.g. only the universal genes never parses the annotations table.
+    """
+
+    def __init__(self, tax_level=33208):
+        import eggnog_library as eggnog
+
+        self.eggnog = eggnog
+        self.tax_level = tax_level
+
+    # parsed tables are cached in data/cache and rebuilt automatically when the source files change
+    @cached_property
+    def annotations(self):
+        print("Loading annotations ...")
+        return self.eggnog.dataframe_setup_annotations(
+            cache=True, tax_level=self.tax_level
+        )
+
+    # held in the compact layout: categoricals, one protein ID byte buffer and the
+    # taxids parsed once into integer arrays; the pandas table is dropped after encoding
+    @cached_property
+    def members(self):
+        print("Loading members ...")
+        df_members = self.eggnog.dataframe_setup_members(
+            cache=True, tax_level=self.tax_level
+        )
+        print("Parsing TaxIDs of the protein IDs into compact integer arrays ...")
+        return self.eggnog.compact_members(df_members)
+
+    @cached_property
+    def species(self):
+        print("Loading taxid info ...")
+        return self.eggnog.dataframe_setup_taxid_info(cache=True)
+
+    @cached_property
+    def functional_categories(self):
+        return self.eggnog.dataframe_setup_functional_categories()
+
+    # hash-map index for species name <-> taxid lookups and lineages
+    @cached_property
+    def taxonomy(self):
+        return self.eggnog.build_taxonomy_index(self.species)
+
+    # copy numbers and presence both come from the taxids parsed with the members
+    @cached_property
+    def copy_numbers(self):
+        return self.members.copy_number_matrix()
+
+    @cached_property
+    def presence(self):
+        return self.copy_numbers.presence_matrix()
+
+    @cached_property
+    def species_ids(self):
+        # get species ids
+        human_id, chimp_id, mouse_id = self.taxonomy.resolve_names(
+            ["Homo sapiens", "Pan troglodytes", "Mus musculus"]
+        )
+        return {"human": human_id, "chimp": chimp_id, "mouse": mouse_id}
+
+
+def build_queries(tables, analyses):
+    """Returns the eggnog.Query objects needed by the selected analyses."""
+    eggnog = tables.eggnog
+    queries = []
+
+    if "homologs" in analyses or "categories" in analyses:
+        human_id = tables.species_ids["human"]
+        chimp_id = tables.species_ids["chimp"]
+        mouse_id = tables.species_ids["mouse"]
+        queries.append(
+            eggnog.Query("1A", include=[human_id, chimp_id], exclude=[mouse_id])
+        )
+
+    if "homologs" in analyses:
+        # all species under the order Primates, resolved from the taxonomy lineages
+        primate_ids = tables.taxonomy.clade_species(eggnog.PRIMATES_TAXID)
+        queries += [
+            eggnog.Query(
+                "1D", include=[human_id, chimp_id], only_within=[human_id, chimp_id]
+            ),
+            eggnog.Query(
+                "1E",
+                include=[human_id, chimp_id],
+                exclude=[mouse_id],
+                only_within=primate_ids,
+            ),
+        ]
+
+    if "lineage-loss" in analyses:
+        ids = eggnog.IDS_EX2
+        core_groups = [
+            [ids["human"], ids["chimp"]],
+            [ids["chicken"]],
+            [ids["danio"], ids["takifugu"]],
+        ]
+        queries += [
+            eggnog.Query("2_core", include_any=core_groups),
+            eggnog.Query(
+                "2_lost_both",
+                include_any=core_groups,
+                exclude=[ids["mouse"], ids["rat"]],
+            ),
+            eggnog.Query(
+                "2_lost_only_mouse",
+                include_any=core_groups + [[ids["rat"]]],
+                exclude=[ids["mouse"]],
+            ),
+            eggnog.Query(
+                "2_lost_only_rat",
+                include_any=core_groups + [[ids["mouse"]]],
+                exclude=[ids["rat"]],
+            ),
+        ]
+
+    return queries
 
-###----------------------------------------------------------------------
-### 1) A) homologuous genes in humans and chimp but not mouse
 
-# get species ids
-human_id = eggnog.get_species_id_by_name("Homo sapiens", df_species)
-chimp_id = eggnog.get_species_id_by_name("Pan troglodytes", df_species)
-mouse_id = eggnog.get_species_id_by_name("Mus musculus", df_species)
+###----------------------------------------------------------------------
+### Stage graph: every result is persisted in data/cache/pipeline and only
+### recomputed when its input files, parameters, code or upstream stages change
+
+
+def build_pipeline(tables, rebuild=False, workers=1):
+    """Registers the computations of all questions as eggnog.Pipeline stages."""
+    eggnog = tables.eggnog
+    members_file = f"{eggnog.DATA_DIR}/{tables.tax_level}_members.tsv"
+    annotations_file = f"{eggnog.DATA_DIR}/{tables.tax_level}_annotations.tsv"
+    taxid_info_file = f"{eggnog.DATA_DIR}/e5.taxid_info.tsv"
+    categories_file = f"{eggnog.DATA_DIR}/eggnog4.functional_categories.txt"
+    pipeline = eggnog.Pipeline(
+        eggnog.PIPELINE_DIR / str(tables.tax_level), force=rebuild
+    )
 
-# set which species should be included and excluded
-include = [human_id, chimp_id]
-exclude = [mouse_id]
+    def copy_numbers():
+        return tables.copy_numbers
+
+    def presence(copy_numbers):
+        # derived from the copy numbers, the protein IDs are only parsed once
+        return copy_numbers.presence_matrix()
+
+    def answers(presence):
+        # all questions are answered together in a single pass over the presence matrix
+        print("Answering questions 1-3 in one pass over the members data ...")
+        # with several workers the presence matrix is shared, not copied, per process
+        return eggnog.run_queries(
+            build_queries(tables, ANALYSES), presence, workers=workers
+        )
+
+    def q1_homologs(answers):
+        members = tables.members
+        # Scan for homologs within the inclusion list; omit excluded species. Assign return to variable "homologs"
+        print(
+            "Identify homologs in the target species set, filtering out excluded taxa ..."
+        )
+        homologs = answers["1A"].to_numpy()
+
+        print("Extracting unique protein IDs from homologs ...")
+        # decode only the protein IDs of the homolog rows from the compact members
+        unique_protein_ids = (
+            eggnog.pd.Series(members.protein_ids(homologs)).str.strip().unique()
+        )
+        return {
+            "n_homologs": int(homologs.sum()),
+            "unique_protein_ids": list(unique_protein_ids),
+            # 1 D) ortholog genes found only in humans and chimp.
+            "n_only_human_chimp": int(answers["1D"].sum()),
+            # 1 E) ortholog genes found only in primates
+            "n_primate_specific": int(answers["1E"].sum()),
+        }
+
+    def q1_categories(answers):
+        # get functional categories for homologous genes by merging with annotations dataframe on orthologous group id
+        print("Extracting functional categories for homologous genes ...")
+
+        # category strings are encoded once as an OG x category matrix
+        categories = eggnog.build_category_matrix(tables.annotations)
+
+        print("Counting occurrences of each functional category ...")
+
+        homolog_og_ids = answers.index[answers["1A"].to_numpy()]
+        category_counts_df = categories.category_counts(homolog_og_ids)
+
+        return category_counts_df.merge(
+            tables.functional_categories, on="category_code", how="left"
+        )
+
+    def q2_lineage_loss(presence, answers):
+        print("\nAnalyzing lineage conservation and loss...")
+        ids = eggnog.IDS_EX2
+        return {
+            # Retrieve sets
+            "set_sizes": {
+                "Primates": len(presence.og_set([ids["human"], ids["chimp"]])),
+                "Chicken": len(presence.og_set([ids["chicken"]])),
+                "Fish": len(presence.og_set([ids["danio"], ids["takifugu"]])),
+                "Mouse": len(presence.og_set([ids["mouse"]])),
+                "Rat": len(presence.og_set([ids["rat"]])),
+            },
+            # Logic: Core Vertebrate Genes (present in Fish + Birds + Primates)
+            "core": set(answers.index[answers["2_core"]]),
+            # Identify losses in Rodents
+            # (In Core Set) MINUS (Any Rodent)
+            "lost_both": set(answers.index[answers["2_lost_both"]]),
+            # (In Core Set AND In Rat) MINUS (Mouse) -> Lost only in Mouse
+            "lost_only_mouse": set(answers.index[answers["2_lost_only_mouse"]]),
+            # (In Core Set AND In Mouse) MINUS (Rat) -> Lost only in Rat
+            "lost_only_rat": set(answers.index[answers["2_lost_only_rat"]]),
+        }
+
+    def q3_universal(presence):
+        print("\nIdentifying universal animal genes...")
+        # Count species per OG once; the coverage distribution answers any threshold
+        coverage = presence.coverage()
+        mask = coverage.mask(0.99)
+        universal_ogs = eggnog.pd.DataFrame(
+            {
+                "orthologous_group_id": presence.og_ids[mask],
+                "actual_sp_count": coverage.counts[mask],
+            }
+        )
+        return {"coverage": coverage, "universal_ogs": universal_ogs}
+
+    def species_cooccurrence(presence):
+        print("\nComparing the OG sets of all species pairs ...")
+        return eggnog.species_cooccurrence(presence, tables.taxonomy)
+
+    def loss_scan(presence):
+        print("\nScanning all clades of the taxonomy for gene losses ...")
+        return eggnog.lineage_loss_scan(presence, tables.taxonomy)
+
+    def profile_index(presence):
+        print("\nIndexing the phylogenetic profiles of all OGs ...")
+        index = eggnog.build_profile_index(presence)
+        # also kept as memory-mappable files for eggnog.load_profile_index()
+        index.save(eggnog.PROFILE_INDEX_DIR / str(tables.tax_level))
+        return index
+
+    def profile_neighbours(profile_index, answers):
+        print("Searching the most similar profiles of the 1A homologs ...")
+        return profile_index.top_k(k=5, og_ids=answers.index[answers["1A"]])
+
+    pipeline.add("copy_numbers", copy_numbers, sources=[members_file])
+    pipeline.add("presence", presence, inputs=["copy_numbers"])
+    pipeline.add("answers", answers, inputs=["presence"], params=_query_params(tables))
+    pipeline.add("q1_homologs", q1_homologs, inputs=["answers"], sources=[members_file])
+    pipeline.add(
+        "q1_categories",
+        q1_categories,
+        inputs=["answers"],
+        sources=[annotations_file, categories_file],
+    )
+    pipeline.add("q2_lineage_loss", q2_lineage_loss, inputs=["presence", "answers"])
+    pipeline.add("q3_universal", q3_universal, inputs=["presence"])
+    pipeline.add(
+        "species_cooccurrence",
+        species_cooccurrence,
+        inputs=["presence"],
+        sources=[taxid_info_file],
+    )
+    pipeline.add("profile_index", profile_index, inputs=["presence"])
+    pipeline.add(
+        "profile_neighbours",
+        profile_neighbours,
+        inputs=["profile_index", "answers"],
+    )
+    pipeline.add("loss_scan", loss_scan, inputs=["presence"], sources=[taxid_info_file])
+    return pipeline
 
-# Scan for homologs within the inclusion list; omit excluded species. Assign return to variable "homologs"
-print("Identify homologs in the target species set, filtering out excluded taxa ...")
-homologs_df = eggnog.filter_by_ids(
-    df_members, "species_taxid_containing_protein", include, exclude
-)
 
-# output to .txt file
-print("Writing number of homologs to 1_A_homologs.txt file in /results ...")
-with open(result_1A, "w") as f:
-    f.write(
-        f'We identified {len(homologs_df)} homologous genes shared by "{", ".join([eggnog.get_species_name_by_id(n, df_species) for n in include])}" that have diverged or are absent in "{", ".join([eggnog.get_species_name_by_id(n, df_species) for n in exclude])}"'
-    )
+def _query_params(tables):
+    # evaluated only when the fingerprint of the answers is needed
+    return lambda: build_queries(tables, ANALYSES)
 
 
 ###----------------------------------------------------------------------
-### 1) B) extract unique protein IDs from homologs file and
+### QUESTION 1: homologs (1A, 1B, 1D, 1E) and functional categories (1C)
 
-print("Extracting unique protein IDs from homologs ...")
 
-# extract unique protein IDs from homologs dataframe
-unique_protein_ids = (
-    homologs_df["protein_id"].str.split(",").explode().str.strip().unique()
-)
+def run_homologs(tables, pipeline, summary, writer):
+    """1A, 1B, 1D and 1E: homologs in human and chimp but not mouse."""
+    taxonomy = tables.taxonomy
+    result = pipeline.get("q1_homologs")
 
-print("Writing unique protein IDs to 1_B_unique_protein_IDs.txt file in /results ...")
+    ### 1) A) homologuous genes in humans and chimp but not mouse
 
-with open(result_1B, "w") as f:
-    f.write("\n".join(unique_protein_ids))
+    # set which species should be included and excluded
+    include = [tables.species_ids["human"], tables.species_ids["chimp"]]
+    exclude = [tables.species_ids["mouse"]]
 
-###----------------------------------------------------------------------
-### 1) C) functional categories of homologous genes
+    # output to .txt file
+    print("Writing number of homologs to 1_A_homologs.txt file in /results ...")
+    writer.text(
+        result_1A,
+        f'We identified {result["n_homologs"]} homologous genes shared by "{", ".join(taxonomy.resolve_ids(include))}" that have diverged or are absent in "{", ".join(taxonomy.resolve_ids(exclude))}"',
+    )
 
-# get functional categories for homologous genes by merging with annotations dataframe on orthologous group id
-print("Extracting functional categories for homologous genes ...")
+    ### 1) B) extract unique protein IDs from homologs file and
 
-functional_categories_in_homologs = df_annotations[
-    df_annotations["orthologous_group_id"].isin(
-        homologs_df["orthologous_group_id"].tolist()
+    print(
+        "Writing unique protein IDs to 1_B_unique_protein_IDs.txt file in /results ..."
     )
-]["functional_category"]
 
-print("Counting occurrences of each functional category ...")
+    # streamed in batches on the writer thread
+    writer.lines(result_1B, result["unique_protein_ids"])
 
-category_counts_df = (
-    functional_categories_in_homologs.apply(list).explode().value_counts().reset_index()
-)
-category_counts_df.columns = ["category_code", "count"]
+    ### 1) D) ortholog genes found only in humans and chimp.
 
-category_counts_df = category_counts_df.merge(
-    df_functional_categories_description, on="category_code", how="left"
-)
+    print(
+        f"{result['n_only_human_chimp']} ortholog genes are only found in human and chimps"
+    )
 
-print("Exporting result table to results/1_C_functional_category_counts.csv ...")
+    ### 1 E) ortholog genes found only in primates
 
-category_counts_df.to_csv(result_1C, index=False)
+    print(f"{result['n_primate_specific']} ortholog genes are only found in primates.")
 
+    summary["1A"] = result["n_homologs"]
+    summary["1B"] = len(result["unique_protein_ids"])
+    summary["1D"] = result["n_only_human_chimp"]
+    summary["1E"] = result["n_primate_specific"]
 
-###----------------------------------------------------------------------
-### 1) D) ortholog genes found only in humans and chimp.
 
+def run_categories(tables, pipeline, summary, writer):
+    """1C: functional categories of the 1A homologs."""
+    category_counts_df = pipeline.get("q1_categories")
+
+    print("Exporting result table to results/1_C_functional_category_counts.csv ...")
+
+    writer.table(result_1C, category_counts_df, sep=",", index=False)
 
-unique_orth_genes = homologs_df.loc[
-    homologs_df["num_of_species"] == 2,
-    ["orthologous_group_id", "species_taxid_containing_protein"],
-]
-print(f"{len(unique_orth_genes)} ortholog genes are only found in human and chimps")
+    summary["1C"] = category_counts_df
 
 
 ###----------------------------------------------------------------------
-### 1 E) ortholog genes found only in primates
+### QUESTION 2: Lineage Analysis - Primates, Chicken, Fish vs Rodents
 
 
-primate_specific_OG = eggnog.filter_by_species_names(
-    homologs_df, "species_taxid_containing_protein", eggnog.PRIMATES, df_species
-)
-print(f"{len(primate_specific_OG)} ortholog genes are only found in primates.")
+def run_lineage_loss(tables, pipeline, summary, writer):
+    """Question 2: core vertebrate OGs and their losses in mouse and rat."""
+    print("\n" + "=" * 80)
+    print("QUESTION 2: LINEAGE ANALYSIS")
+    print("Orthologs in Primates + Chicken + Fish, checking losses in Rodents")
+    print("=" * 80)
+
+    result = pipeline.get("q2_lineage_loss")
+    core_set = result["core"]
+    lost_both = result["lost_both"]
+    lost_only_mouse = result["lost_only_mouse"]
+    lost_only_rat = result["lost_only_rat"]
+
+    print(f"\n=== SET SIZES ===")
+    for group, size in result["set_sizes"].items():
+        print(f"{group} OGs: {size}")
+
+    print(f"\nCore vertebrate OGs (in Primates + Chicken + Fish): {len(core_set)}")
+    print(f"Lost in BOTH Mouse and Rat: {len(lost_both)}")
+    print(f"Lost ONLY in Mouse: {len(lost_only_mouse)}")
+    print(f"Lost ONLY in Rat: {len(lost_only_rat)}")
+
+    # Save Q2 Results
+
+    writer.text(
+        result_detailed_2,
+        "Evolutionary Analysis: Primates, Chicken, Fish vs Rodents\n"
+        + "=" * 60
+        + "\n"
+        + f"Conserved in Primates+Chicken+Fish: {len(core_set)}\n"
+        + f"Lost in both Mouse and Rat: {len(lost_both)}\n"
+        + f"Lost ONLY in Mouse: {len(lost_only_mouse)}\n"
+        + f"Lost ONLY in Rat: {len(lost_only_rat)}\n"
+        + "\nExample OGs lost in both:\n"
+        + "\n".join(str(og) for og in list(lost_both)[:10]),
+    )
+
+    # printed once the writes have finished
+    writer.announce(f"\n Q2 Results saved to {writer.output_path(result_detailed_2)}")
+
+    summary["2"] = {
+        "core": len(core_set),
+        "lost_both": len(lost_both),
+        "lost_only_mouse": len(lost_only_mouse),
+        "lost_only_rat": len(lost_only_rat),
+    }
+
 
 ###----------------------------------------------------------------------
-### QUESTION 2: Lineage Analysis - Primates, Chicken, Fish vs Rodents
-print("\n" + "=" * 80)
-print("QUESTION 2: LINEAGE ANALYSIS")
-print("Orthologs in Primates + Chicken + Fish, checking losses in Rodents")
-print("=" * 80)
+### QUESTION 3: Universal Genes (99% or more of all animal species)
 
-print("\nCleaning TaxIDs (removing protein suffixes)...")
 
+def run_universal(tables, pipeline, summary, writer):
+    """Question 3: OGs present in at least 99% of all species."""
+    result = pipeline.get("q3_universal")
+    coverage = result["coverage"]
+    universal_ogs = result["universal_ogs"]
+    total_sp_count = coverage.n_species
+    threshold = total_sp_count * 0.99
 
-# Apply the cleaning function
-df_members["clean_taxid_set"] = df_members["species_taxid_containing_protein"].apply(
-    eggnog.clean_taxid_string
-)
+    print(f"Total unique species found in file: {total_sp_count}")
+    print(f"Threshold for universal (99%): {threshold:.2f}")
+    print(coverage.sweep([0.9, 0.95, 0.99, 1.0]).to_string(index=False))
 
-print("Analyzing lineage conservation and loss...")
+    print(f" Found {len(universal_ogs)} universal OGs (99%+ species)")
 
-# Define Target IDs (verified these are standard TaxIDs)
+    # Save Q3 Results
+    writer.table(result_3, universal_ogs, sep="\t", index=False)
 
+    writer.announce(f" Q3 Results saved to {writer.output_path(result_3, table=True)}")
 
-# Retrieve sets
-primates_q2 = eggnog.get_og_set(
-    eggnog.IDS_EX2["human"], df_members
-) | eggnog.get_og_set(eggnog.IDS_EX2["chimp"], df_members)
-chicken = eggnog.get_og_set(eggnog.IDS_EX2["chicken"], df_members)
-fish = eggnog.get_og_set(eggnog.IDS_EX2["danio"], df_members) | eggnog.get_og_set(
-    eggnog.IDS_EX2["takifugu"], df_members
-)
-mouse = eggnog.get_og_set(eggnog.IDS_EX2["mouse"], df_members)
-rat = eggnog.get_og_set(eggnog.IDS_EX2["rat"], df_members)
+    summary["3"] = {"species": total_sp_count, "universal": len(universal_ogs)}
 
-print(f"\n=== SET SIZES ===")
-print(f"Primates OGs: {len(primates_q2)}")
-print(f"Chicken OGs: {len(chicken)}")
-print(f"Fish OGs: {len(fish)}")
-print(f"Mouse OGs: {len(mouse)}")
-print(f"Rat OGs: {len(rat)}")
 
-# Logic: Core Vertebrate Genes (present in Fish + Birds + Primates)
-core_set = primates_q2 & chicken & fish
+###----------------------------------------------------------------------
+### Shared OGs and Jaccard similarity of every species pair
+
+
+def run_cooccurrence(tables, pipeline, summary, writer):
+    """Species x species matrices of shared OGs and Jaccard similarity."""
+    shared, jaccard = pipeline.get("species_cooccurrence")
+
+    # most similar other species of each species
+    similarity = jaccard.to_numpy().copy()
+    similarity.flat[:: len(similarity) + 1] = -1
+    closest = similarity.argmax(axis=1)
+    print(f"Compared {len(shared)} species pairwise, e.g. closest by Jaccard:")
+    for i in range(min(len(shared), 5)):
+        print(
+            f"  {jaccard.index[i]} - {jaccard.columns[closest[i]]}: "
+            f"{similarity[i, closest[i]]:.3f}"
+        )
+
+    writer.table(result_shared, shared, sep="\t")
+    writer.table(result_jaccard, jaccard, sep="\t", float_format="%.6f")
+
+    writer.announce(
+        f" Species co-occurrence saved to {writer.output_path(result_shared, table=True)} "
+        f"and {writer.output_path(result_jaccard, table=True)}"
+    )
 
-# Identify losses in Rodents
-# (In Core Set) MINUS (Any Rodent)
-lost_both = core_set - (mouse | rat)
 
-# (In Core Set AND In Rat) MINUS (Mouse) -> Lost only in Mouse
-lost_only_mouse = (core_set & rat) - mouse
+###----------------------------------------------------------------------
+### Gene losses of every clade (absent in the clade, present in sister and outgroup)
 
-# (In Core Set AND In Mouse) MINUS (Rat) -> Lost only in Rat
-lost_only_rat = (core_set & mouse) - rat
 
-print(f"\nCore vertebrate OGs (in Primates + Chicken + Fish): {len(core_set)}")
-print(f"Lost in BOTH Mouse and Rat: {len(lost_both)}")
-print(f"Lost ONLY in Mouse: {len(lost_only_mouse)}")
-print(f"Lost ONLY in Rat: {len(lost_only_rat)}")
+def run_loss_scan(tables, pipeline, summary, writer):
+    """Dollo-style gene losses of every clade of the taxonomy tree."""
+    scan = pipeline.get("loss_scan")
+    clades = scan.clades
+
+    print(f"Scanned {len(clades)} clades; most losses:")
+    print(
+        clades.nlargest(5, "n_lost")[["clade_name", "n_species", "n_lost"]].to_string(
+            index=False
+        )
+    )
+    for name in ("mouse", "rat"):
+        taxid = tables.eggnog.IDS_EX2[name]
+        print(f"OGs lost in {name}: {len(scan.lost_ogs(taxid))}")
 
-# Save Q2 Results
+    writer.table(result_losses, clades, sep="\t", index=False)
 
-with open(result_detailed_2, "w") as f:
-    f.write("Evolutionary Analysis: Primates, Chicken, Fish vs Rodents\n")
-    f.write("=" * 60 + "\n")
-    f.write(f"Conserved in Primates+Chicken+Fish: {len(core_set)}\n")
-    f.write(f"Lost in both Mouse and Rat: {len(lost_both)}\n")
-    f.write(f"Lost ONLY in Mouse: {len(lost_only_mouse)}\n")
-    f.write(f"Lost ONLY in Rat: {len(lost_only_rat)}\n")
-    f.write(
-        "\nExample OGs lost in both:\n"
-        + "\n".join(str(og) for og in list(lost_both)[:10])
+    writer.announce(
+        f" Gene losses per clade saved to {writer.output_path(result_losses, table=True)}"
     )
 
-print(f"\n Q2 Results saved to {result_detailed_2}")
 
 ###----------------------------------------------------------------------
-### QUESTION 3: Universal Genes (99% or more of all animal species)
+### Copy numbers: single-copy orthologs and paralog expansions
+
+
+def run_copy_number(tables, pipeline, summary, writer):
+    """Single-copy OGs (95% of species) and OGs expanded 3x in primates vs mouse."""
+    eggnog = tables.eggnog
+    copy_numbers = pipeline.get("copy_numbers")
+
+    # single-copy orthologs, the input of phylogenomic analyses
+    single_copy = copy_numbers.single_copy(0.95)
+    print(f"{single_copy.sum()} OGs are single-copy in at least 95% of species")
+    single_copy_df = eggnog.pd.DataFrame(
+        {
+            "orthologous_group_id": copy_numbers.og_ids[single_copy],
+            "mean_copies": copy_numbers.mean_copies(copy_numbers.taxids)[single_copy],
+        }
+    )
+    writer.table(
+        result_single_copy, single_copy_df, sep="\t", index=False, float_format="%.4f"
+    )
+
+    # paralog expansions in primates relative to mouse
+    primate_ids = tables.taxonomy.clade_species(eggnog.PRIMATES_TAXID)
+    mouse_id = [tables.species_ids["mouse"]]
+    expanded = copy_numbers.expanded(primate_ids, mouse_id, fold=3.0)
+    print(f"{expanded.sum()} OGs are expanded at least 3x in primates vs mouse")
+    expanded_df = eggnog.pd.DataFrame(
+        {
+            "orthologous_group_id": copy_numbers.og_ids[expanded],
+            "primate_mean_copies": copy_numbers.mean_copies(primate_ids)[expanded],
+            "mouse_copies": copy_numbers.mean_copies(mouse_id)[expanded],
+        }
+    )
+    writer.table(
+        result_expanded, expanded_df, sep="\t", index=False, float_format="%.4f"
+    )
 
-print("\nIdentifying universal animal genes...")
+    writer.announce(
+        " Copy number results saved to "
+        f"{writer.output_path(result_single_copy, table=True)} and "
+        f"{writer.output_path(result_expanded, table=True)}"
+    )
 
-# 1. Calculate total species count from the data itself
-all_species = set()
-for s in df_members["clean_taxid_set"]:
-    all_species.update(s)
 
-total_sp_count = len(all_species)
-threshold = total_sp_count * 0.99
+###----------------------------------------------------------------------
+### Phylogenetic profiles: OGs with the same presence/absence pattern
+
 
-print(f"Total unique species found in file: {total_sp_count}")
-print(f"Threshold for universal (99%): {threshold:.2f}")
+def run_profiles(tables, pipeline, summary, writer):
+    """Top 5 OGs by profile (species set) Jaccard similarity for every 1A homolog."""
+    neighbours = pipeline.get("profile_neighbours")
+    n_queries = neighbours["orthologous_group_id"].nunique()
+    identical = neighbours.loc[neighbours["jaccard"] == 1.0, "orthologous_group_id"]
 
-# 2. Count species per OG
-df_members["actual_sp_count"] = df_members["clean_taxid_set"].apply(len)
+    print(
+        f"{identical.nunique()} of {n_queries} homolog OGs share their exact "
+        "species set with another OG"
+    )
 
-# 3. Filter
-universal_ogs = df_members[df_members["actual_sp_count"] >= threshold]
+    writer.table(
+        result_neighbours, neighbours, sep="\t", index=False, float_format="%.6f"
+    )
 
-print(f" Found {len(universal_ogs)} universal OGs (99%+ species)")
+    writer.announce(
+        f" Profile neighbours saved to {writer.output_path(result_neighbours, table=True)}"
+    )
 
-# Save Q3 Results
 
-og_col = (
-    "orthologous_group_id" if "orthologous_group_id" in universal_ogs.columns else None
-)
-if og_col:
-    universal_ogs[[og_col, "actual_sp_count"]].to_csv(result_3, sep="\t", index=False)
-else:
-    universal_ogs[["actual_sp_count"]].to_csv(result_3, sep="\t")
+RUNNERS = {
+    "homologs": run_homologs,
+    "categories": run_categories,
+    "lineage-loss": run_lineage_loss,
+    "universal": run_universal,
+    "cooccurrence": run_cooccurrence,
+    "loss-scan": run_loss_scan,
+    "copy-number": run_copy_number,
+    "profiles": run_profiles,
+}
 
-print(f" Q3 Results saved to {result_3}")
 
 ###----------------------------------------------------------------------
 # save files
 
-print("\n" + "=" * 80)
-print("SAVING COMPREHENSIVE SUMMARY")
-print("=" * 80)
-
-
-with open(summary_file, "w") as f:
-    f.write("=" * 80 + "\n")
-    f.write("METAZOAN GENE CONSERVATION AND LOSS ANALYSIS - COMPLETE SUMMARY\n")
-    f.write("Questions 1A-1E, Question 2, and Question 3\n")
-    f.write("=" * 80 + "\n\n")
-
-    f.write("QUESTION 1: PRIMATE-SPECIFIC GENE ANALYSIS\n")
-    f.write("-" * 80 + "\n")
-    f.write(f"1A) Homologs in Human & Chimp but NOT in Mouse: {len(homologs_df)} OGs\n")
-    f.write(f"1B) Unique protein IDs: {len(unique_protein_ids)}\n")
-    f.write(f"1C) Functional categories found: {len(category_counts_df)}\n")
-    f.write(f"    Top 3 categories:\n")
-    for idx, row in category_counts_df.head(3).iterrows():
-        f.write(f"      - {row['category_code']}: {row['count']} genes\n")
-    f.write(f"1D) OGs found ONLY in Human and Chimp: {len(unique_orth_genes)} OGs\n")
-    f.write(f"1E) Primate-specific OGs: {len(primate_specific_OG)} OGs\n\n")
-
-    f.write("QUESTION 2: LINEAGE ANALYSIS\n")
-    f.write("-" * 80 + "\n")
-    f.write(f"Core vertebrate OGs (Primates + Chicken + Fish): {len(core_set)}\n")
-    f.write(f"Lost in BOTH Mouse and Rat: {len(lost_both)}\n")
-    f.write(f"Lost ONLY in Mouse: {len(lost_only_mouse)}\n")
-    f.write(f"Lost ONLY in Rat: {len(lost_only_rat)}\n\n")
-
-    f.write("QUESTION 3: UNIVERSAL ANIMAL GENES\n")
-    f.write("-" * 80 + "\n")
-    f.write(f"Total unique species in dataset: {total_sp_count}\n")
-    f.write(f"Universal OGs (99%+): {len(universal_ogs)}\n\n")
-
-    f.write("=" * 80 + "\n")
-    f.write("RESULT FILES SAVED:\n")
-    f.write("-" * 80 + "\n")
-    f.write("Question 1:\n")
-    f.write("  - results/1_A_homologs.txt\n")
-    f.write("  - results/1_B_unique_protein_IDs.txt\n")
-    f.write("  - results/1_C_functional_category_counts.csv\n")
-    f.write("Question 2:\n")
-    f.write("  - results/2_detailed_results.txt\n")
-    f.write("Question 3:\n")
-    f.write("  - results/3_universal_ogs.tsv\n")
-    f.write("=" * 80 + "\n")
-
-print(f"\n Complete summary saved to: {summary_file}")
-
-print("\n" + "=" * 80)
-print("ALL ANALYSES COMPLETE!")
-print("=" * 80)
-print(f"Main summary: {summary_file}")
-print("All result files saved to: results/")
-print("\n" + "=" * 80)
+
+def write_summary(summary, writer):
+    """Writes COMPLETE_SUMMARY.txt for the analyses that were run (and the files written by writer)."""
+    print("\n" + "=" * 80)
+    print("SAVING COMPREHENSIVE SUMMARY")
+    print("=" * 80)
+
+    question_1 = "1A" in summary or "1C" in summary
+
+    with open(summary_file, "w") as f:
+        f.write("=" * 80 + "\n")
+        f.write("METAZOAN GENE CONSERVATION AND LOSS ANALYSIS - COMPLETE SUMMARY\n")
+        f.write("Questions 1A-1E, Question 2, and Question 3\n")
+        f.write("=" * 80 + "\n\n")
+
+        if question_1:
+            f.write("QUESTION 1: PRIMATE-SPECIFIC GENE ANALYSIS\n")
+            f.write("-" * 80 + "\n")
+        if "1A" in summary:
+            f.write(
+                f"1A) Homologs in Human & Chimp but NOT in Mouse: {summary['1A']} OGs\n"
+            )
+            f.write(f"1B) Unique protein IDs: {summary['1B']}\n")
+        if "1C" in summary:
+            category_counts_df = summary["1C"]
+            f.write(f"1C) Functional categories found: {len(category_counts_df)}\n")
+            f.write(f"    Top 3 categories:\n")
+            for idx, row in category_counts_df.head(3).iterrows():
+                f.write(f"      - {row['category_code']}: {row['count']} genes\n")
+        if "1A" in summary:
+            f.write(f"1D) OGs found ONLY in Human and Chimp: {summary['1D']} OGs\n")
+            f.write(f"1E) Primate-specific OGs: {summary['1E']} OGs\n")
+        if question_1:
+            f.write("\n")
+
+        if "2" in summary:
+            f.write("QUESTION 2: LINEAGE ANALYSIS\n")
+            f.write("-" * 80 + "\n")
+            f.write(
+                f"Core vertebrate OGs (Primates + Chicken + Fish): {summary['2']['core']}\n"
+            )
+            f.write(f"Lost in BOTH Mouse and Rat: {summary['2']['lost_both']}\n")
+            f.write(f"Lost ONLY in Mouse: {summary['2']['lost_only_mouse']}\n")
+            f.write(f"Lost ONLY in Rat: {summary['2']['lost_only_rat']}\n\n")
+
+        if "3" in summary:
+            f.write("QUESTION 3: UNIVERSAL ANIMAL GENES\n")
+            f.write("-" * 80 + "\n")
+            f.write(f"Total unique species in dataset: {summary['3']['species']}\n")
+            f.write(f"Universal OGs (99%+): {summary['3']['universal']}\n\n")
+
+        f.write("=" * 80 + "\n")
+        f.write("RESULT FILES SAVED:\n")
+        f.write("-" * 80 + "\n")
+        if question_1:
+            f.write("Question 1:\n")
+        if "1A" in summary:
+            f.write(f"  - {writer.output_path(result_1A)}\n")
+            f.write(f"  - {writer.output_path(result_1B)}\n")
+        if "1C" in summary:
+            f.write(f"  - {writer.output_path(result_1C, table=True)}\n")
+        if "2" in summary:
+            f.write("Question 2:\n")
+            f.write(f"  - {writer.output_path(result_detailed_2)}\n")
+        if "3" in summary:
+            f.write("Question 3:\n")
+            f.write(f"  - {writer.output_path(result_3, table=True)}\n")
+        f.write("=" * 80 + "\n")
+
+    print(f"\n Complete summary saved to: {summary_file}")
+
+
+def write_memory_report(tables):
+    """Reports the memory of the loaded tables (members are held compact)."""
+    eggnog = tables.eggnog
+    loaded = {}
+    # only tables the analyses already loaded, the report does not load anything
+    if "members" in vars(tables):
+        loaded["members (compact)"] = tables.members
+    if "annotations" in vars(tables):
+        loaded["annotations"] = tables.annotations
+        loaded["annotations (compact)"] = eggnog.compact_annotations(tables.annotations)
+    if "presence" in vars(tables):
+        loaded["presence matrix"] = tables.presence
+    if not loaded:
+        return
+    report = eggnog.memory_report(loaded)
+    report.to_csv(result_memory, sep="\t", index=False)
+    print("\nMemory (MB) per table:")
+    print(report.groupby("table", sort=False)["megabytes"].sum().round(1).to_string())
+    print(f"Memory report saved to {result_memory}")
+
+
+def analyze_levels(tables, args):
+    """Answers the questions' queries on several taxonomic levels in parallel."""
+    print(f"Analyzing taxonomic levels {', '.join(map(str, args.levels))} ...")
+    # the taxonomy is built once here and shared with the worker processes
+    levels_df = tables.eggnog.analyze_levels(
+        args.levels,
+        queries=build_queries(tables, ANALYSES),
+        taxonomy=tables.taxonomy,
+        stream=args.stream or None,
+        max_memory_mb=args.max_memory_mb,
+    )
+    levels_df.to_csv(result_levels, sep="\t", index=False)
+    print(levels_df.to_string(index=False))
+    print(f"\n Level summary saved to {result_levels}")
+
+
+def serve(tables, args):
+    """Keeps the presence matrix, taxonomy and categories in memory and answers queries."""
+    server = tables.eggnog.QueryServer(
+        tables.presence,
+        tables.taxonomy,
+        tables.eggnog.build_category_matrix(tables.annotations),
+    )
+    server.serve_forever(args.host, args.port, args.socket)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Metazoan gene conservation analysis on eggNOG 5 (Metazoa, 33208).",
+        epilog="Without arguments all analyses are run. Tables are only loaded "
+        "when an analysis needs them, e.g. 'universal' never reads the annotations.",
+    )
+    parser.add_argument(
+        "analyses",
+        nargs="*",
+        choices=ANALYSES + ("all",),
+        default="all",
+        help="homologs: 1A, 1B, 1D, 1E; categories: 1C; "
+        "lineage-loss: question 2; universal: question 3; cooccurrence: shared OGs "
+        "and Jaccard similarity of all species pairs; loss-scan: OGs lost in every "
+        "clade of the taxonomy tree; copy-number: single-copy OGs and paralog "
+        "expansions; profiles: OGs with the most similar species sets to the 1A "
+        "homologs (default: all)",
+    )
+    parser.add_argument(
+        "--tax-level",
+        type=int,
+        default=33208,
+        help="eggNOG taxonomic level of the members/annotations files (default: 33208 Metazoa)",
+    )
+    parser.add_argument(
+        "--levels",
+        type=int,
+        nargs="+",
+        metavar="LEVEL",
+        help="instead of the analyses, count the answers to all questions on each of "
+        "these levels (e.g. 7742 40674 2759) in parallel; saved to "
+        "results/levels_summary.tsv",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="with --levels: read every level straight from "
+        "data/zips/<level>_members.tsv.gz in bounded memory instead of loading its "
+        "members table (default: only for levels that are not extracted)",
+    )
+    parser.add_argument(
+        "--max-memory-mb",
+        type=int,
+        default=256,
+        help="with --levels: memory ceiling in MB of the levels streamed at the same "
+        "time, split between the worker processes (default: 256)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes answering the questions in parallel; they attach the "
+        "presence matrix in shared memory instead of copying it (default: 1)",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="recompute all stages instead of reusing the results of earlier runs "
+        "(data/cache/pipeline)",
+    )
+    parser.add_argument(
+        "--memory-report",
+        action="store_true",
+        help="after the analyses, save the memory of the loaded tables (members in "
+        "their compact layout, annotations as loaded and compact) to "
+        "results/memory_report.tsv",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=list(OUTPUT_FORMATS),
+        default="text",
+        help="format of the result files: text (.txt/.csv/.tsv), gzip (the same, "
+        "gzip-compressed with a .gz suffix) or parquet (tables as .parquet, ID lists "
+        "and texts as text) (default: text)",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="load the data once and answer JSON queries (eggnog_library.QueryClient) "
+        "instead of running analyses",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="server interface")
+    parser.add_argument("--port", type=int, default=8765, help="server TCP port")
+    parser.add_argument(
+        "--socket", default=None, help="serve on this Unix socket instead of TCP"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="record wall/CPU time, rows and peak memory of every loader, filter and "
+        "question stage in results/profile.json and results/profile.tsv",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="with --profile: also measure per-stage peaks with tracemalloc (slower)",
+    )
+    parser.add_argument(
+        "--cprofile",
+        action="append",
+        default=[],
+        metavar="STAGE",
+        help="with --profile: run this stage (name as in profile.tsv, e.g. "
+        "build_presence_matrix or universal) under cProfile, "
+        "dumped to results/profile_<STAGE>.prof; can be repeated",
+    )
+    args = parser.parse_args(argv)
+    if "all" in args.analyses:
+        args.analyses = list(ANALYSES)
+    else:
+        # run in the fixed order regardless of the order given on the command line
+        args.analyses = [name for name in ANALYSES if name in args.analyses]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    print("Setting up dataframes ...")
+    tables = Tables(args.tax_level)
+
+    if args.serve:
+        serve(tables, args)
+        return
+    if args.levels:
+        analyze_levels(tables, args)
+        return
+
+    profiler = None
+    if args.profile or args.trace_memory or args.cprofile:
+        # loaders, filters and matrix builders of eggnog_library record themselves
+        eggnog = tables.eggnog
+        hooks = {stage: eggnog.cprofile_hook(profile_prefix) for stage in args.cprofile}
+        profiler = eggnog.enable_profiling(
+            eggnog.StageProfiler(trace_memory=args.trace_memory, hooks=hooks)
+        )
+
+    # results of earlier runs are reused unless their inputs changed (--rebuild: recompute all)
+    pipeline = build_pipeline(tables, rebuild=args.rebuild, workers=args.workers)
+
+    summary = {}
+    # result files are written on a background thread; leaving the block waits for
+    # them and only then reports the saved files
+    with tables.eggnog.ResultWriter(
+        output_format=OUTPUT_FORMATS[args.output_format]
+    ) as writer:
+        for name in args.analyses:
+            with tables.eggnog.profile_stage(name):
+                RUNNERS[name](tables, pipeline, summary, writer)
+
+    print(
+        f"\nPipeline stages recomputed: {', '.join(pipeline.computed) or 'none'}; "
+        f"reused: {', '.join(pipeline.loaded) or 'none'}"
+    )
+
+    write_summary(summary, writer)
+
+    if args.memory_report:
+        write_memory_report(tables)
+
+    if profiler is not None:
+        tables.eggnog.disable_profiling()
+        json_path, tsv_path = profiler.write(profile_prefix)
+        print(f"Stage profile saved to: {json_path} and {tsv_path}")
+        print(
+            profiler.to_dataframe()[
+                ["name", "depth", "wall_seconds", "cpu_seconds", "peak_rss_mb"]
+            ].to_string(index=False)
+        )
+
+    print("\n" + "=" * 80)
+    print("ALL ANALYSES COMPLETE!")
+    print("=" * 80)
+    print(f"Main summary: {summary_file}")
+    print("All result files saved to: results/")
+    print("\n" + "=" * 80)
+
+
+if __name__ == "__main__":
+    main()
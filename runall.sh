@@ -16,8 +16,11 @@ mkdir -p data/zips
 
 echo "Downloading EggNOG data files..."
 
-wget -P data/zips/ http://eggnog5.embl.de/download/eggnog_5.0/per_tax_level/33208/33208_members.tsv.gz 
-wget -P data/zips/ http://eggnog5.embl.de/download/eggnog_5.0/per_tax_level/33208/33208_annotations.tsv.gz
+# further taxonomic levels for "python main.py --levels ...", e.g. TAX_LEVELS="33208 7742 40674" bash runall.sh
+for level in ${TAX_LEVELS:-33208}; do
+    wget -P data/zips/ http://eggnog5.embl.de/download/eggnog_5.0/per_tax_level/${level}/${level}_members.tsv.gz
+    wget -P data/zips/ http://eggnog5.embl.de/download/eggnog_5.0/per_tax_level/${level}/${level}_annotations.tsv.gz
+done
 wget -P data/ http://eggnog5.embl.de/download/eggnog_5.0/e5.taxid_info.tsv
 wget -P data/ http://eggnog5.embl.de/download/eggnog_4.5/eggnog4.functional_categories.txt
 